@@ -0,0 +1,149 @@
+# Lectura de archivos y comprimidos (anidados) desde búferes, sin extraer miembros a disco
+
+import io
+import os
+import tempfile
+import zipfile
+from typing import BinaryIO, Callable, Iterator, Optional, Tuple, Union
+
+from app.config import config, ARCHIVE_EXTENSIONS
+
+BLOQUE_COPIA = 1024 * 1024
+
+
+class ComprimidoInvalido(zipfile.BadZipFile):
+    """Un .rar que rarfile no puede abrir (los .zip ya levantan BadZipFile)."""
+
+
+class Fuente:
+    """
+    Contenido de un archivo descargado o de un miembro de comprimido. Queda en memoria hasta `max_bytes`
+    (ARCHIVE_SPOOL_MAX_MB) y por encima se vuelca a un temporal con nombre. A diferencia de
+    SpooledTemporaryFile sobrevive al pickle (viaja como bytes o como ruta), así que se puede pasar al
+    proceso del pipeline. str(fuente) es su nombre lógico: resumen y manifiesto lo usan como clave.
+    El temporal lo borra `cerrar()` (o el with) en el proceso que creó la fuente.
+    """
+
+    def __init__(self, nombre: str, datos: Optional[bytes] = None, ruta: Optional[str] = None):
+        self.nombre = nombre
+        self.datos = datos
+        self.ruta = ruta
+
+    @classmethod
+    def desde_stream(cls, nombre: str, origen: BinaryIO, max_bytes: Optional[int] = None) -> 'Fuente':
+        max_bytes = config.ARCHIVE_SPOOL_MAX_MB * 1024 * 1024 if max_bytes is None else max_bytes
+        buffer = io.BytesIO()
+        while bloque := origen.read(BLOQUE_COPIA):
+            buffer.write(bloque)
+            if buffer.tell() > max_bytes:
+                break
+        else:
+            return cls(nombre, datos=buffer.getvalue())
+
+        extension = os.path.splitext(nombre)[1]
+        with tempfile.NamedTemporaryFile(prefix='fuente_', suffix=extension, delete=False) as salida:
+            salida.write(buffer.getbuffer())
+            del buffer
+            while bloque := origen.read(BLOQUE_COPIA):
+                salida.write(bloque)
+        return cls(nombre, ruta=salida.name)
+
+    @property
+    def en_memoria(self) -> bool:
+        return self.datos is not None
+
+    @property
+    def tamano(self) -> int:
+        return len(self.datos) if self.en_memoria else os.path.getsize(self.ruta)
+
+    def abrir(self) -> BinaryIO:
+        return io.BytesIO(self.datos) if self.en_memoria else open(self.ruta, 'rb')
+
+    def cerrar(self) -> None:
+        if self.ruta is not None and os.path.exists(self.ruta):
+            os.remove(self.ruta)
+        self.datos = self.ruta = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.cerrar()
+
+    def __str__(self):
+        return self.nombre
+
+    def __repr__(self):
+        ubicacion = f"{len(self.datos)} bytes en memoria" if self.en_memoria else self.ruta
+        return f"Fuente({self.nombre!r}, {ubicacion})"
+
+
+# Los pipelines reciben rutas locales (CLI) o fuentes en búfer (fase 2)
+Origen = Union[str, Fuente]
+
+
+def nombre_fuente(fuente: Origen) -> str:
+    return os.path.basename(str(fuente))
+
+
+def tamano_fuente(fuente: Origen) -> int:
+    return fuente.tamano if isinstance(fuente, Fuente) else os.path.getsize(fuente)
+
+
+def abrir_fuente(fuente: Origen) -> BinaryIO:
+    return fuente.abrir() if isinstance(fuente, Fuente) else open(fuente, 'rb')
+
+
+def es_comprimido(nombre: str) -> bool:
+    return nombre.lower().endswith(ARCHIVE_EXTENSIONS)
+
+
+def por_extension(*extensiones: str) -> Callable[[str], bool]:
+    """Criterio de selección de miembros por extensión (sin distinguir mayúsculas)."""
+    return lambda nombre: nombre.lower().endswith(extensiones)
+
+
+def abrir_comprimido(fuente: Origen):
+    """ZipFile o RarFile sobre una ruta o una fuente; las fuentes en memoria se abren sin tocar disco."""
+    origen = fuente if isinstance(fuente, str) else (fuente.ruta or fuente.abrir())
+    if str(fuente).lower().endswith('.rar'):
+        import rarfile
+        try:
+            return rarfile.RarFile(origen)
+        except rarfile.Error as e:
+            raise ComprimidoInvalido(f"{nombre_fuente(fuente)}: {e}") from e
+    return zipfile.ZipFile(origen)
+
+
+def iter_miembros(fuente: Origen, seleccionar: Callable[[str], bool],
+                  max_bytes: Optional[int] = None) -> Iterator[Tuple[str, Callable[[], BinaryIO]]]:
+    """
+    Entrega (nombre, función que abre su contenido) por cada archivo que acepta `seleccionar`: la fuente
+    misma si su nombre lo cumple o, si es un comprimido, sus miembros (ver iter_comprimido).
+    """
+    if seleccionar(nombre_fuente(fuente)):
+        yield nombre_fuente(fuente), lambda: abrir_fuente(fuente)
+    elif es_comprimido(str(fuente)):
+        with abrir_comprimido(fuente) as archivo:
+            yield from iter_comprimido(archivo, seleccionar, max_bytes)
+
+
+def iter_comprimido(archivo, seleccionar: Callable[[str], bool], max_bytes: Optional[int] = None,
+                    prefijo: str = '') -> Iterator[Tuple[str, Callable[[], BinaryIO]]]:
+    """
+    Recorre un comprimido abierto (zipfile, rarfile o RemoteZipFile). Los miembros que acepta `seleccionar`
+    se entregan como (ruta dentro del comprimido, abrir), leídos directo del comprimido; un comprimido
+    anidado que no acepta se copia a una Fuente (zipfile necesita seek) y se recorre igual.
+    `abrir` solo es válido hasta pedir el siguiente miembro.
+    """
+    for info in archivo.infolist():
+        if info.is_dir():
+            continue
+        nombre = prefijo + info.filename
+        base = os.path.basename(info.filename)
+        if seleccionar(base):
+            yield nombre, lambda info=info: archivo.open(info)
+        elif es_comprimido(base):
+            with archivo.open(info) as origen, Fuente.desde_stream(base, origen, max_bytes) as anidado, \
+                    abrir_comprimido(anidado) as interno:
+                yield from iter_comprimido(interno, seleccionar, max_bytes, prefijo=nombre + '/')
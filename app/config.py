@@ -1,5 +1,6 @@
 import os
 import re
+from functools import lru_cache
 from dotenv import load_dotenv
 
 # Cargar variables de entorno desde .env
@@ -43,6 +44,22 @@ PATRONES_NEED_ETL = {
     "reporte_planilla_zip": (re.compile(r"^(\d{11})_([A-Z]{3})+_(\d{8})\.(zip)$", re.IGNORECASE), ["ruc", "codigo", "fecha", "ext"]),
 }
 
+# Nombres de archivo cuya clasificación se mantiene en memoria (match_file_pattern)
+CLASSIFIER_CACHE_SIZE = int(os.getenv('CLASSIFIER_CACHE_SIZE', 200_000))
+
+# Extensiones de comprimidos que se inspeccionan aunque su nombre no coincida con ningún patrón
+ARCHIVE_EXTENSIONS = ('.zip', '.rar')
+
+# Opciones de los pipelines SIRE. Viven aquí (y no en sire_common) para que la CLI las use sin importar pandas.
+# Políticas disponibles para filas cuya clave única ya existe en destino
+ON_CONFLICT_POLICIES = ('nothing', 'update')
+# 'diff' compara cada propuesta con la huella del último snapshot de su (ruc, periodo) y solo aplica los cambios
+LOAD_MODES = ('rows', 'copy', 'diff')
+# 'classic' encadena rename_columns, transform_data y filter_final_columns; 'fused' lo hace en una sola pasada
+TRANSFORM_MODES = ('classic', 'fused')
+# 'pandas' lee todo como texto con el parser C; 'pyarrow' lee en paralelo con columnas tipadas (requiere pyarrow)
+READ_ENGINES = ('pandas', 'pyarrow')
+
 # Mapeo de columnas para SIRE Compras
 COLUMN_MAPPING_COMPRAS = {
     'RUC': 'ruc',
@@ -92,11 +109,23 @@ class Config:
     ONEDRIVE_CLIENT_SECRET = os.getenv('ONEDRIVE_CLIENT_SECRET')
     ONEDRIVE_TENANT_ID = os.getenv('ONEDRIVE_TENANT_ID')
     ONEDRIVE_FOLDER_ID = os.getenv('ONEDRIVE_FOLDER_ID')
+    ONEDRIVE_ROOT_FOLDER = os.getenv('ONEDRIVE_ROOT_FOLDER', 'AbacoBot')
+    ONEDRIVE_MAX_CONCURRENCY = int(os.getenv('ONEDRIVE_MAX_CONCURRENCY', 8))
+    # Caché de tokens MSAL: ruta opcional para persistirla entre ejecuciones y margen de renovación (segundos)
+    MS_TOKEN_CACHE_PATH = os.getenv('MS_TOKEN_CACHE_PATH')
+    MS_TOKEN_REFRESH_MARGIN = int(os.getenv('MS_TOKEN_REFRESH_MARGIN', 300))
 
     # S3
     AWS_ACCESS_KEY_ID = os.getenv('AWS_ACCESS_KEY_ID')
     AWS_SECRET_ACCESS_KEY = os.getenv('AWS_SECRET_ACCESS_key')
     AWS_S3_BUCKET_NAME = os.getenv('AWS_S3_BUCKET_NAME')
+    # Manifiesto local de claves S3 por prefijo RUC/ y antigüedad máxima de cada listado
+    S3_MANIFEST_PATH = os.getenv('S3_MANIFEST_PATH', 's3_manifest.db')
+    S3_MANIFEST_TTL_HOURS = float(os.getenv('S3_MANIFEST_TTL_HOURS', 24))
+    # Parámetros multipart de cada transferencia (las subidas simultáneas las fijan los WORKER_CONCURRENCY_*)
+    S3_MULTIPART_THRESHOLD_MB = int(os.getenv('S3_MULTIPART_THRESHOLD_MB', 8))
+    S3_MULTIPART_CHUNKSIZE_MB = int(os.getenv('S3_MULTIPART_CHUNKSIZE_MB', 8))
+    S3_MULTIPART_CONCURRENCY = int(os.getenv('S3_MULTIPART_CONCURRENCY', 4))
 
     # --- PostgreSQL: ÚNICA FUENTE DE VERDAD ---
     POSTGRES_USER = os.getenv('POSTGRES_USER')
@@ -107,14 +136,49 @@ class Config:
 
     # URL de conexión para SQLAlchemy, usada en toda la aplicación
     DB_URL = f"postgresql://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_HOST}:{POSTGRES_PORT}/{POSTGRES_DB}"
+    # Pool de conexiones compartido (app/db.py): conexiones fijas, extra bajo demanda, verificación y reciclado (segundos)
+    DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 5))
+    DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 10))
+    DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', 'true').lower() == 'true'
+    DB_POOL_RECYCLE_SECONDS = int(os.getenv('DB_POOL_RECYCLE_SECONDS', 1800))
 
     # SQLite Queue
     QUEUE_DB_PATH = os.getenv('QUEUE_DB_PATH', 'queue.db')
+    # Segundos que una tarea reservada por un worker queda bloqueada antes de poder reasignarse
+    QUEUE_LEASE_SECONDS = int(os.getenv('QUEUE_LEASE_SECONDS', 600))
+    # Cantidad de archivos clasificados que se acumulan antes de escribirlos juntos en la cola
+    QUEUE_INSERT_BATCH_SIZE = int(os.getenv('QUEUE_INSERT_BATCH_SIZE', 500))
+
+    # Fase 2: tareas simultáneas por tipo (NO ETL = subida directa a S3, ETL = pipelines, comprimidos)
+    WORKER_CONCURRENCY_NO_ETL = int(os.getenv('WORKER_CONCURRENCY_NO_ETL', 16))
+    WORKER_CONCURRENCY_ETL = int(os.getenv('WORKER_CONCURRENCY_ETL', 2))
+    WORKER_CONCURRENCY_COMPRIMIDO = int(os.getenv('WORKER_CONCURRENCY_COMPRIMIDO', 4))
+    # Procesos para los pipelines ETL (trabajo bloqueante de CPU y base de datos)
+    WORKER_ETL_PROCESSES = int(os.getenv('WORKER_ETL_PROCESSES', 2))
+    # Motor de lectura de los pipelines SIRE en la fase 2: 'pandas' o 'pyarrow' (requiere pyarrow)
+    SIRE_READ_ENGINE = os.getenv('SIRE_READ_ENGINE', 'pandas')
+    # Comprobantes XML (UBL) que se acumulan en columnas antes de cargarlos con COPY
+    XML_BATCH_DOCUMENTS = int(os.getenv('XML_BATCH_DOCUMENTS', 5000))
+    # Comprimidos .zip: leer por HTTP Range solo el directorio central y los miembros que se procesan
+    # (sin soporte de Range en el servidor, o para .rar, se descarga el archivo completo)
+    ARCHIVE_RANGE_READS = os.getenv('ARCHIVE_RANGE_READS', 'true').lower() == 'true'
+    ARCHIVE_RANGE_BLOCK_MB = int(os.getenv('ARCHIVE_RANGE_BLOCK_MB', 8))
+    # Descargas y miembros de comprimidos se mantienen en memoria hasta este tamaño; por encima, en un temporal
+    ARCHIVE_SPOOL_MAX_MB = int(os.getenv('ARCHIVE_SPOOL_MAX_MB', 64))
+    # Reintentos con backoff exponencial; agotados los intentos la tarea pasa a FALLIDO (dead-letter)
+    WORKER_MAX_ATTEMPTS = int(os.getenv('WORKER_MAX_ATTEMPTS', 5))
+    WORKER_BACKOFF_BASE_SECONDS = float(os.getenv('WORKER_BACKOFF_BASE_SECONDS', 30))
+    WORKER_BACKOFF_MAX_SECONDS = float(os.getenv('WORKER_BACKOFF_MAX_SECONDS', 3600))
 
     # Logging
     LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
     LOG_FILE = os.getenv('LOG_FILE', 'etl_sire.log')
 
+    # Métricas por etapa (app/metrics.py): JSON lines que se acumulan entre ejecuciones y textfile de
+    # Prometheus (p. ej. en el directorio del textfile collector de node_exporter). Vacío = no se exporta
+    METRICS_JSONL_FILE = os.getenv('METRICS_JSONL_FILE', 'etl_metrics.jsonl')
+    METRICS_PROMETHEUS_FILE = os.getenv('METRICS_PROMETHEUS_FILE', '')
+
     # Email
     EMAIL_SMTP_SERVER = os.getenv('EMAIL_SMTP_SERVER')
     EMAIL_SMTP_PORT = int(os.getenv('EMAIL_SMTP_PORT', 587))
@@ -134,25 +198,121 @@ class Config:
 # Instancia de configuración
 config = Config()
 
+class _FileClassifier:
+    """
+    Clasificador precompilado equivalente a recorrer PATRONES_NEED_ETL y luego PATRONES_NO_ETL en orden.
+    Cada patrón se indexa por su prefijo literal (dos primeros caracteres) y por las extensiones que acepta;
+    para un nombre solo se prueban los patrones compatibles, unidos en una sola expresión con alternativas
+    nombradas (?P<pN>...) que re evalúa en el mismo orden original. El índice solo descarta patrones que
+    no pueden coincidir, así que el resultado es idéntico al del recorrido secuencial.
+    """
+    _METACARACTERES = set('\\.^$*+?{}[]()|')
+    _EXTENSIONES = re.compile(r'\\\.\(([a-z0-9|]+)\)\$$', re.IGNORECASE)
+
+    def __init__(self):
+        self._entradas = []  # (tipo, campos, need_etl, cantidad_de_grupos, prefijo, extensiones, cuerpo)
+        for patrones, need_etl in ((PATRONES_NEED_ETL, True), (PATRONES_NO_ETL, False)):
+            for tipo, (pattern, fields) in patrones.items():
+                fuente = pattern.pattern
+                cuerpo = fuente[1:] if fuente.startswith('^') else fuente
+                ext = self._EXTENSIONES.search(fuente)
+                extensiones = frozenset(ext.group(1).lower().split('|')) if ext else None
+                self._entradas.append((tipo, fields, need_etl, pattern.groups, self._prefijo(cuerpo), extensiones, cuerpo))
+        self._extensiones = frozenset().union(*(e[5] for e in self._entradas if e[5] is not None))
+        self._por_clave = {}
+        self._regex = {}
+
+    @classmethod
+    def _prefijo(cls, cuerpo):
+        """Prefijo literal (en minúsculas) que todo nombre que coincida debe tener."""
+        prefijo = []
+        for i, c in enumerate(cuerpo):
+            if c in cls._METACARACTERES:
+                # Un cuantificador vuelve opcional al carácter anterior
+                if c in '?*{' and prefijo:
+                    prefijo.pop()
+                break
+            prefijo.append(c)
+        return ''.join(prefijo).lower()
+
+    def _candidatos(self, inicio, extension):
+        indices = []
+        for i, (_, _, _, _, prefijo, extensiones, _) in enumerate(self._entradas):
+            if inicio is not None and not (prefijo[:2] == inicio if len(prefijo) >= 2 else inicio.startswith(prefijo)):
+                continue
+            if extension is not None and extensiones is not None and extension not in extensiones:
+                continue
+            indices.append(i)
+        return tuple(indices)
+
+    def _compilar(self, indices):
+        """Expresión combinada de los patrones candidatos y, por alternativa, los datos de su resultado."""
+        if indices not in self._regex:
+            if not indices:
+                self._regex[indices] = None
+            else:
+                alternativas = "|".join(f"(?P<p{i}>{self._entradas[i][6]})" for i in indices)
+                regex = re.compile(f"^(?:{alternativas})", re.IGNORECASE)
+                # La alternativa que coincidió es el último grupo en cerrarse (lastindex); sus subgrupos vienen a continuación
+                resultados = {}
+                for i in indices:
+                    tipo, fields, need_etl, n_grupos = self._entradas[i][:4]
+                    inicio = regex.groupindex[f"p{i}"]
+                    resultados[inicio] = (tipo, fields[:n_grupos], need_etl, tuple(range(inicio + 1, inicio + 1 + n_grupos)))
+                self._regex[indices] = (regex, resultados)
+        return self._regex[indices]
+
+    def match(self, file_name):
+        inicio = file_name[:2].lower()
+        extension = file_name.rpartition('.')[2].rstrip('\n').lower()
+        # Con caracteres no ASCII el case-folding de re puede diferir de lower(): no se filtra por ellos
+        if not extension.isascii():
+            extension = None
+        elif extension not in self._extensiones:
+            extension = ''  # ninguna extensión conocida: mantiene acotada la cantidad de claves
+        clave = (inicio if inicio.isascii() and len(inicio) == 2 else None, extension)
+        compilado = self._por_clave.get(clave)
+        if compilado is None:
+            if clave in self._por_clave:
+                return None, None, None
+            compilado = self._por_clave[clave] = self._compilar(self._candidatos(*clave))
+            if compilado is None:
+                return None, None, None
+
+        regex, resultados = compilado
+        match = regex.match(file_name)
+        if not match:
+            return None, None, None
+        tipo, fields, need_etl, grupos = resultados[match.lastindex]
+        valores = match.group(*grupos) if len(grupos) > 1 else (match.group(*grupos),) if grupos else ()
+        return tipo, dict(zip(fields, valores)), need_etl
+
+
+_classifier = _FileClassifier()
+
+
+@lru_cache(maxsize=CLASSIFIER_CACHE_SIZE)
+def _match_cached(file_name):
+    """Resultado memoizado; el dict de datos es compartido y no debe modificarse (se entrega una copia)."""
+    return _classifier.match(file_name)
+
+
 def match_file_pattern(file_name):
     """
     Verifica si el archivo coincide con algún patrón estructurado y retorna el tipo, datos extraídos y si necesita ETL.
+    Primero se prueban los patrones NEED ETL y luego los NO ETL; el resultado se memoiza por nombre.
     """
-    # Primero verificar NEED ETL
-    for tipo, (pattern, fields) in PATRONES_NEED_ETL.items():
-        match = pattern.match(file_name)
-        if match:
-            data = dict(zip(fields, match.groups()))
-            return tipo, data, True
-
-    # Luego NO ETL
-    for tipo, (pattern, fields) in PATRONES_NO_ETL.items():
-        match = pattern.match(file_name)
-        if match:
-            data = dict(zip(fields, match.groups()))
-            return tipo, data, False
-
-    return None, None, None
+    tipo, data, need_etl = _match_cached(file_name)
+    return (tipo, data.copy(), need_etl) if data is not None else (None, None, None)
+
+
+def classify_many(file_names):
+    """Clasifica un lote de nombres; retorna una lista de (tipo, datos, need_etl) en el mismo orden."""
+    resultados = []
+    for nombre in file_names:
+        tipo, data, need_etl = _match_cached(nombre)
+        resultados.append((tipo, data.copy(), need_etl) if data is not None else (None, None, None))
+    return resultados
 
 # Estrategias de verificación de procesamiento por tipo de archivo
 VERIFICATION_STRATEGIES = {
@@ -219,5 +379,5 @@ def extract_ruc(file_name):
     """
     Extrae el RUC del nombre del archivo basado en los patrones.
     """
-    _, data, _ = match_file_pattern(file_name)
+    _, data, _ = _match_cached(file_name)
     return data.get('ruc') if data else None
\ No newline at end of file
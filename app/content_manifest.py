@@ -0,0 +1,147 @@
+# Manifiesto de contenido: evita volver a procesar archivos byte a byte idénticos a uno ya cargado
+
+import hashlib
+import logging
+import os
+import zipfile
+from dataclasses import dataclass, field
+from typing import Dict, List, Tuple
+
+from app.archive_stream import Origen, abrir_fuente, es_comprimido, iter_miembros, nombre_fuente, por_extension
+from app.metrics import metrics
+from app.queue_db import queue_db
+
+logger = logging.getLogger(__name__)
+
+BLOQUE_LECTURA = 1024 * 1024
+
+# Miembros de un comprimido que leen los pipelines (SIRE: .txt/.csv, comprobantes: .xml)
+EXTENSIONES_MIEMBRO = ('.txt', '.csv', '.xml')
+
+
+@dataclass
+class HuellaContenido:
+    """SHA-256 de un archivo y, si es un .zip, del contenido descomprimido de cada miembro."""
+    ruta: str
+    sha256: str
+    tamano: int
+    miembros: Dict[str, Tuple[str, int]] = field(default_factory=dict)  # nombre -> (sha256, tamaño)
+
+    def claves(self) -> List[str]:
+        return [self.sha256] + [sha for sha, _ in self.miembros.values()]
+
+
+def _sha256(archivo) -> Tuple[str, int]:
+    """SHA-256 y tamaño en bytes del contenido de un archivo abierto."""
+    h, tamano = hashlib.sha256(), 0
+    while bloque := archivo.read(BLOQUE_LECTURA):
+        h.update(bloque)
+        tamano += len(bloque)
+    return h.hexdigest(), tamano
+
+
+def calcular_huella(ruta: Origen) -> HuellaContenido:
+    """
+    El hash de un miembro es el de sus bytes descomprimidos: coincide con el del mismo .txt suelto o
+    dentro de otro .zip (SUNAT vuelve a comprimir la misma propuesta o comprobante con otra fecha o nombre).
+    `ruta` puede ser un archivo local o una Fuente en memoria; los comprimidos anidados se recorren igual
+    que en los pipelines.
+    """
+    with abrir_fuente(ruta) as f:
+        huella = HuellaContenido(str(ruta), *_sha256(f))
+    if es_comprimido(str(ruta)):
+        for nombre, abrir in iter_miembros(ruta, por_extension(*EXTENSIONES_MIEMBRO)):
+            with abrir() as miembro:
+                huella.miembros[nombre] = _sha256(miembro)
+    return huella
+
+
+class ContentManifest:
+    """
+    Tabla content_manifest de queue.db, indexada por (sha256, pipeline): registra de cada archivo y de
+    cada miembro de comprimido las filas extraídas, cargadas, omitidas y rechazadas, y el resultado.
+    Antes de extraer, los archivos cuyo contenido ya terminó como PROCESADO se omiten (salvo force).
+    """
+
+    def __init__(self, queue=None):
+        self.queue = queue or queue_db
+        self._tabla_lista = False
+
+    def _preparar(self):
+        if not self._tabla_lista:
+            self.queue.create_table()
+            self._tabla_lista = True
+
+    def filtrar(self, pipeline: str, rutas: List[Origen], force: bool = False) -> Tuple[List[Origen], Dict[str, HuellaContenido]]:
+        """
+        Retorna (rutas a procesar, huellas de esas rutas por str(ruta)). Se omiten las rutas con el mismo
+        contenido que uno ya procesado por `pipeline` (el archivo entero o todos sus miembros) y las repetidas
+        en el lote. Las rutas pueden ser archivos locales o Fuentes en memoria.
+        Un archivo que no se puede leer queda pendiente sin huella: el extractor informará el error.
+        """
+        self._preparar()
+        huellas = {}
+        for ruta in rutas:
+            with metrics.etapa(pipeline, 'verify', ruta) as medicion:
+                try:
+                    huellas[str(ruta)] = calcular_huella(ruta)
+                    medicion.bytes_leidos = huellas[str(ruta)].tamano
+                except (OSError, zipfile.BadZipFile) as e:
+                    medicion.exito = False
+                    logger.warning(f"No se pudo calcular el hash de '{nombre_fuente(ruta)}': {e}")
+        if force:
+            return list(rutas), huellas
+
+        procesados = self.queue.get_processed_hashes(pipeline, [c for h in huellas.values() for c in h.claves()])
+        pendientes, vistos = [], set()
+        for ruta in rutas:
+            huella = huellas.get(str(ruta))
+            if huella is None:
+                pendientes.append(ruta)
+                continue
+            miembros = [sha for sha, _ in huella.miembros.values()]
+            if huella.sha256 in procesados or (miembros and procesados.issuperset(miembros)):
+                logger.info(f"Se omite '{nombre_fuente(ruta)}': su contenido (sha256 {huella.sha256[:12]}) ya fue procesado con {pipeline}. Use --force para reprocesarlo.")
+                del huellas[str(ruta)]
+            elif huella.sha256 in vistos:
+                logger.info(f"Se omite '{nombre_fuente(ruta)}': mismo contenido que otro archivo del lote.")
+                del huellas[str(ruta)]
+            else:
+                vistos.add(huella.sha256)
+                pendientes.append(ruta)
+        return pendientes, huellas
+
+    def registrar(self, pipeline: str, huellas: Dict[str, HuellaContenido], resumen) -> int:
+        """
+        Registra el resultado de un lote (ResumenETL) para cada archivo y miembro con huella.
+        Las filas extraídas son por archivo; cargadas, omitidas y rechazadas solo se conocen por lote,
+        así que se guardan únicamente cuando el lote tenía un solo archivo.
+        """
+        if not huellas:
+            return 0
+        un_archivo = len(huellas) == 1
+        registros = []
+        for ruta, huella in huellas.items():
+            if ruta in resumen.archivos_fallidos:
+                resultado = 'FALLIDO'
+            else:
+                resultado = 'PROCESADO' if resumen else 'CON_ERRORES'
+            filas = resumen.filas_por_archivo.get(ruta)
+            carga = (resumen.filas_cargadas, resumen.filas_omitidas, resumen.filas_rechazadas) if un_archivo else (None, None, None)
+            nombre = os.path.basename(ruta)
+            registros.append((huella.sha256, pipeline, 'archivo', nombre, huella.tamano, filas, *carga, resultado))
+            # Con un solo miembro sus filas son las del archivo
+            un_miembro = len(huella.miembros) == 1
+            for miembro, (sha, tamano) in huella.miembros.items():
+                registros.append((sha, pipeline, 'miembro', f"{nombre}:{miembro}", tamano,
+                                  filas if un_miembro else None, *(carga if un_miembro else (None, None, None)), resultado))
+        try:
+            self._preparar()
+            return self.queue.record_contents(registros)
+        except Exception as e:
+            logger.error(f"No se pudo registrar el manifiesto de contenido de {pipeline}: {e}")
+            return 0
+
+
+# Instancia global
+content_manifest = ContentManifest()
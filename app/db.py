@@ -0,0 +1,48 @@
+# Pool de conexiones a PostgreSQL compartido por todo el proceso
+
+import os
+import threading
+from sqlalchemy import create_engine
+from app.config import config
+
+_engines = {}
+_pid = os.getpid()
+_lock = threading.Lock()
+
+
+def get_engine(db_url=None):
+    """
+    Engine de SQLAlchemy con pool para db_url (por defecto config.DB_URL). Se crea una sola vez por
+    URL y por proceso, así los pipelines y PostgresClient reutilizan conexiones ya abiertas.
+    Tamaño del pool, pre-ping y reciclado se configuran con DB_POOL_SIZE, DB_MAX_OVERFLOW,
+    DB_POOL_PRE_PING y DB_POOL_RECYCLE_SECONDS.
+    """
+    global _pid
+    url = db_url or config.DB_URL
+    with _lock:
+        if os.getpid() != _pid:
+            # Proceso hijo (fork): las conexiones heredadas pertenecen al padre; se sueltan sin cerrarlas
+            for engine in _engines.values():
+                engine.dispose(close=False)
+            _engines.clear()
+            _pid = os.getpid()
+
+        engine = _engines.get(url)
+        if engine is None:
+            engine = create_engine(
+                url,
+                pool_size=config.DB_POOL_SIZE,
+                max_overflow=config.DB_MAX_OVERFLOW,
+                pool_pre_ping=config.DB_POOL_PRE_PING,
+                pool_recycle=config.DB_POOL_RECYCLE_SECONDS,
+            )
+            _engines[url] = engine
+        return engine
+
+
+def dispose_engines():
+    """Cierra todas las conexiones del pool (p. ej. al terminar el proceso)."""
+    with _lock:
+        for engine in _engines.values():
+            engine.dispose()
+        _engines.clear()
@@ -1,37 +1,43 @@
 # Cliente para PostgreSQL - Implementado con estrategias de verificación
 
-import psycopg2
-from app.config import config, VERIFICATION_STRATEGIES, generar_identificador_procesamiento
+import os
+import sys
+from contextlib import contextmanager
+from psycopg2.extras import execute_values
+from app.config import config, VERIFICATION_STRATEGIES, generar_identificador_procesamiento, classify_many
+from app.db import get_engine
+from app.metrics import metrics
+
+# Filas por sentencia en las operaciones por lote (VALUES ... con execute_values)
+BATCH_PAGE_SIZE = 1000
 
 class PostgresClient:
-    def __init__(self):
-        self.connection_params = {
-            'host': config.POSTGRES_HOST,
-            'port': config.POSTGRES_PORT,
-            'database': config.POSTGRES_DB,
-            'user': config.POSTGRES_USER,
-            'password': config.POSTGRES_PASSWORD
-        }
-        self._connection = None
+    def __init__(self, db_url=None):
+        self.db_url = db_url or config.DB_URL
 
+    @contextmanager
     def _get_connection(self):
-        """Obtiene conexión a PostgreSQL."""
-        if not self._connection:
-            self._connection = psycopg2.connect(**self.connection_params)
-        return self._connection
+        """
+        Toma una conexión psycopg2 del pool compartido (app/db.py) y la devuelve al salir;
+        el pool deshace lo que no se haya confirmado y descarta las conexiones caídas.
+        """
+        conn = get_engine(self.db_url).raw_connection()
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _test_mode():
+        test_mode = len(sys.argv) > 1 and sys.argv[1] == "--test"
+        return test_mode or os.getenv("ETL_TEST_MODE", "false").lower() == "true"
 
     def check_file_processed(self, file_name):
         """
         Verifica procesamiento según estrategia del tipo de archivo.
         En modo prueba, siempre retorna False para evitar conexiones PostgreSQL.
         """
-        # Verificar si estamos en modo prueba
-        import os
-        import sys
-        test_mode = len(sys.argv) > 1 and sys.argv[1] == "--test"
-        test_mode = test_mode or os.getenv("ETL_TEST_MODE", "false").lower() == "true"
-
-        if test_mode:
+        if self._test_mode():
             return False  # En modo prueba, no verificar PostgreSQL
 
         from app.config import match_file_pattern
@@ -46,12 +52,73 @@ class PostgresClient:
         if method == "single_row_check":
             return self._check_single_row(strategy, data)
         elif method == "row_by_row_check":
-            return False  # Siempre procesar, verificar internamente
+            return False  # Siempre procesar: el pipeline filtra fila por fila (RowKeyIndex en sire_common)
         elif method == "timestamp_check":
-            return self._check_timestamp(strategy, data, file_name)
+            return self._check_timestamp(tipo, data, file_name)
 
         return False
 
+    def check_files_processed(self, file_names):
+        """
+        Versión por lotes de check_file_processed: una consulta por tabla de single_row_check y una
+        sola contra archivos_procesados para todos los timestamp_check, uniendo una lista VALUES.
+        Retorna un dict {file_name: bool}.
+        """
+        file_names = list(file_names)
+        resultado = dict.fromkeys(file_names, False)
+        if self._test_mode():
+            return resultado
+
+        with metrics.etapa('postgres', 'verify', filas_entrada=len(file_names)) as medicion:
+            por_tabla = {}   # single_row_check: (tabla, id_column, check_column) -> [(nombre, id, check_value)]
+            timestamps = []  # timestamp_check: [(nombre, identificador, timestamp)]
+            for nombre, (tipo, data, _) in zip(file_names, classify_many(file_names)):
+                strategy = VERIFICATION_STRATEGIES.get(tipo)
+                if not strategy:
+                    continue
+                if strategy["method"] == "single_row_check":
+                    clave = (strategy["table"], strategy["id_column"], strategy["check_column"])
+                    id_value = self._build_identifier_value(strategy["id_column"], data)
+                    por_tabla.setdefault(clave, []).append((nombre, id_value, strategy["check_value"]))
+                elif strategy["method"] == "timestamp_check":
+                    identificador = generar_identificador_procesamiento(tipo, data)
+                    timestamps.append((nombre, identificador, int(data.get("timestamp", 0))))
+
+            for (table, id_column, check_column), filas in por_tabla.items():
+                query = f"""
+                    SELECT v.nombre FROM (VALUES %s) AS v(nombre, id_value, check_value)
+                    WHERE EXISTS (
+                        SELECT 1 FROM {table}
+                        WHERE {id_column} = v.id_value AND {check_column} = v.check_value
+                    )
+                """
+                resultado.update(dict.fromkeys(self._fetch_values(query, filas, "single_row"), True))
+
+            if timestamps:
+                query = """
+                    SELECT v.nombre FROM (VALUES %s) AS v(nombre, identificador, timestamp_archivo)
+                    WHERE EXISTS (
+                        SELECT 1 FROM archivos_procesados a
+                        WHERE a.identificador = v.identificador
+                        AND a.timestamp_archivo >= v.timestamp_archivo
+                        AND a.estado = 'PROCESADO'
+                    )
+                """
+                resultado.update(dict.fromkeys(self._fetch_values(query, timestamps, "timestamp"), True))
+            medicion.filas_salida = sum(resultado.values())
+
+        return resultado
+
+    def _fetch_values(self, query, filas, descripcion):
+        """Ejecuta una consulta con una lista VALUES y retorna la primera columna del resultado."""
+        try:
+            with self._get_connection() as conn, conn.cursor() as cursor:
+                filas_encontradas = execute_values(cursor, query, filas, page_size=BATCH_PAGE_SIZE, fetch=True)
+            return [fila[0] for fila in filas_encontradas]
+        except Exception as e:
+            print(f"Error en verificación por lotes ({descripcion}): {e}")
+            return []
+
     def _check_single_row(self, strategy, data):
         """Verificación de archivos que corresponden a una sola fila."""
         table = strategy["table"]
@@ -64,16 +131,16 @@ class PostgresClient:
         """
 
         try:
-            with self._get_connection().cursor() as cursor:
+            with self._get_connection() as conn, conn.cursor() as cursor:
                 cursor.execute(query, (id_value, strategy["check_value"]))
                 return cursor.fetchone() is not None
         except Exception as e:
             print(f"Error en verificación single_row: {e}")
             return False
 
-    def _check_timestamp(self, strategy, data, file_name):
+    def _check_timestamp(self, tipo, data, file_name):
         """Verificación por timestamp - solo procesar si es más reciente."""
-        identificador = generar_identificador_procesamiento(strategy.get("tipo", ""), data)
+        identificador = generar_identificador_procesamiento(tipo, data)
         timestamp_actual = int(data.get("timestamp", 0))
 
         # Verificar si existe una versión más reciente procesada
@@ -85,7 +152,7 @@ class PostgresClient:
         """
 
         try:
-            with self._get_connection().cursor() as cursor:
+            with self._get_connection() as conn, conn.cursor() as cursor:
                 cursor.execute(query, (identificador, timestamp_actual))
                 exists_newer = cursor.fetchone() is not None
                 return exists_newer  # True si ya hay versión más reciente
@@ -118,12 +185,45 @@ class PostgresClient:
         """
 
         try:
-            with self._get_connection().cursor() as cursor:
+            with self._get_connection() as conn, conn.cursor() as cursor:
                 cursor.execute(query, (tipo, identificador, nombre_archivo, ruc, timestamp_archivo))
-                self._get_connection().commit()
+                conn.commit()
         except Exception as e:
             print(f"Error registrando procesamiento: {e}")
 
+    def registrar_procesamientos(self, registros):
+        """
+        Registra en una sola sentencia (upsert con execute_values) y un solo commit una lista de
+        (tipo, identificador, nombre_archivo, ruc, timestamp_archivo).
+        Si un mismo (tipo, identificador) aparece varias veces, prevalece el último, como al registrarlos de a uno.
+        """
+        unicos = {}
+        for registro in registros:
+            unicos[(registro[0], registro[1])] = tuple(registro)
+        if not unicos:
+            return 0
+
+        query = """
+            INSERT INTO archivos_procesados
+            (tipo_documento, identificador, nombre_archivo, ruc, timestamp_archivo, estado)
+            VALUES %s
+            ON CONFLICT (tipo_documento, identificador)
+            DO UPDATE SET
+                nombre_archivo = EXCLUDED.nombre_archivo,
+                fecha_procesamiento = CURRENT_TIMESTAMP,
+                timestamp_archivo = EXCLUDED.timestamp_archivo
+        """
+
+        try:
+            with self._get_connection() as conn, conn.cursor() as cursor:
+                execute_values(cursor, query, list(unicos.values()),
+                               template="(%s, %s, %s, %s, %s, 'PROCESADO')", page_size=BATCH_PAGE_SIZE)
+                conn.commit()
+            return len(unicos)
+        except Exception as e:
+            print(f"Error registrando procesamientos por lotes: {e}")
+            return 0
+
     def insert_data(self, table, data):
         """
         Inserta datos en la tabla especificada.
@@ -137,14 +237,14 @@ class PostgresClient:
         query = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({values_placeholder})"
 
         try:
-            with self._get_connection().cursor() as cursor:
+            with self._get_connection() as conn, conn.cursor() as cursor:
                 for row in data:
                     values = [row[col] for col in columns]
                     cursor.execute(query, values)
-                self._get_connection().commit()
+                conn.commit()
         except Exception as e:
+            # Al devolver la conexión al pool se deshace la transacción incompleta
             print(f"Error insertando datos: {e}")
-            self._get_connection().rollback()
 
 # Instancia
 postgres_client = PostgresClient()
\ No newline at end of file
@@ -1,17 +1,148 @@
 # Cliente para S3 - Adaptado de FilesToS3.py
 
-import boto3
+import os
+import sqlite3
+import threading
+from datetime import datetime, timedelta
 import requests
 from app.config import config
+from app.metrics import metrics
+
+MB = 1024 * 1024
+
+
+class S3KeyManifest:
+    """
+    Índice local (SQLite) de las claves existentes en el bucket, agrupadas por prefijo RUC/.
+    Guarda ETag y tamaño de cada objeto y la fecha del último listado de cada prefijo, para que
+    las ejecuciones siguientes solo vuelvan a listar los prefijos vencidos o nunca vistos.
+    """
+
+    def __init__(self, db_path=None, ttl_hours=None):
+        self.db_path = db_path or config.S3_MANIFEST_PATH
+        self.ttl = timedelta(hours=ttl_hours if ttl_hours is not None else config.S3_MANIFEST_TTL_HOURS)
+        self._lock = threading.Lock()
+        self._prefixes = {}  # prefijo -> {clave: (etag, size)}
+        self._create_tables()
+
+    def _get_connection(self):
+        return sqlite3.connect(self.db_path)
+
+    def _create_tables(self):
+        with self._get_connection() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS s3_objects (
+                    key TEXT PRIMARY KEY,
+                    prefix TEXT NOT NULL,
+                    etag TEXT,
+                    size INTEGER
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_s3_objects_prefix ON s3_objects (prefix)')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS s3_prefixes (
+                    prefix TEXT PRIMARY KEY,
+                    listed_at TEXT NOT NULL
+                )
+            ''')
+
+    def is_fresh(self, prefix):
+        with self._get_connection() as conn:
+            row = conn.execute('SELECT listed_at FROM s3_prefixes WHERE prefix = ?', (prefix,)).fetchone()
+        return row is not None and datetime.fromisoformat(row[0]) > datetime.now() - self.ttl
+
+    def load_prefix(self, prefix):
+        """Carga en memoria las claves guardadas de un prefijo (una sola vez por proceso)."""
+        with self._lock:
+            if prefix in self._prefixes:
+                return self._prefixes[prefix]
+        with self._get_connection() as conn:
+            rows = conn.execute('SELECT key, etag, size FROM s3_objects WHERE prefix = ?', (prefix,)).fetchall()
+        objetos = {key: (etag, size) for key, etag, size in rows}
+        with self._lock:
+            return self._prefixes.setdefault(prefix, objetos)
+
+    def replace_prefix(self, prefix, objetos):
+        """Reemplaza el contenido de un prefijo con el resultado de un listado completo."""
+        with self._get_connection() as conn:
+            conn.execute('DELETE FROM s3_objects WHERE prefix = ?', (prefix,))
+            conn.executemany(
+                'INSERT INTO s3_objects (key, prefix, etag, size) VALUES (?, ?, ?, ?)',
+                [(key, prefix, etag, size) for key, (etag, size) in objetos.items()]
+            )
+            conn.execute('''
+                INSERT INTO s3_prefixes (prefix, listed_at) VALUES (?, ?)
+                ON CONFLICT(prefix) DO UPDATE SET listed_at = excluded.listed_at
+            ''', (prefix, datetime.now().isoformat()))
+        with self._lock:
+            self._prefixes[prefix] = dict(objetos)
+
+    def add(self, key, etag=None, size=None):
+        """Registro write-through de una subida propia; evita re-listar el prefijo."""
+        prefix = S3Client.prefix_of(key)
+        with self._get_connection() as conn:
+            conn.execute('''
+                INSERT INTO s3_objects (key, prefix, etag, size) VALUES (?, ?, ?, ?)
+                ON CONFLICT(key) DO UPDATE SET etag = excluded.etag, size = excluded.size
+            ''', (key, prefix, etag, size))
+        with self._lock:
+            if prefix in self._prefixes:
+                self._prefixes[prefix][key] = (etag, size)
+
+    def contains(self, key):
+        with self._lock:
+            return key in self._prefixes.get(S3Client.prefix_of(key), {})
+
 
 class S3Client:
     def __init__(self):
-        self.s3 = boto3.client(
-            's3',
-            aws_access_key_id=config.AWS_ACCESS_KEY_ID,
-            aws_secret_access_key=config.AWS_SECRET_ACCESS_KEY
-        )
+        # El cliente boto3 se crea en el primer uso: importar boto3 y armar el cliente cuesta
+        # varios cientos de ms y los flujos que no tocan S3 (p. ej. sire-compras --path) no lo necesitan
+        self._s3 = None
+        self._transfer_config = None
+        self._client_lock = threading.Lock()
         self.bucket = config.AWS_S3_BUCKET_NAME
+        self._manifest = None
+
+    @property
+    def s3(self):
+        if self._s3 is None:
+            with self._client_lock:
+                if self._s3 is None:
+                    import boto3
+                    from botocore.config import Config as BotoConfig
+                    subidas = (config.WORKER_CONCURRENCY_NO_ETL + config.WORKER_CONCURRENCY_ETL
+                               + config.WORKER_CONCURRENCY_COMPRIMIDO)
+                    self._s3 = boto3.client(
+                        's3',
+                        aws_access_key_id=config.AWS_ACCESS_KEY_ID,
+                        aws_secret_access_key=config.AWS_SECRET_ACCESS_KEY,
+                        # Cada tarea simultánea de la fase 2 puede abrir S3_MULTIPART_CONCURRENCY conexiones a la vez
+                        config=BotoConfig(max_pool_connections=subidas * config.S3_MULTIPART_CONCURRENCY)
+                    )
+        return self._s3
+
+    @property
+    def transfer_config(self):
+        if self._transfer_config is None:
+            from boto3.s3.transfer import TransferConfig
+            self._transfer_config = TransferConfig(
+                multipart_threshold=config.S3_MULTIPART_THRESHOLD_MB * MB,
+                multipart_chunksize=config.S3_MULTIPART_CHUNKSIZE_MB * MB,
+                max_concurrency=config.S3_MULTIPART_CONCURRENCY
+            )
+        return self._transfer_config
+
+    @property
+    def manifest(self):
+        if self._manifest is None:
+            self._manifest = S3KeyManifest()
+        return self._manifest
+
+    @staticmethod
+    def prefix_of(key):
+        """Prefijo de agrupación de una clave: el primer segmento de la ruta (RUC/)."""
+        return key.split('/', 1)[0] + '/' if '/' in key else ''
 
     def check_file_exists(self, key):
         """
@@ -35,26 +166,108 @@ class S3Client:
             print(f"Error de cliente de AWS al verificar el archivo: {e}")
             return False
 
+    def check_files_exist(self, keys, refresh=False):
+        """
+        Verificación en lote: lista cada prefijo RUC/ a lo sumo una vez (paginando) y responde
+        las consultas desde memoria. Los prefijos listados hace menos de S3_MANIFEST_TTL_HOURS
+        se responden desde el manifiesto local sin llamar a S3.
+        Retorna un dict {clave: bool}.
+        """
+        keys = list(keys)
+        resultado = {}
+        prefijos = {self.prefix_of(key) for key in keys}
+
+        with metrics.etapa('s3', 'verify', filas_entrada=len(keys)) as medicion:
+            for prefijo in prefijos:
+                if not prefijo:
+                    continue
+                if refresh or not self.manifest.is_fresh(prefijo):
+                    self._refresh_prefix(prefijo)
+                else:
+                    self.manifest.load_prefix(prefijo)
+
+            for key in keys:
+                if self.prefix_of(key):
+                    resultado[key] = self.manifest.contains(key)
+                else:
+                    # Claves en la raíz del bucket: no hay prefijo que listar, se consultan una a una
+                    resultado[key] = self.check_file_exists(key)
+            medicion.filas_salida = sum(resultado.values())
+        return resultado
+
+    def _refresh_prefix(self, prefijo):
+        objetos = {}
+        try:
+            paginator = self.s3.get_paginator('list_objects_v2')
+            for page in paginator.paginate(Bucket=self.bucket, Prefix=prefijo):
+                for obj in page.get('Contents', []):
+                    objetos[obj['Key']] = (obj.get('ETag', '').strip('"'), obj.get('Size'))
+        except self.s3.exceptions.NoSuchBucket:
+            print(f"⚠️  Bucket S3 '{self.bucket}' no existe. Omitiendo verificación S3.")
+            return
+        except self.s3.exceptions.ClientError as e:
+            print(f"Error de cliente de AWS al listar el prefijo {prefijo}: {e}")
+            return
+        self.manifest.replace_prefix(prefijo, objetos)
+
     def upload_file(self, local_path, key):
         """
         Sube un archivo local a S3 con la clave key.
         """
         try:
-            self.s3.upload_file(local_path, self.bucket, key)
+            with metrics.etapa('s3', 'upload', key) as medicion:
+                self.s3.upload_file(local_path, self.bucket, key, Config=self.transfer_config)
+                medicion.bytes_leidos = os.path.getsize(local_path)
+            self.manifest.add(key, size=medicion.bytes_leidos)
+            print(f"Archivo subido a S3: {key}")
+        except self.s3.exceptions.NoSuchBucket:
+            print(f"⚠️  Bucket S3 '{self.bucket}' no existe. Omitiendo subida a S3.")
+        except Exception as e:
+            print(f"Error al subir archivo a S3: {e}")
+            raise
+
+    def upload_fileobj(self, fileobj, key):
+        """
+        Sube a S3 el contenido de un archivo abierto (p. ej. un miembro de comprimido en memoria).
+        Retorna la cantidad de bytes subidos.
+        """
+        transferidos = 0
+
+        def contar(n):
+            nonlocal transferidos
+            transferidos += n
+
+        try:
+            with metrics.etapa('s3', 'upload', key) as medicion:
+                self.s3.upload_fileobj(fileobj, self.bucket, key, Config=self.transfer_config, Callback=contar)
+                medicion.bytes_leidos = transferidos
+            self.manifest.add(key, size=transferidos)
             print(f"Archivo subido a S3: {key}")
         except self.s3.exceptions.NoSuchBucket:
             print(f"⚠️  Bucket S3 '{self.bucket}' no existe. Omitiendo subida a S3.")
         except Exception as e:
             print(f"Error al subir archivo a S3: {e}")
             raise
+        return transferidos
 
     def upload_from_url(self, url, key):
         """
-        Descarga de URL y sube a S3 en streaming.
+        Descarga de URL y sube a S3 en streaming (sin archivo temporal).
+        Retorna la cantidad de bytes transferidos.
         """
-        with requests.get(url, stream=True) as r:
+        transferidos = 0
+
+        def contar(n):
+            nonlocal transferidos
+            transferidos += n
+
+        with metrics.etapa('s3', 'upload', key) as medicion, requests.get(url, stream=True, timeout=(10, 300)) as r:
             r.raise_for_status()
-            self.s3.upload_fileobj(r.raw, self.bucket, key)
+            r.raw.decode_content = True
+            self.s3.upload_fileobj(r.raw, self.bucket, key, Config=self.transfer_config, Callback=contar)
+            medicion.bytes_leidos = transferidos
+        self.manifest.add(key, size=transferidos)
+        return transferidos
 
 # Instancia
 s3_client = S3Client()
\ No newline at end of file
@@ -0,0 +1,202 @@
+# ETL de guías de remisión electrónicas (UBL 2.x DespatchAdvice) con la verificación row_by_row_check
+
+import logging
+import os
+import zipfile
+from typing import Iterator, List, Optional
+from xml.etree.ElementTree import ParseError
+
+import pandas as pd
+from sqlalchemy import text
+
+from app.archive_stream import Origen
+from app.config import config, VERIFICATION_STRATEGIES
+from app.etl_pipelines.sire_common import Loader, ResumenETL, RowKeyIndex, ON_CONFLICT_POLICIES
+from app.etl_pipelines.xml_parser_etl import EsquemaUBL, Extractor, LoteColumnar, ParserUBL
+from app.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Nombre del pipeline en las métricas por etapa (las etapas se reparten como en xml_parser_etl)
+PIPELINE = 'guia_remision_xml'
+
+ESTRATEGIA = VERIFICATION_STRATEGIES['guia_remision']
+
+CAMPOS_GUIA = {
+    'numero': ['cbc:ID'],
+    'fecha_emision': ['cbc:IssueDate'],
+    'hora_emision': ['cbc:IssueTime'],
+    'tipo_guia': ['cbc:DespatchAdviceTypeCode'],
+    'ruc': ['cac:DespatchSupplierParty/cac:Party/cac:PartyIdentification/cbc:ID',
+            'cac:DespatchSupplierParty/cbc:CustomerAssignedAccountID'],
+    'razon_social_remitente': ['cac:DespatchSupplierParty/cac:Party/cac:PartyLegalEntity/cbc:RegistrationName'],
+    'numero_documento_destinatario': ['cac:DeliveryCustomerParty/cac:Party/cac:PartyIdentification/cbc:ID',
+                                      'cac:DeliveryCustomerParty/cbc:CustomerAssignedAccountID'],
+    'tipo_documento_destinatario': ['cac:DeliveryCustomerParty/cbc:AdditionalAccountID'],
+    'razon_social_destinatario': ['cac:DeliveryCustomerParty/cac:Party/cac:PartyLegalEntity/cbc:RegistrationName'],
+    'motivo_traslado': ['cac:Shipment/cbc:HandlingCode'],
+    'peso_bruto': ['cac:Shipment/cbc:GrossWeightMeasure'],
+    'fecha_inicio_traslado': ['cac:Shipment/cac:ShipmentStage/cac:TransitPeriod/cbc:StartDate'],
+    'ubigeo_partida': ['cac:Shipment/cac:Delivery/cac:Despatch/cac:DespatchAddress/cbc:ID',
+                       'cac:Shipment/cac:OriginAddress/cbc:ID'],
+    'ubigeo_llegada': ['cac:Shipment/cac:Delivery/cac:DeliveryAddress/cbc:ID'],
+}
+ATRIBUTOS_GUIA = {
+    'tipo_documento_destinatario': [('cac:DeliveryCustomerParty/cac:Party/cac:PartyIdentification/cbc:ID', 'schemeID')],
+    'unidad_peso': [('cac:Shipment/cbc:GrossWeightMeasure', 'unitCode')],
+}
+CAMPOS_LINEA_GUIA = {
+    'item': ['cbc:ID'],
+    'cantidad': ['cbc:DeliveredQuantity'],
+    'descripcion': ['cac:Item/cbc:Description', 'cac:Item/cbc:Name'],
+    'codigo_producto': ['cac:Item/cac:SellersItemIdentification/cbc:ID'],
+}
+ATRIBUTOS_LINEA_GUIA = {
+    'unidad_medida': [('cbc:DeliveredQuantity', 'unitCode')],
+}
+
+GUIAS = EsquemaUBL(CAMPOS_GUIA, ATRIBUTOS_GUIA, ('cac:DespatchLine',), CAMPOS_LINEA_GUIA, ATRIBUTOS_LINEA_GUIA)
+
+# Una fila por ítem, con los datos de la guía repetidos. La clave de la estrategia se acota por RUC emisor.
+CLAVE_GUIA = ['ruc'] + ESTRATEGIA['id_columns']
+COLUMNAS_GUIA = CLAVE_GUIA + [
+    'tipo_guia', 'numero_serie', 'numero_correlativo', 'fecha_emision', 'hora_emision', 'razon_social_remitente',
+    'tipo_documento_destinatario', 'numero_documento_destinatario', 'razon_social_destinatario',
+    'motivo_traslado', 'fecha_inicio_traslado', 'peso_bruto', 'unidad_peso', 'ubigeo_partida', 'ubigeo_llegada',
+    'codigo_producto', 'descripcion', 'unidad_medida', 'cantidad', 'archivo',
+]
+COLUMNAS_NUMERICAS = ['peso_bruto', 'cantidad']
+COLUMNAS_ENTERAS = ['ruc', 'item']
+COLUMNAS_FECHA = ['fecha_emision', 'fecha_inicio_traslado']
+
+DDL = """
+    ruc bigint NOT NULL, numero_guia text NOT NULL, item integer NOT NULL, tipo_guia text, numero_serie text,
+    numero_correlativo text, fecha_emision date, hora_emision text, razon_social_remitente text,
+    tipo_documento_destinatario text, numero_documento_destinatario text, razon_social_destinatario text,
+    motivo_traslado text, fecha_inicio_traslado date, peso_bruto numeric(16,3), unidad_peso text,
+    ubigeo_partida text, ubigeo_llegada text, codigo_producto text, descripcion text, unidad_medida text,
+    cantidad numeric(18,4), archivo text,
+    UNIQUE (ruc, numero_guia, item)
+"""
+
+
+class Transformer:
+    @staticmethod
+    def guia(cabecera: dict, lineas: List[dict], nombre: str) -> List[dict]:
+        """Una fila por ítem con la cabecera de la guía; numero_guia es serie-correlativo sin ceros a la izquierda."""
+        cabecera.pop('_raiz', None)
+        serie, _, correlativo = cabecera.pop('numero', '').partition('-')
+        correlativo = correlativo.lstrip('0') or correlativo
+        cabecera.update(
+            numero_serie=serie, numero_correlativo=correlativo, archivo=nombre,
+            numero_guia=f"{serie}-{correlativo}" if serie and correlativo else None,
+        )
+        return [{**cabecera, **linea} for linea in lineas]
+
+
+def _anotar_lote(medicion, lote) -> None:
+    medicion.filas_salida = lote.filas
+
+
+class ETLGuiaRemision:
+    def __init__(self, db_url: str, schema: str = 'acc', on_conflict: str = 'nothing', batch_documents: Optional[int] = None):
+        if on_conflict not in ON_CONFLICT_POLICIES:
+            raise ValueError(f"Política ON CONFLICT no soportada: {on_conflict}")
+        self.extractor = Extractor()
+        self.parser = ParserUBL(GUIAS)
+        self.transformer = Transformer()
+        self.schema = schema
+        self.table_name = ESTRATEGIA['table']
+        self.loader = Loader(db_url, schema, self.table_name, CLAVE_GUIA)
+        # Claves existentes de los RUC del lote, cargadas una sola vez por ejecución
+        self.indice = RowKeyIndex.from_strategy(self.loader.engine, schema, ESTRATEGIA)
+        self.on_conflict = on_conflict
+        self.batch_documents = batch_documents or config.XML_BATCH_DOCUMENTS
+        self.resumen = ResumenETL()
+        self._tabla_lista = False
+
+    def _preparar(self) -> None:
+        if self._tabla_lista:
+            return
+        with self.loader.engine.begin() as connection:
+            connection.execute(text(f"CREATE TABLE IF NOT EXISTS {self.schema}.{self.table_name} ({DDL})"))
+        self._tabla_lista = True
+
+    def _nuevo_lote(self) -> LoteColumnar:
+        return LoteColumnar(COLUMNAS_GUIA, montos=COLUMNAS_NUMERICAS, enteras=COLUMNAS_ENTERAS, fechas=COLUMNAS_FECHA)
+
+    def iter_lotes(self, rutas_archivos: List[Origen]) -> Iterator[LoteColumnar]:
+        """Parsea las guías y entrega lotes columnares con los ítems de hasta batch_documents guías."""
+        lote, documentos = self._nuevo_lote(), 0
+        for ruta, nombre, abrir in self.extractor.iter_documentos(rutas_archivos, self.resumen.archivos_fallidos):
+            try:
+                with abrir() as fuente:
+                    cabecera, lineas = self.parser.parse(fuente)
+            except (ParseError, OSError, zipfile.BadZipFile) as e:
+                logger.error(f"XML inválido en '{nombre}' ({os.path.basename(ruta)}): {e}")
+                self.resumen.archivos_fallidos.append(f"{ruta}:{nombre}" if nombre != os.path.basename(ruta) else ruta)
+                continue
+            filas = self.transformer.guia(cabecera, lineas, nombre)
+            for fila in filas:
+                lote.agregar(fila)
+            self.resumen.filas_por_archivo[ruta] = self.resumen.filas_por_archivo.get(ruta, 0) + len(filas)
+            documentos += 1
+            if documentos >= self.batch_documents:
+                yield lote
+                lote, documentos = self._nuevo_lote(), 0
+        if lote.filas:
+            yield lote
+
+    def run(self, rutas_archivos: List[Origen]) -> bool:
+        self.resumen = ResumenETL()
+        success = True
+        try:
+            self._preparar()
+            lotes = metrics.iterar(PIPELINE, 'extract', self.iter_lotes(rutas_archivos), _anotar_lote)
+            for lote in lotes:
+                self.resumen.filas_extraidas += lote.filas
+                with metrics.etapa(PIPELINE, 'transform', filas_entrada=lote.filas) as medicion:
+                    df = lote.a_dataframe()
+                    medicion.filas_salida = len(df)
+                cargadas = self.resumen.filas_cargadas
+                with metrics.etapa(PIPELINE, 'load', filas_entrada=len(df)) as medicion:
+                    medicion.exito = self._load(df)
+                    medicion.filas_salida = self.resumen.filas_cargadas - cargadas
+                success = medicion.exito and success
+        except Exception as e:
+            logger.critical(f"Error fatal en el proceso ETL de guías de remisión: {str(e)}", exc_info=True)
+            self.resumen.archivos_fallidos = [str(ruta) for ruta in rutas_archivos]
+            success = False
+        self.resumen.exito = success and not self.resumen.archivos_fallidos
+        return success
+
+    def _load(self, df: pd.DataFrame) -> bool:
+        validas = df[CLAVE_GUIA].notna().all(axis=1)
+        self.resumen.filas_rechazadas += int((~validas).sum())
+        df = df[validas]
+
+        # duplicate_action 'skip': lo que ya está en destino no llega a la base
+        df_nuevas = self.indice.filter_new(df)
+        self.resumen.filas_omitidas += len(df) - len(df_nuevas)
+
+        success = self.loader.load_data_copy(df_nuevas, on_conflict=self.on_conflict)
+        estadisticas = self.loader.estadisticas
+        self.resumen.filas_cargadas += estadisticas['insertadas'] + estadisticas['actualizadas']
+        self.resumen.filas_omitidas += estadisticas['omitidas']
+        self.resumen.filas_rechazadas += estadisticas['errores']
+        if success:
+            self.indice.register(df_nuevas)
+        return success
+
+
+def run_guia_remision_etl(file_paths: List[Origen], on_conflict: str = 'nothing', batch_documents: Optional[int] = None) -> ResumenETL:
+    logger.info(f"Iniciando ETL de guías de remisión para {len(file_paths)} archivo(s).")
+    etl = ETLGuiaRemision(config.DB_URL, on_conflict=on_conflict, batch_documents=batch_documents)
+    etl.run(file_paths)
+
+    if etl.resumen:
+        logger.info(f"ETL de guías de remisión completado: {etl.resumen.filas_extraidas} ítem(s), "
+                    f"{etl.indice.consultas} consulta(s) de claves existentes.")
+    else:
+        logger.warning("ETL de guías de remisión finalizado con errores.")
+    return etl.resumen
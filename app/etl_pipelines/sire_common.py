@@ -0,0 +1,696 @@
+import logging
+import numpy as np
+import pandas as pd
+from dataclasses import dataclass, field
+from io import StringIO
+from sqlalchemy import text
+from typing import Dict, Iterator, List, Optional
+
+from app.config import LOAD_MODES, ON_CONFLICT_POLICIES, READ_ENGINES, TRANSFORM_MODES  # noqa: F401 (re-exportados)
+from app.archive_stream import Origen
+from app.db import get_engine
+from app.metrics import Medicion
+
+# Configuración de logging
+logger = logging.getLogger(__name__)
+
+# Formato de las fechas en las propuestas SIRE
+FORMATO_FECHA_SIRE = '%d/%m/%Y'
+
+# Tipo de lectura con pyarrow según la columna de destino (COLUMN_MAPPING_*); las no listadas se leen como texto.
+# 'categoria' usa dictionary encoding: pocas cadenas distintas repetidas en todas las filas.
+TIPOS_LECTURA = {
+    'ruc': 'entero',
+    'numero_final': 'entero',
+    'tipo_comprobante': 'codigo',
+    'tipo_comprobante_modificado': 'codigo',
+    'fecha_emision': 'fecha',
+    'fecha_vencimiento': 'fecha',
+    'isc': 'monto',
+    'icbp': 'monto',
+    'periodo_tributario': 'categoria',
+    'tipo_moneda': 'categoria',
+    'tipo_documento': 'categoria',
+    'tasa_detraccion': 'categoria',
+}
+
+
+def convertir_fechas(serie: pd.Series, formato: str = FORMATO_FECHA_SIRE) -> pd.Series:
+    """
+    Convierte una columna de texto a datetime64 parseando cada valor distinto una sola vez: una
+    propuesta repite unas pocas decenas de fechas en cientos de miles de filas. Los valores que no
+    respetan el formato se interpretan con inferencia (día primero); los inválidos quedan en NaT.
+    """
+    if pd.api.types.is_datetime64_any_dtype(serie):
+        return serie
+    codigos, unicos = pd.factorize(serie)
+    fechas = pd.to_datetime(unicos, format=formato, errors='coerce').to_numpy(dtype='datetime64[ns]')
+    faltantes = np.flatnonzero(np.isnat(fechas))
+    if len(faltantes):
+        fechas[faltantes] = pd.to_datetime(unicos[faltantes], format='mixed', dayfirst=True,
+                                           errors='coerce').to_numpy(dtype='datetime64[ns]')
+    # El código -1 (valor nulo) toma el NaT agregado al final
+    fechas = np.append(fechas, np.datetime64('NaT', 'ns'))
+    return pd.Series(fechas[codigos], index=serie.index, name=serie.name)
+
+
+def convertir_periodo(serie: pd.Series) -> pd.Series:
+    """Periodo 'AAAAMM' a entero AAAAMM (Int64), validado como fecha y parseado una vez por valor distinto."""
+    codigos, unicos = pd.factorize(serie)
+    fechas = pd.to_datetime(unicos, format='%Y%m', errors='coerce')
+    periodos = pd.array(fechas.year * 100 + fechas.month, dtype='Int64')
+    return pd.Series(periodos.take(codigos, allow_fill=True), index=serie.index, name=serie.name)
+
+
+class LectorArrow:
+    """
+    Lee los .txt SIRE (separados por '|', latin-1) con el lector CSV multihilo de pyarrow y un
+    esquema tipado derivado del mapeo de columnas: montos como float64, RUC y códigos como enteros
+    nullable y las columnas de baja cardinalidad con dictionary encoding (Categorical en pandas).
+    Las fechas se leen como diccionario y se convierten con convertir_fechas una vez por valor
+    distinto (el parser de Arrow acepta fechas como 31/02 y las desplaza al mes siguiente).
+    Si un valor no respeta su tipo, el archivo se vuelve a leer con las columnas numéricas como texto.
+    """
+
+    def __init__(self, mapping: dict, columnas_monto: List[str]):
+        try:
+            import pyarrow
+            import pyarrow.csv
+        except ImportError as e:
+            raise ImportError("El motor de lectura 'pyarrow' requiere el paquete pyarrow (pip install pyarrow)") from e
+        self.pa = pyarrow
+        self.csv = pyarrow.csv
+        self.tipos = dict.fromkeys(columnas_monto, 'monto')
+        self.tipos.update({origen: TIPOS_LECTURA[destino] for origen, destino in mapping.items() if destino in TIPOS_LECTURA})
+        self._tipos_pandas = {pyarrow.int64(): pd.Int64Dtype(), pyarrow.int16(): pd.Int16Dtype()}
+
+    def _tipo_arrow(self, tipo: str, estricto: bool):
+        pa = self.pa
+        if tipo in ('categoria', 'fecha'):
+            return pa.dictionary(pa.int32(), pa.string())
+        if estricto and tipo in ('entero', 'codigo', 'monto'):
+            return {'entero': pa.int64(), 'codigo': pa.int16(), 'monto': pa.float64()}[tipo]
+        return pa.string()
+
+    def _opciones(self, encabezado: List[str], estricto: bool, saltar_filas: int = 0, bloque: Optional[int] = None) -> dict:
+        opciones_lectura = self.csv.ReadOptions(encoding='latin-1', use_threads=True, skip_rows_after_names=saltar_filas)
+        if bloque:
+            opciones_lectura.block_size = bloque
+        tipos = {col: self._tipo_arrow(self.tipos.get(col, 'texto'), estricto) for col in encabezado}
+        return {
+            'read_options': opciones_lectura,
+            'parse_options': self.csv.ParseOptions(delimiter='|'),
+            'convert_options': self.csv.ConvertOptions(column_types=tipos, strings_can_be_null=True),
+        }
+
+    @staticmethod
+    def _encabezado(abrir) -> List[str]:
+        with abrir() as raw:
+            linea = raw.readline().decode('latin-1').rstrip('\r\n')
+        if not linea:
+            raise pd.errors.EmptyDataError("No columns to parse from file")
+        return linea.split('|')
+
+    def _a_pandas(self, tabla, liberar: bool = False) -> pd.DataFrame:
+        # liberar (self_destruct) suelta cada columna de Arrow a medida que se convierte; solo si nadie más usa la tabla
+        df = tabla.to_pandas(types_mapper=self._tipos_pandas.get, split_blocks=True, self_destruct=liberar)
+        for col in df.columns:
+            if self.tipos.get(col) == 'fecha':
+                df[col] = convertir_fechas(df[col])
+        return df
+
+    def read(self, abrir) -> pd.DataFrame:
+        """Lee el archivo completo; abrir es un callable que retorna un stream binario nuevo."""
+        encabezado = self._encabezado(abrir)
+        try:
+            with abrir() as raw:
+                tabla = self.csv.read_csv(raw, **self._opciones(encabezado, estricto=True))
+        except self.pa.ArrowInvalid as e:
+            logger.warning(f"Lectura tipada con pyarrow fallida ({e}); se reintenta con las columnas numéricas como texto.")
+            with abrir() as raw:
+                tabla = self.csv.read_csv(raw, **self._opciones(encabezado, estricto=False))
+        return self._a_pandas(tabla, liberar=True)
+
+    def iter_chunks(self, abrir, chunk_rows: int) -> Iterator[pd.DataFrame]:
+        """Lectura en streaming en bloques de chunk_rows filas; ante un valor inválido retoma sin tipos desde la fila pendiente."""
+        encabezado = self._encabezado(abrir)
+        entregadas = 0
+        try:
+            for df in self._iter_tablas(abrir, encabezado, chunk_rows, estricto=True):
+                entregadas += len(df)
+                yield df
+        except self.pa.ArrowInvalid as e:
+            logger.warning(f"Lectura tipada con pyarrow fallida ({e}); se retoma desde la fila {entregadas} con las columnas numéricas como texto.")
+            yield from self._iter_tablas(abrir, encabezado, chunk_rows, estricto=False, saltar_filas=entregadas)
+
+    def _iter_tablas(self, abrir, encabezado, chunk_rows, estricto, saltar_filas=0):
+        pendientes, filas = [], 0
+        with abrir() as raw:
+            lector = self.csv.open_csv(raw, **self._opciones(encabezado, estricto, saltar_filas, bloque=1 << 22))
+            for lote in lector:
+                pendientes.append(lote)
+                filas += lote.num_rows
+                while filas >= chunk_rows:
+                    tabla = self.pa.Table.from_batches(pendientes)
+                    resto = tabla.slice(chunk_rows)
+                    yield self._a_pandas(tabla.slice(0, chunk_rows))
+                    pendientes, filas = resto.to_batches(), resto.num_rows
+            if filas:
+                yield self._a_pandas(self.pa.Table.from_batches(pendientes))
+
+
+@dataclass
+class ResumenETL:
+    """Contadores de una ejecución de pipeline; se evalúa como verdadero si terminó sin errores."""
+    exito: bool = True
+    filas_extraidas: int = 0
+    filas_cargadas: int = 0
+    filas_omitidas: int = 0
+    filas_rechazadas: int = 0
+    filas_eliminadas: int = 0
+    archivos_fallidos: List[str] = field(default_factory=list)
+    filas_por_archivo: Dict[str, int] = field(default_factory=dict)
+    # Mediciones por etapa tomadas en el proceso que corrió el pipeline (ver app/metrics.py)
+    metricas: List[Medicion] = field(default_factory=list)
+
+    def __bool__(self) -> bool:
+        return self.exito
+
+    def marcar_fallidos(self, rutas: List[Origen]) -> None:
+        """Agrega a archivos_fallidos las rutas que todavía no figuran, sin perder las ya registradas."""
+        for ruta in map(str, rutas):
+            if ruta not in self.archivos_fallidos:
+                self.archivos_fallidos.append(ruta)
+
+    def combinar(self, otro: 'ResumenETL') -> 'ResumenETL':
+        return ResumenETL(
+            exito=self.exito and otro.exito,
+            filas_extraidas=self.filas_extraidas + otro.filas_extraidas,
+            filas_cargadas=self.filas_cargadas + otro.filas_cargadas,
+            filas_omitidas=self.filas_omitidas + otro.filas_omitidas,
+            filas_rechazadas=self.filas_rechazadas + otro.filas_rechazadas,
+            filas_eliminadas=self.filas_eliminadas + otro.filas_eliminadas,
+            archivos_fallidos=self.archivos_fallidos + otro.archivos_fallidos,
+            filas_por_archivo={**self.filas_por_archivo, **otro.filas_por_archivo},
+            metricas=self.metricas + otro.metricas,
+        )
+
+
+def _copy_from_dataframe(connection, tabla: str, df: pd.DataFrame) -> None:
+    """Vuelca el DataFrame en `tabla` (mismas columnas) con COPY FROM STDIN sobre la conexión de SQLAlchemy."""
+    buffer = StringIO()
+    df.to_csv(buffer, index=False, header=False, na_rep='\\N', date_format='%Y-%m-%d')
+    buffer.seek(0)
+    with connection.connection.cursor() as cursor:
+        cursor.copy_expert(f"COPY {tabla} ({', '.join(df.columns)}) FROM STDIN WITH (FORMAT csv, NULL '\\N')", buffer)
+
+
+class Loader:
+    def __init__(self, db_url: str, schema: str, table: str, conflict_columns: Optional[List[str]] = None,
+                 key_columns: Optional[List[str]] = None):
+        self.engine = get_engine(db_url)
+        self.schema = schema
+        self.table = table
+        self.full_table_name = f"{self.schema}.{self.table}"
+        self.conflict_columns = list(conflict_columns or [])
+        # Columnas del DataFrame que identifican una fila; la de conflicto puede ser generada (cui)
+        self.key_columns = list(key_columns or self.conflict_columns)
+        self.estadisticas = {'insertadas': 0, 'actualizadas': 0, 'omitidas': 0, 'errores': 0}
+
+    def load_data(self, df: pd.DataFrame) -> bool:
+        logger.info(f"Iniciando carga de {len(df)} filas a {self.full_table_name}")
+        insert_count = 0
+        error_count = 0
+        # Las fechas que llegan como datetime64 (transformación fusionada) se pasan como date, igual que en la clásica
+        columnas_fecha = df.select_dtypes(include='datetime64').columns
+        if len(columnas_fecha):
+            df = df.assign(**{col: df[col].dt.date for col in columnas_fecha})
+        df_prepared = df.replace({np.nan: None})
+
+        with self.engine.connect() as connection:
+            with connection.begin() as transaction:
+                for index, row in df_prepared.iterrows():
+                    savepoint = connection.begin_nested()
+                    try:
+                        columns = ', '.join(row.index)
+                        placeholders = ', '.join([f":{col}" for col in row.index])
+                        stmt = text(f"INSERT INTO {self.full_table_name} ({columns}) VALUES ({placeholders})")
+                        connection.execute(stmt, row.to_dict())
+                        savepoint.commit()
+                        insert_count += 1
+                    except Exception as e:
+                        savepoint.rollback()
+                        error_count += 1
+                        logger.error(f"Error al insertar fila {index} en {self.full_table_name}: {e}")
+                        logger.debug(f"Datos de la fila con error: {row.to_dict()}")
+
+        self.estadisticas = {'insertadas': insert_count, 'actualizadas': 0, 'omitidas': 0, 'errores': error_count}
+        logger.info(f"Carga completada: {insert_count} filas insertadas, {error_count} errores.")
+        return error_count == 0
+
+    def load_data_copy(self, df: pd.DataFrame, on_conflict: str = 'nothing') -> bool:
+        """
+        Carga masiva: vuelca el DataFrame a una tabla temporal con COPY FROM STDIN y
+        la fusiona con la tabla destino en un único INSERT ... ON CONFLICT.
+        """
+        if on_conflict not in ON_CONFLICT_POLICIES:
+            raise ValueError(f"Política ON CONFLICT no soportada: {on_conflict}")
+        if not self.conflict_columns:
+            raise ValueError(f"No hay columnas de conflicto definidas para {self.full_table_name}")
+
+        total = len(df)
+        logger.info(f"Iniciando carga masiva (COPY) de {total} filas a {self.full_table_name} [on_conflict={on_conflict}]")
+        self.estadisticas = {'insertadas': 0, 'actualizadas': 0, 'omitidas': 0, 'errores': 0}
+        if total == 0:
+            return True
+
+        # Dos filas del lote con la misma clave harían fallar el ON CONFLICT DO UPDATE ("cannot affect row a
+        # second time"). Con update prevalece la última, como en load_data_diff; con nothing, la primera.
+        claves = [col for col in self.key_columns if col in df.columns]
+        if claves:
+            df_unico = df.drop_duplicates(claves, keep='last' if on_conflict == 'update' else 'first')
+        else:
+            df_unico = df.drop_duplicates()
+        duplicadas_lote = total - len(df_unico)
+
+        try:
+            with self.engine.begin() as connection:
+                resultados = self._copy_merge(connection, df_unico, on_conflict)
+        except Exception as e:
+            self.estadisticas['errores'] = total
+            logger.error(f"Error en la carga masiva a {self.full_table_name}: {e}")
+            return False
+
+        insertadas = sum(1 for (es_nueva,) in resultados if es_nueva)
+        actualizadas = len(resultados) - insertadas
+        omitidas = total - insertadas - actualizadas
+        self.estadisticas = {'insertadas': insertadas, 'actualizadas': actualizadas, 'omitidas': omitidas, 'errores': 0}
+        logger.info(
+            f"Carga masiva completada: {insertadas} insertadas, {actualizadas} actualizadas, "
+            f"{omitidas} omitidas ({duplicadas_lote} duplicadas dentro del lote)."
+        )
+        return True
+
+    def _copy_merge(self, connection, df: pd.DataFrame, on_conflict: str) -> list:
+        """COPY del DataFrame a una tabla temporal y merge con la tabla destino dentro de la transacción dada."""
+        columnas = list(df.columns)
+        lista_columnas = ', '.join(columnas)
+        staging = f"stg_{self.table.strip('_')}"
+        connection.execute(text(
+            f"CREATE TEMP TABLE {staging} ON COMMIT DROP AS "
+            f"SELECT {lista_columnas} FROM {self.full_table_name} WITH NO DATA"
+        ))
+        _copy_from_dataframe(connection, staging, df)
+        return connection.execute(text(self._build_merge_sql(staging, columnas, on_conflict))).fetchall()
+
+    def load_data_diff(self, diff: 'DiffSnapshot', snapshot: 'SnapshotFingerprints') -> bool:
+        """
+        Aplica en una sola transacción el diff contra el último snapshot: upsert (COPY + ON CONFLICT DO UPDATE)
+        de las filas nuevas o cambiadas, borrado de las que ya no vienen y actualización de las huellas.
+        """
+        self.estadisticas = {'insertadas': 0, 'actualizadas': 0, 'omitidas': diff.sin_cambios, 'eliminadas': 0, 'errores': 0}
+        logger.info(
+            f"Carga por diff a {self.full_table_name}: {len(diff.cambios)} filas nuevas o cambiadas, "
+            f"{len(diff.eliminadas)} eliminadas, {diff.sin_cambios} sin cambios"
+        )
+        try:
+            with self.engine.begin() as connection:
+                resultados = self._copy_merge(connection, diff.cambios, 'update') if len(diff.cambios) else []
+                eliminadas = snapshot.aplicar(connection, diff)
+        except Exception as e:
+            self.estadisticas['errores'] = len(diff.cambios) + len(diff.eliminadas)
+            logger.error(f"Error en la carga por diff a {self.full_table_name}: {e}")
+            return False
+
+        insertadas = sum(1 for (es_nueva,) in resultados if es_nueva)
+        actualizadas = len(resultados) - insertadas
+        # Las filas enviadas que resultaron idénticas a las de destino también cuentan como omitidas
+        omitidas = diff.sin_cambios + len(diff.cambios) - insertadas - actualizadas
+        self.estadisticas = {'insertadas': insertadas, 'actualizadas': actualizadas, 'omitidas': omitidas,
+                             'eliminadas': eliminadas, 'errores': 0}
+        logger.info(f"Carga por diff completada: {insertadas} insertadas, {actualizadas} actualizadas, "
+                    f"{eliminadas} eliminadas, {omitidas} omitidas.")
+        return True
+
+    def _build_merge_sql(self, staging: str, columnas: List[str], on_conflict: str) -> str:
+        lista_columnas = ', '.join(columnas)
+        conflicto = ', '.join(self.conflict_columns)
+        sql = f"INSERT INTO {self.full_table_name} AS t ({lista_columnas}) SELECT {lista_columnas} FROM {staging} "
+
+        columnas_update = [col for col in columnas if col not in self.conflict_columns]
+        if on_conflict == 'nothing' or not columnas_update:
+            return sql + f"ON CONFLICT ({conflicto}) DO NOTHING RETURNING true"
+
+        # Solo se reescriben las filas que realmente cambiaron; las idénticas cuentan como omitidas.
+        # xmax = 0 distingue una fila recién insertada de una actualizada.
+        asignaciones = ', '.join(f"{col} = EXCLUDED.{col}" for col in columnas_update)
+        actuales = ', '.join(f"t.{col}" for col in columnas_update)
+        nuevas = ', '.join(f"EXCLUDED.{col}" for col in columnas_update)
+        return sql + (
+            f"ON CONFLICT ({conflicto}) DO UPDATE SET {asignaciones} "
+            f"WHERE ({actuales}) IS DISTINCT FROM ({nuevas}) "
+            f"RETURNING (t.xmax = 0)"
+        )
+
+
+def construir_claves(df: pd.DataFrame, key_columns: List[str], separador: str = '|') -> pd.Series:
+    """Clave única de cada fila como texto; coincide con COALESCE(col::text, '') || separador || ... en SQL."""
+    claves = None
+    for col in key_columns:
+        valores = df[col].astype('string').fillna('')
+        claves = valores if claves is None else claves + separador + valores
+    return claves
+
+
+def _clave_sql(key_columns: List[str], alias: str = 't', separador: str = '|') -> str:
+    return f" || '{separador}' || ".join(f"COALESCE({alias}.{col}::text, '')" for col in key_columns)
+
+
+class ExistingKeyCache:
+    """
+    Claves únicas ya presentes en la tabla destino, consultadas una sola vez por
+    (ruc, periodo_tributario) durante una ejecución.
+    """
+    SEPARADOR = '|'
+
+    def __init__(self, engine, full_table_name: str, key_columns: List[str]):
+        self.engine = engine
+        self.full_table_name = full_table_name
+        self.key_columns = list(key_columns)
+        self._claves = {}
+        self.consultas = 0
+
+    def _build_keys(self, df: pd.DataFrame) -> pd.Series:
+        return construir_claves(df, self.key_columns, self.SEPARADOR)
+
+    def _fetch(self, grupos: List[tuple]) -> None:
+        """Trae en una sola consulta las claves existentes de todos los grupos aún no cacheados."""
+        pendientes = [g for g in grupos if g not in self._claves]
+        if not pendientes:
+            return
+
+        clave_sql = _clave_sql(self.key_columns, 't', self.SEPARADOR)
+        valores_sql = ', '.join(f"(CAST(:ruc_{i} AS bigint), CAST(:periodo_{i} AS integer))" for i in range(len(pendientes)))
+        params = {}
+        for i, (ruc, periodo) in enumerate(pendientes):
+            params[f"ruc_{i}"] = ruc
+            params[f"periodo_{i}"] = periodo
+
+        query = text(
+            f"SELECT v.ruc, v.periodo, {clave_sql} FROM {self.full_table_name} t "
+            f"JOIN (VALUES {valores_sql}) AS v(ruc, periodo) "
+            f"ON t.ruc = v.ruc AND t.periodo_tributario IS NOT DISTINCT FROM v.periodo"
+        )
+        encontradas = {grupo: set() for grupo in pendientes}
+        with self.engine.connect() as connection:
+            for ruc, periodo, clave in connection.execute(query, params):
+                encontradas[(ruc, periodo)].add(clave)
+        self._claves.update(encontradas)
+        self.consultas += 1
+
+    @staticmethod
+    def _grupos(df: pd.DataFrame) -> List[tuple]:
+        pares = df[['ruc', 'periodo_tributario']].drop_duplicates()
+        return [
+            (None if pd.isna(ruc) else int(ruc), None if pd.isna(periodo) else int(periodo))
+            for ruc, periodo in pares.itertuples(index=False)
+        ]
+
+    def filter_new(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Anti-join contra las claves existentes; también descarta claves repetidas dentro del lote."""
+        if df.empty or not all(col in df.columns for col in ['ruc', 'periodo_tributario', *self.key_columns]):
+            return df
+
+        grupos = self._grupos(df)
+        self._fetch(grupos)
+        existentes = set().union(*(self._claves[g] for g in grupos))
+
+        claves = self._build_keys(df)
+        ya_existen = claves.isin(existentes)
+        repetidas = claves.duplicated() & ~ya_existen
+        df_nuevas = df[~(ya_existen | repetidas)]
+
+        logger.info(
+            f"Filtro de duplicados previo a la carga: {len(df)} -> {len(df_nuevas)} filas "
+            f"({int(ya_existen.sum())} ya existentes en {self.full_table_name}, {int(repetidas.sum())} repetidas en el lote)"
+        )
+        return df_nuevas
+
+    def register(self, df: pd.DataFrame) -> None:
+        """Añade a la caché las claves recién cargadas para que no se reenvíen en esta ejecución."""
+        if df.empty:
+            return
+        claves = self._build_keys(df)
+        for (ruc, periodo), grupo in claves.groupby([df['ruc'], df['periodo_tributario']], dropna=False):
+            grupo_key = (None if pd.isna(ruc) else int(ruc), None if pd.isna(periodo) else int(periodo))
+            self._claves.setdefault(grupo_key, set()).update(grupo)
+
+
+class RowKeyIndex:
+    """
+    Estrategia row_by_row_check de VERIFICATION_STRATEGIES (duplicate_action 'skip') como paso de conjunto:
+    las claves id_columns ya presentes en destino se cargan una vez por RUC, con una sola consulta COPY para
+    todos los RUC nuevos del lote, en un arreglo ordenado de hashes de 64 bits (8 bytes por clave, en vez de
+    un str por clave como ExistingKeyCache). Las filas entrantes se filtran con searchsorted, sin una
+    consulta ni un insert fallido por fila.
+
+    El hash incluye el RUC, así que la misma guía de dos emisores no se confunde. Dos claves distintas con
+    el mismo hash harían omitir una fila nueva: con un millón de claves la probabilidad es del orden de 1e-8.
+    """
+    SEPARADOR = '|'
+
+    def __init__(self, engine, full_table_name: str, id_columns: List[str], scope_column: str = 'ruc'):
+        self.engine = engine
+        self.full_table_name = full_table_name
+        self.key_columns = [scope_column] + list(id_columns)
+        self.scope_column = scope_column
+        self._hashes = np.empty(0, dtype=np.uint64)
+        self._ambitos = set()
+        self.consultas = 0
+
+    @classmethod
+    def from_strategy(cls, engine, schema: str, strategy: dict, scope_column: str = 'ruc') -> 'RowKeyIndex':
+        if strategy.get('method') != 'row_by_row_check' or strategy.get('duplicate_action') != 'skip':
+            raise ValueError(f"Estrategia no soportada por RowKeyIndex: {strategy}")
+        return cls(engine, f"{schema}.{strategy['table']}", strategy['id_columns'], scope_column)
+
+    def __len__(self) -> int:
+        return len(self._hashes)
+
+    @property
+    def nbytes(self) -> int:
+        return self._hashes.nbytes
+
+    def _hash(self, claves) -> np.ndarray:
+        # categorize=False: mismo hash, sin factorizar antes (las claves casi no se repiten)
+        return pd.util.hash_array(np.asarray(claves, dtype=object), categorize=False)
+
+    def _agregar(self, hashes: np.ndarray) -> None:
+        # sort + descarte de vecinos iguales; np.union1d es mucho más lento en uint64
+        combinados = np.sort(np.concatenate([self._hashes, hashes]))
+        if len(combinados):
+            combinados = combinados[np.concatenate(([True], combinados[1:] != combinados[:-1]))]
+        self._hashes = combinados
+
+    def _fetch(self, ambitos: List[int]) -> np.ndarray:
+        """Claves existentes de los RUC dados, como texto; con COPY TO STDOUT porque pueden ser cientos de miles."""
+        consulta = (
+            f"SELECT {_clave_sql(self.key_columns, 't', self.SEPARADOR)} FROM {self.full_table_name} t "
+            f"WHERE t.{self.scope_column} IN ({', '.join(str(int(a)) for a in ambitos)})"
+        )
+        buffer = StringIO()
+        with self.engine.connect() as connection, connection.connection.cursor() as cursor:
+            cursor.copy_expert(f"COPY ({consulta}) TO STDOUT", buffer)
+        self.consultas += 1
+        # Formato text de COPY: una clave por línea; las claves de guía no llevan tabuladores ni barras invertidas
+        return np.array(buffer.getvalue().splitlines(), dtype=object)
+
+    def load(self, ambitos) -> None:
+        """Carga las claves de los RUC que todavía no están en el índice."""
+        pendientes = sorted({int(a) for a in ambitos if not pd.isna(a)} - self._ambitos)
+        if not pendientes:
+            return
+        claves = self._fetch(pendientes)
+        if len(claves):
+            self._agregar(self._hash(claves))
+        self._ambitos.update(pendientes)
+
+    def contains(self, hashes: np.ndarray) -> np.ndarray:
+        if not len(self._hashes):
+            return np.zeros(len(hashes), dtype=bool)
+        posicion = np.searchsorted(self._hashes, hashes).clip(max=len(self._hashes) - 1)
+        return self._hashes[posicion] == hashes
+
+    def filter_new(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Descarta las filas cuya clave ya existe en destino y las repetidas dentro del lote (queda la primera)."""
+        if df.empty:
+            return df
+        self.load(df[self.scope_column].unique())
+        hashes = self._hash(construir_claves(df, self.key_columns, self.SEPARADOR))
+        ya_existen = self.contains(hashes)
+        repetidas = pd.Series(hashes).duplicated().to_numpy() & ~ya_existen
+        df_nuevas = df[~(ya_existen | repetidas)]
+        logger.info(
+            f"Verificación row_by_row_check: {len(df)} -> {len(df_nuevas)} filas "
+            f"({int(ya_existen.sum())} ya existentes en {self.full_table_name}, {int(repetidas.sum())} repetidas en el lote)"
+        )
+        return df_nuevas
+
+    def register(self, df: pd.DataFrame) -> None:
+        """Añade al índice las claves recién cargadas para que no se reenvíen en esta ejecución."""
+        if not df.empty:
+            self._agregar(self._hash(construir_claves(df, self.key_columns, self.SEPARADOR)))
+
+
+def huella_filas(df: pd.DataFrame) -> np.ndarray:
+    """
+    Hash de 64 bits del contenido de cada fila, estable entre modos de transformación y motores de lectura:
+    las fechas se comparan como días, las categorías por su valor y las columnas vacías como una constante.
+    """
+    columnas = {}
+    for col in df.columns:
+        serie = df[col]
+        if isinstance(serie.dtype, pd.CategoricalDtype):
+            serie = serie.astype(object)
+        if serie.dtype == object and pd.api.types.infer_dtype(serie, skipna=True) == 'date':
+            serie = pd.to_datetime(serie)
+        if pd.api.types.is_datetime64_any_dtype(serie):
+            serie = pd.Series(serie.values.astype('datetime64[D]').view('int64'))
+        elif serie.isna().all():
+            serie = pd.Series(np.zeros(len(serie), dtype='int64'))
+        columnas[col] = serie.reset_index(drop=True)
+    return pd.util.hash_pandas_object(pd.DataFrame(columnas), index=False).values.view('int64')
+
+
+@dataclass
+class DiffSnapshot:
+    """Resultado de comparar una propuesta con el último snapshot cargado de sus (ruc, periodo)."""
+    cambios: pd.DataFrame     # filas nuevas o cambiadas (y las que no tienen ruc/periodo), a cargar con upsert
+    huellas: pd.DataFrame     # ruc, periodo, clave, huella de las filas de `cambios` con snapshot
+    eliminadas: pd.DataFrame  # ruc, periodo, clave del snapshot anterior que ya no vienen en la propuesta
+    sin_cambios: int = 0
+
+
+class SnapshotFingerprints:
+    """
+    Huella compacta del último snapshot cargado de cada (ruc, periodo): la clave única de cada fila y un hash
+    de 64 bits de su contenido, en la tabla <schema>.huellas_sire. Una propuesta nueva del mismo periodo se
+    compara contra ella y solo se envían a destino las filas insertadas, cambiadas o eliminadas.
+    La primera carga de un (ruc, periodo) con este modo envía todas sus filas y deja la huella de base.
+    """
+    TABLA = 'huellas_sire'
+    SEPARADOR = ExistingKeyCache.SEPARADOR
+    COLUMNAS = ['ruc', 'periodo', 'clave', 'huella']
+
+    def __init__(self, engine, schema: str, full_table_name: str, key_columns: List[str]):
+        self.engine = engine
+        self.full_table_name = full_table_name
+        self.key_columns = list(key_columns)
+        self.tabla_huellas = f"{schema}.{self.TABLA}"
+        self._tabla_lista = False
+
+    def _preparar(self) -> None:
+        if self._tabla_lista:
+            return
+        with self.engine.begin() as connection:
+            connection.execute(text(
+                f"CREATE TABLE IF NOT EXISTS {self.tabla_huellas} ("
+                f"tabla text NOT NULL, ruc bigint NOT NULL, periodo integer NOT NULL, "
+                f"clave text NOT NULL, huella bigint NOT NULL, PRIMARY KEY (tabla, ruc, periodo, clave))"
+            ))
+        self._tabla_lista = True
+
+    def _fetch(self, grupos: List[tuple]) -> pd.DataFrame:
+        """Huellas guardadas de los grupos dados; con COPY TO STDOUT porque un periodo puede tener cientos de miles."""
+        vacio = pd.DataFrame({'ruc': pd.Series(dtype='int64'), 'periodo': pd.Series(dtype='int64'),
+                              'clave': pd.Series(dtype=object), 'huella': pd.Series(dtype='int64')})
+        if not grupos:
+            return vacio
+        valores = ', '.join(f"({int(ruc)}, {int(periodo)})" for ruc, periodo in grupos)
+        consulta = (
+            f"SELECT h.ruc, h.periodo, h.clave, h.huella FROM {self.tabla_huellas} h "
+            f"JOIN (VALUES {valores}) AS v(ruc, periodo) ON h.ruc = v.ruc AND h.periodo = v.periodo "
+            f"WHERE h.tabla = '{self.full_table_name}'"
+        )
+        buffer = StringIO()
+        with self.engine.connect() as connection, connection.connection.cursor() as cursor:
+            cursor.copy_expert(f"COPY ({consulta}) TO STDOUT WITH (FORMAT csv)", buffer)
+        if not buffer.tell():
+            return vacio
+        buffer.seek(0)
+        return pd.read_csv(buffer, header=None, names=self.COLUMNAS, keep_default_na=False,
+                           dtype={'ruc': 'int64', 'periodo': 'int64', 'clave': str, 'huella': 'int64'})
+
+    def diff(self, df: pd.DataFrame) -> DiffSnapshot:
+        self._preparar()
+        con_grupo = (df['ruc'].notna() & df['periodo_tributario'].notna()).to_numpy()
+        # Sin (ruc, periodo) no hay snapshot con qué comparar: esas filas se envían siempre
+        sin_grupo = df[~con_grupo]
+        df = df[con_grupo]
+        nuevas = pd.DataFrame({
+            'ruc': df['ruc'].astype('int64').to_numpy(),
+            'periodo': df['periodo_tributario'].astype('int64').to_numpy(),
+            'clave': construir_claves(df, self.key_columns, self.SEPARADOR).to_numpy(),
+            'huella': huella_filas(df),
+        })
+        # Con una clave repetida en la propuesta prevalece la última fila, como en un upsert fila por fila
+        ultimas = ~nuevas.duplicated(['ruc', 'periodo', 'clave'], keep='last').to_numpy()
+        df, nuevas = df[ultimas], nuevas[ultimas].reset_index(drop=True)
+
+        previas = self._fetch(list(nuevas[['ruc', 'periodo']].drop_duplicates().itertuples(index=False, name=None)))
+        if len(previas):
+            hash_previas, hash_nuevas = self._hash_claves(previas), self._hash_claves(nuevas)
+            posicion = self._emparejar(hash_previas, previas['clave'], hash_nuevas, nuevas['clave'])
+            cambiadas = (posicion == -1) | (previas['huella'].to_numpy()[posicion] != nuevas['huella'].to_numpy())
+            no_vienen = self._emparejar(hash_nuevas, nuevas['clave'], hash_previas, previas['clave']) == -1
+            eliminadas = previas.loc[no_vienen, ['ruc', 'periodo', 'clave']]
+        else:
+            cambiadas = np.ones(len(nuevas), dtype=bool)
+            eliminadas = previas[['ruc', 'periodo', 'clave']]
+
+        cambios = pd.concat([df[cambiadas], sin_grupo]) if len(sin_grupo) else df[cambiadas]
+        return DiffSnapshot(cambios, nuevas[cambiadas], eliminadas, int((~cambiadas).sum()))
+
+    @staticmethod
+    def _hash_claves(df: pd.DataFrame) -> pd.Index:
+        return pd.Index(pd.util.hash_pandas_object(df[['ruc', 'periodo', 'clave']], index=False).to_numpy())
+
+    @staticmethod
+    def _emparejar(hashes: pd.Index, claves: pd.Series, hashes_buscadas: pd.Index, claves_buscadas: pd.Series) -> np.ndarray:
+        """
+        Posición en `hashes` de cada clave buscada, o -1. Se busca por un hash de 64 bits de (ruc, periodo, clave)
+        (una tabla hash, mucho más rápida que ordenar un MultiIndex) y se confirma comparando el texto de la clave.
+        """
+        posicion = hashes.get_indexer(hashes_buscadas)
+        encontradas = posicion >= 0
+        # Una colisión de hash no debe emparejar claves distintas: esas filas se tratan como no encontradas
+        distintas = claves.to_numpy()[posicion[encontradas]] != claves_buscadas.to_numpy()[encontradas]
+        posicion[np.flatnonzero(encontradas)[distintas]] = -1
+        return posicion
+
+    def aplicar(self, connection, diff: DiffSnapshot) -> int:
+        """Borra de destino las filas eliminadas y actualiza las huellas, dentro de la transacción de la carga."""
+        eliminadas = 0
+        if len(diff.eliminadas):
+            connection.execute(text("CREATE TEMP TABLE stg_eliminadas (ruc bigint, periodo integer, clave text) ON COMMIT DROP"))
+            _copy_from_dataframe(connection, 'stg_eliminadas', diff.eliminadas)
+            eliminadas = connection.execute(text(
+                f"DELETE FROM {self.full_table_name} t USING stg_eliminadas e "
+                f"WHERE t.ruc = e.ruc AND t.periodo_tributario = e.periodo "
+                f"AND ({_clave_sql(self.key_columns, 't', self.SEPARADOR)}) = e.clave"
+            )).rowcount
+            connection.execute(text(
+                f"DELETE FROM {self.tabla_huellas} h USING stg_eliminadas e "
+                f"WHERE h.tabla = :tabla AND h.ruc = e.ruc AND h.periodo = e.periodo AND h.clave = e.clave"
+            ), {'tabla': self.full_table_name})
+        if len(diff.huellas):
+            connection.execute(text(
+                "CREATE TEMP TABLE stg_huellas (ruc bigint, periodo integer, clave text, huella bigint) ON COMMIT DROP"
+            ))
+            _copy_from_dataframe(connection, 'stg_huellas', diff.huellas)
+            connection.execute(text(
+                f"INSERT INTO {self.tabla_huellas} (tabla, ruc, periodo, clave, huella) "
+                f"SELECT :tabla, ruc, periodo, clave, huella FROM stg_huellas "
+                f"ON CONFLICT (tabla, ruc, periodo, clave) DO UPDATE SET huella = EXCLUDED.huella"
+            ), {'tabla': self.full_table_name})
+        return eliminadas
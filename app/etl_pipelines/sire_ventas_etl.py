@@ -1,48 +1,102 @@
-import os
-import zipfile
+import io
 import logging
 import numpy as np
 import pandas as pd
-from io import StringIO
-from sqlalchemy import create_engine, text
-from typing import List, Optional
+from typing import Iterator, List, Optional
 
+from app.archive_stream import Origen, iter_miembros, nombre_fuente, por_extension, tamano_fuente
 from app.config import config, COLUMN_MAPPING_VENTAS
+from app.etl_pipelines.sire_common import (
+    Loader, ExistingKeyCache, LectorArrow, ResumenETL, SnapshotFingerprints, LOAD_MODES, READ_ENGINES, TRANSFORM_MODES, convertir_fechas, convertir_periodo
+)
+from app.metrics import metrics
 
 # Configuración de logging
 logger = logging.getLogger(__name__)
 
+# Nombre del pipeline en las métricas por etapa
+PIPELINE = 'sire_ventas'
+
+# Archivos de propuesta que lee el extractor, sueltos o dentro de comprimidos (anidados o no)
+EXTENSIONES_PROPUESTA = ('.txt',)
+
+
 class Extractor:
     @staticmethod
-    def extract_files(rutas_archivos: List[str]) -> List[pd.DataFrame]:
+    def extract_files(rutas_archivos: List[Origen], archivos_fallidos: Optional[List[str]] = None,
+                      lector: Optional[LectorArrow] = None) -> List[pd.DataFrame]:
+        """
+        Con un LectorArrow, los .txt se leen con pyarrow y columnas tipadas en lugar de pandas.
+        Cada ruta puede ser un archivo local o una Fuente en memoria; los miembros de comprimidos se leen
+        como streams, sin extraerlos a disco.
+        """
         lista_dataframes = []
         logger.info("Iniciando fase de extracción para SIRE Ventas")
 
         for ruta in rutas_archivos:
             try:
-                logger.info(f"Procesando archivo: {os.path.basename(ruta)}")
-                if ruta.lower().endswith('.zip'):
-                    with zipfile.ZipFile(ruta, 'r') as zip_ref:
-                        for nombre_archivo in zip_ref.namelist():
-                            if nombre_archivo.lower().endswith('.txt'):
-                                with zip_ref.open(nombre_archivo) as file:
-                                    content = file.read().decode('latin-1', errors='replace')
-                                    # CORRECCIÓN: Usar header=0 para leer el encabezado del archivo
-                                    df = pd.read_csv(StringIO(content), sep='|', header=0, dtype=str)
-                                    lista_dataframes.append(df)
-                elif ruta.lower().endswith('.txt'):
-                    # CORRECCIÓN: Usar header=0 para leer el encabezado del archivo
-                    df = pd.read_csv(ruta, sep='|', header=0, dtype=str, encoding='latin-1')
-                    lista_dataframes.append(df)
+                logger.info(f"Procesando archivo: {nombre_fuente(ruta)}")
+                for nombre, abrir in iter_miembros(ruta, por_extension(*EXTENSIONES_PROPUESTA)):
+                    if lector is not None and nombre.lower().endswith('.txt'):
+                        lista_dataframes.append(lector.read(abrir))
+                        continue
+                    with abrir() as raw, io.TextIOWrapper(raw, encoding='latin-1', errors='replace') as file:
+                        lista_dataframes.append(pd.read_csv(file, sep='|', header=0, dtype=str))
             except pd.errors.EmptyDataError:
-                logger.warning(f"Archivo omitido: '{os.path.basename(ruta)}' no contiene datos o columnas.")
+                logger.warning(f"Archivo omitido: '{nombre_fuente(ruta)}' no contiene datos o columnas.")
             except Exception as e:
-                logger.error(f"Error al procesar '{os.path.basename(ruta)}': {e}")
+                logger.error(f"Error al procesar '{nombre_fuente(ruta)}': {e}")
+                if archivos_fallidos is not None:
+                    archivos_fallidos.append(str(ruta))
 
         return lista_dataframes
 
+    @staticmethod
+    def iter_chunks(rutas_archivos: List[Origen], chunk_rows: int,
+                    archivos_fallidos: Optional[List[str]] = None,
+                    lector: Optional[LectorArrow] = None) -> Iterator[pd.DataFrame]:
+        """
+        Variante en streaming de extract_files: decodifica cada miembro al vuelo y entrega
+        bloques de chunk_rows filas sin materializar el archivo completo en memoria.
+        """
+        logger.info(f"Iniciando extracción en streaming para SIRE Ventas (bloques de {chunk_rows} filas)")
+
+        for ruta in rutas_archivos:
+            try:
+                logger.info(f"Procesando archivo: {nombre_fuente(ruta)}")
+                for nombre, abrir in iter_miembros(ruta, por_extension(*EXTENSIONES_PROPUESTA)):
+                    if lector is not None and nombre.lower().endswith('.txt'):
+                        yield from lector.iter_chunks(abrir, chunk_rows)
+                        continue
+                    with abrir() as raw, io.TextIOWrapper(raw, encoding='latin-1', errors='replace') as file, \
+                            pd.read_csv(file, sep='|', header=0, dtype=str, chunksize=chunk_rows) as reader:
+                        yield from reader
+            except pd.errors.EmptyDataError:
+                logger.warning(f"Archivo omitido: '{nombre_fuente(ruta)}' no contiene datos o columnas.")
+            except Exception as e:
+                logger.error(f"Error al procesar '{nombre_fuente(ruta)}': {e}")
+                if archivos_fallidos is not None:
+                    archivos_fallidos.append(str(ruta))
+
 
 class Transformer:
+    COLUMNAS_VALOR = [
+        'BI Gravada', 'Dscto BI', 'IGV / IPM', 'Dscto IGV / IPM',
+        'Mto Exonerado', 'Mto Inafecto', 'BI Grav IVAP', 'IVAP',
+        'Otros Tributos', 'Valor Facturado Exportación', 'Tipo CP/Doc.'
+    ]
+    COLUMNAS_FINALES = [
+        'ruc', 'periodo_tributario', 'tipo_comprobante', 'fecha_emision',
+        'fecha_vencimiento', 'numero_serie', 'numero_correlativo', 'numero_final', 'tipo_documento',
+        'numero_documento', 'destino', 'valor', 'igv', 'icbp', 'isc', 'otros_cargos',
+        'tipo_moneda', 'tipo_comprobante_modificado','numero_serie_modificado',
+        'numero_correlativo_modificado', 'observaciones', 'tipo_operacion'
+    ]
+    COLUMNAS_ENTERAS = ['ruc', 'tipo_comprobante', 'destino', 'tasa_detraccion', 'tipo_comprobante_modificado', 'numero_final', 'tipo_operacion']
+    COLUMNAS_FECHA = ['fecha_emision', 'fecha_vencimiento']
+    COLUMNAS_NUMERICAS = ['valor', 'igv', 'icbp', 'isc', 'otros_cargos']
+    VALORES_VACIOS = ['', ' ', 'nan']
+
     @staticmethod
     def transform_data(df: pd.DataFrame) -> pd.DataFrame:
         logging.info("Iniciando fase de transformación de SIRE Ventas")
@@ -91,15 +145,24 @@ class Transformer:
     @staticmethod
     def _aplicar_filtro_complejo(df: pd.DataFrame) -> None:
         logger.info("Aplicando filtro complejo de negocio para SIRE Ventas.")
-        columnas_valor = [
-            'BI Gravada', 'Dscto BI', 'IGV / IPM', 'Dscto IGV / IPM',
-            'Mto Exonerado', 'Mto Inafecto', 'BI Grav IVAP', 'IVAP',
-            'Otros Tributos', 'Valor Facturado Exportación', 'Tipo CP/Doc.'
-        ]
-        for col in columnas_valor:
+        for col in Transformer.COLUMNAS_VALOR:
             if col not in df.columns: df[col] = 0
             df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0)
 
+        tipo_operacion, destino, valor, igv, otros_cargos = Transformer._calcular_destino(df)
+        df['tipo_operacion'] = tipo_operacion
+        df['destino'] = destino
+        df['valor'] = valor
+        df['igv'] = igv
+        df['otros_cargos'] = otros_cargos
+
+        if 'CAR SUNAT' in df.columns:
+            df.loc[df['destino'] == 99, 'CAR SUNAT'] = df['CAR SUNAT'].astype(str) + " | Revisar dinamica de destino"
+        logger.info("Lógica de negocio compleja aplicada.")
+
+    @staticmethod
+    def _calcular_destino(df) -> tuple:
+        """Dinámica de tipo de operación y destino sobre los montos ya numéricos; df puede ser un DataFrame o un dict de arrays."""
         suma_exo_inaf = df['Mto Exonerado'] + df['Mto Inafecto']
         condiciones = [
             (df['Tipo CP/Doc.'] == 7) & (df['Valor Facturado Exportación'] < 0),
@@ -124,15 +187,11 @@ class Transformer:
             df['Otros Tributos'], df['Otros Tributos'], df['Otros Tributos'] + suma_exo_inaf
         ]
 
-        df['tipo_operacion'] = np.select(condiciones, resultados_tipo_op, default=99)
-        df['destino'] = np.select(condiciones, resultados_destino, default=99)
-        df['valor'] = np.select(condiciones, resultados_valor, default=0)
-        df['igv'] = np.select(condiciones, resultados_igv, default=0)
-        df['otros_cargos'] = np.select(condiciones, resultados_otros, default=df['Otros Tributos'])
-
-        if 'CAR SUNAT' in df.columns:
-            df.loc[df['destino'] == 99, 'CAR SUNAT'] = df['CAR SUNAT'].astype(str) + " | Revisar dinamica de destino"
-        logger.info("Lógica de negocio compleja aplicada.")
+        return (np.select(condiciones, resultados_tipo_op, default=99),
+                np.select(condiciones, resultados_destino, default=99),
+                np.select(condiciones, resultados_valor, default=0),
+                np.select(condiciones, resultados_igv, default=0),
+                np.select(condiciones, resultados_otros, default=df['Otros Tributos']))
 
     @staticmethod
     def rename_columns(df: pd.DataFrame, mapping: dict) -> pd.DataFrame:
@@ -143,121 +202,262 @@ class Transformer:
         if 'observaciones' in df.columns:
             df['observaciones'] = "SIRE:" + df['observaciones'].astype(str)
 
-        columnas_finales = [
-            'ruc', 'periodo_tributario', 'tipo_comprobante', 'fecha_emision',
-            'fecha_vencimiento', 'numero_serie', 'numero_correlativo', 'numero_final', 'tipo_documento',
-            'numero_documento', 'destino', 'valor', 'igv', 'icbp', 'isc', 'otros_cargos',
-            'tipo_moneda', 'tipo_comprobante_modificado','numero_serie_modificado',
-            'numero_correlativo_modificado', 'observaciones', 'tipo_operacion'
-        ]
-        columnas_existentes = [col for col in columnas_finales if col in df.columns]
+        columnas_existentes = [col for col in Transformer.COLUMNAS_FINALES if col in df.columns]
         df_filtrado = df[columnas_existentes].copy()
-        df_filtrado = df_filtrado.replace({'': np.nan, ' ': np.nan, 'nan': np.nan})
+        df_filtrado = df_filtrado.replace(dict.fromkeys(Transformer.VALORES_VACIOS, np.nan))
         Transformer._convert_data_types(df_filtrado)
         return df_filtrado
 
     @staticmethod
     def _convert_data_types(df: pd.DataFrame) -> None:
-        if 'ruc' in df.columns: df['ruc'] = pd.to_numeric(df['ruc'], errors='coerce').astype('Int64')
-        int_columns = ['tipo_comprobante', 'destino', 'tasa_detraccion', 'tipo_comprobante_modificado', 'numero_final', 'tipo_operacion']
-        for col in int_columns:
+        for col in Transformer.COLUMNAS_ENTERAS:
             if col in df.columns: df[col] = pd.to_numeric(df[col], errors='coerce').astype('Int64')
         if 'periodo_tributario' in df.columns:
-            df['periodo_tributario'] = pd.to_datetime(df['periodo_tributario'], errors='coerce').dt.strftime('%Y%m')
+            df['periodo_tributario'] = pd.to_datetime(df['periodo_tributario'], format='%Y%m', errors='coerce').dt.strftime('%Y%m')
             df['periodo_tributario'] = pd.to_numeric(df['periodo_tributario'], errors='coerce').astype('Int64')
 
-        date_columns = ['fecha_emision', 'fecha_vencimiento']
-        for col in date_columns:
+        for col in Transformer.COLUMNAS_FECHA:
             if col in df.columns: df[col] = pd.to_datetime(df[col], errors='coerce').dt.date
 
-        numeric_cols = ['valor', 'igv', 'icbp', 'isc', 'otros_cargos']
-        for col in numeric_cols:
+        for col in Transformer.COLUMNAS_NUMERICAS:
             if col in df.columns: df[col] = pd.to_numeric(df[col], errors='coerce').round(2)
 
-
-class Loader:
-    def __init__(self, db_url: str, schema: str, table: str):
-        self.engine = create_engine(db_url)
-        self.schema = schema
-        self.table = table
-        self.full_table_name = f"{self.schema}.{self.table}"
-
-    def load_data(self, df: pd.DataFrame) -> bool:
-        logger.info(f"Iniciando carga de {len(df)} filas a {self.full_table_name}")
-        insert_count = 0
-        error_count = 0
-        df_prepared = df.replace({np.nan: None})
-
-        with self.engine.connect() as connection:
-            with connection.begin() as transaction:
-                for index, row in df_prepared.iterrows():
-                    savepoint = connection.begin_nested()
-                    try:
-                        columns = ', '.join(row.index)
-                        placeholders = ', '.join([f":{col}" for col in row.index])
-                        stmt = text(f"INSERT INTO {self.full_table_name} ({columns}) VALUES ({placeholders})")
-                        connection.execute(stmt, row.to_dict())
-                        savepoint.commit()
-                        insert_count += 1
-                    except Exception as e:
-                        savepoint.rollback()
-                        error_count += 1
-                        logger.error(f"Error al insertar fila {index} en {self.full_table_name}: {e}")
-                        logger.debug(f"Datos de la fila con error: {row.to_dict()}")
-        
-        logger.info(f"Carga completada: {insert_count} filas insertadas, {error_count} errores.")
-        return error_count == 0
+    @staticmethod
+    def transform_fused(df: pd.DataFrame, mapping: dict) -> pd.DataFrame:
+        """
+        Equivalente a rename_columns + transform_data + filter_final_columns en una sola pasada: cada
+        columna de origen se lee y se convierte una vez a su tipo final, y el resultado se arma de una
+        vez, sin copiar el DataFrame de entrada ni crear intermedios. Las fechas se parsean con el
+        formato SIRE, una vez por valor distinto, y quedan como datetime64 hasta la carga.
+        Acepta tanto texto (lectura con pandas) como las columnas ya tipadas de LectorArrow.
+        """
+        logger.info("Iniciando transformación fusionada de SIRE Ventas")
+        origen = {str(mapping.get(col, col)).strip(): col for col in df.columns}
+
+        if 'CAR SUNAT' in origen:
+            car = df[origen['CAR SUNAT']].astype(str)
+            before_count = len(df)
+            df = df[car.str.len().isin([27, 29]) | (car == '') | (car.isnull())]
+            logger.info(f"Filtro CAR SUNAT (Ventas): {before_count} -> {len(df)} filas")
+
+        montos = {
+            col: pd.to_numeric(df[origen[col]], errors='coerce').fillna(0).to_numpy() if col in origen else np.zeros(len(df), dtype=int)
+            for col in Transformer.COLUMNAS_VALOR
+        }
+        tipo_operacion, destino, valor, igv, otros_cargos = Transformer._calcular_destino(montos)
+        calculadas = {'tipo_operacion': tipo_operacion, 'destino': destino, 'valor': valor,
+                      'igv': igv, 'otros_cargos': otros_cargos}
+
+        resultado = {}
+        for col in Transformer.COLUMNAS_FINALES:
+            if col in calculadas:
+                serie = pd.Series(calculadas[col], index=df.index)
+            elif col == 'observaciones' and col in origen:
+                # Nulos como 'nan' tanto si vienen de pandas (NaN) como de pyarrow (None)
+                serie = "SIRE:" + df[origen[col]].astype(object).fillna('nan').astype(str)
+            elif col in origen:
+                serie = df[origen[col]]
+            else:
+                continue
+
+            if col == 'periodo_tributario':
+                serie = convertir_periodo(serie)
+            elif col in Transformer.COLUMNAS_FECHA:
+                serie = convertir_fechas(serie)
+            elif col in Transformer.COLUMNAS_ENTERAS:
+                serie = pd.to_numeric(serie, errors='coerce').astype('Int64')
+            elif col in Transformer.COLUMNAS_NUMERICAS:
+                serie = pd.to_numeric(serie, errors='coerce').round(2)
+            elif serie.dtype == object or isinstance(serie.dtype, pd.CategoricalDtype):
+                vacios = serie.isin(Transformer.VALORES_VACIOS)
+                if vacios.any():
+                    serie = serie.mask(vacios)
+            resultado[col] = serie
+
+        df_final = pd.DataFrame(resultado, index=df.index)
+        logger.info(f"Transformación fusionada de SIRE Ventas completada: {len(df_final)} filas")
+        return df_final
+
+
+def _anotar_bloque(medicion, bloque) -> None:
+    ruta, chunk = bloque
+    medicion.archivo, medicion.filas_salida = str(ruta), len(chunk)
 
 
 class ETLSIRE:
-    def __init__(self, db_url: str, schema: str, table: str, column_mapping: Optional[dict] = None):
+    def __init__(self, db_url: str, schema: str, table: str, column_mapping: Optional[dict] = None,
+                 load_mode: str = 'rows', on_conflict: str = 'nothing', conflict_columns: Optional[List[str]] = None,
+                 key_columns: Optional[List[str]] = None, dedup: bool = False, transform_mode: Optional[str] = None,
+                 read_engine: str = 'pandas'):
+        if read_engine not in READ_ENGINES:
+            raise ValueError(f"Motor de lectura no soportado: {read_engine}")
+        # Las columnas tipadas de pyarrow solo las entiende la transformación fusionada
+        transform_mode = transform_mode or ('fused' if read_engine == 'pyarrow' else 'classic')
+        if transform_mode not in TRANSFORM_MODES:
+            raise ValueError(f"Modo de transformación no soportado: {transform_mode}")
+        if read_engine == 'pyarrow' and transform_mode != 'fused':
+            raise ValueError("El motor de lectura 'pyarrow' requiere transform_mode='fused'")
+        if load_mode not in LOAD_MODES:
+            raise ValueError(f"Modo de carga no soportado: {load_mode}")
+        if load_mode == 'diff' and not (key_columns and conflict_columns):
+            raise ValueError("load_mode='diff' requiere columnas clave y de conflicto")
+        if load_mode == 'diff' and dedup:
+            raise ValueError("dedup no aplica con load_mode='diff': el diff ya omite las filas sin cambios")
         self.extractor = Extractor()
         self.transformer = Transformer()
-        self.loader = Loader(db_url, schema, table)
+        self.loader = Loader(db_url, schema, table, conflict_columns, key_columns)
         self.column_mapping = column_mapping or {}
-
-    def run(self, rutas_archivos: List[str], show_preview: bool = False) -> bool:
+        self.load_mode = load_mode
+        self.on_conflict = on_conflict
+        self.transform_mode = transform_mode
+        self.lector = LectorArrow(self.column_mapping, Transformer.COLUMNAS_VALOR) if read_engine == 'pyarrow' else None
+        # Caché de claves existentes por (ruc, periodo) que vive lo que dura esta instancia
+        self.key_cache = ExistingKeyCache(self.loader.engine, self.loader.full_table_name, key_columns) if dedup and key_columns else None
+        self.snapshot = SnapshotFingerprints(self.loader.engine, schema, self.loader.full_table_name, key_columns) if load_mode == 'diff' else None
+        self.resumen = ResumenETL()
+
+    def run(self, rutas_archivos: List[Origen], show_preview: bool = False, chunk_rows: Optional[int] = None) -> ResumenETL:
+        self.resumen = ResumenETL()
+        if self.snapshot is not None:
+            if chunk_rows:
+                raise ValueError("load_mode='diff' necesita la propuesta completa para detectar filas eliminadas; no admite chunk_rows")
+            # Cada archivo es un snapshot completo de su (ruc, periodo): se comparan de a uno, en orden de nombre
+            resultados = [self._run_batch([ruta], show_preview) for ruta in sorted(rutas_archivos, key=nombre_fuente)]
+            success = all(resultados)
+        elif chunk_rows:
+            success = self._run_streaming(rutas_archivos, chunk_rows, show_preview)
+        else:
+            success = self._run_batch(rutas_archivos, show_preview)
+        self.resumen.exito = success and not self.resumen.archivos_fallidos
+        return self.resumen
+
+    def _run_batch(self, rutas_archivos: List[Origen], show_preview: bool) -> bool:
         try:
-            dataframes = self.extractor.extract_files(rutas_archivos)
+            dataframes = []
+            # Archivo por archivo para llevar las filas extraídas de cada uno (manifiesto de contenido)
+            for ruta in rutas_archivos:
+                with metrics.etapa(PIPELINE, 'extract', ruta) as medicion:
+                    extraidos = self.extractor.extract_files([ruta], self.resumen.archivos_fallidos, self.lector)
+                    medicion.filas_salida = sum(len(df) for df in extraidos)
+                    medicion.exito = str(ruta) not in self.resumen.archivos_fallidos
+                    medicion.bytes_leidos = tamano_fuente(ruta) if medicion.exito else 0
+                self.resumen.filas_por_archivo[str(ruta)] = medicion.filas_salida
+                dataframes.extend(extraidos)
             if not dataframes:
                 logger.warning("No se extrajeron datos válidos de ningún archivo.")
                 return True
             
             df_completo = pd.concat(dataframes, ignore_index=True)
             logger.info(f"Total de filas extraídas de todos los archivos: {len(df_completo)}")
+            self.resumen.filas_extraidas += len(df_completo)
 
-            df_renamed = self.transformer.rename_columns(df_completo, self.column_mapping)
-            df_transformed = self.transformer.transform_data(df_renamed)
-            df_final = self.transformer.filter_final_columns(df_transformed)
-            
+            # Con un solo archivo (fase 2, load_mode diff) las etapas siguientes también se atribuyen a él
+            archivo = str(rutas_archivos[0]) if len(rutas_archivos) == 1 else ''
+            df_final = self._transform(df_completo, archivo)
             if show_preview:
-                pd.set_option('display.max_columns', None)
-                pd.set_option('display.max_rows', None)
-                print("=== PREVIEW DEL DATAFRAME FINAL (SIRE VENTAS) ===")
-                print(df_final.head())
-                print(f"Total de filas a cargar: {len(df_final)}")
-                print("=" * 50)
-
-            success = self.loader.load_data(df_final)
-            return success
+                self._preview(df_final)
+
+            return self._load(df_final, archivo)
 
         except Exception as e:
             logger.critical(f"Error fatal en el proceso ETL de SIRE Ventas: {str(e)}", exc_info=True)
+            self.resumen.marcar_fallidos(rutas_archivos)
             return False
 
+    def _run_streaming(self, rutas_archivos: List[Origen], chunk_rows: int, show_preview: bool) -> bool:
+        """Extracción, transformación y carga encadenadas bloque a bloque; la memoria queda acotada por chunk_rows."""
+        total_filas = 0
+        success = True
+        try:
+            bloques = ((ruta, chunk) for ruta in rutas_archivos
+                       for chunk in self.extractor.iter_chunks([ruta], chunk_rows, self.resumen.archivos_fallidos, self.lector))
+            for numero_bloque, (ruta, chunk) in enumerate(metrics.iterar(PIPELINE, 'extract', bloques, _anotar_bloque)):
+                self.resumen.filas_por_archivo[str(ruta)] = self.resumen.filas_por_archivo.get(str(ruta), 0) + len(chunk)
+                total_filas += len(chunk)
+                self.resumen.filas_extraidas += len(chunk)
+                df_final = self._transform(chunk, str(ruta))
+                if show_preview and numero_bloque == 0:
+                    self._preview(df_final)
+                success = self._load(df_final, str(ruta)) and success
+
+            if total_filas == 0:
+                logger.warning("No se extrajeron datos válidos de ningún archivo.")
+            logger.info(f"Total de filas extraídas en streaming: {total_filas}")
+            return success
+
+        except Exception as e:
+            logger.critical(f"Error fatal en el proceso ETL de SIRE Ventas (streaming): {str(e)}", exc_info=True)
+            self.resumen.marcar_fallidos(rutas_archivos)
+            return False
 
-def run_sire_ventas_etl(file_paths: List[str], show_preview: bool = False) -> bool:
+    def _transform(self, df: pd.DataFrame, archivo: str = '') -> pd.DataFrame:
+        with metrics.etapa(PIPELINE, 'transform', archivo, filas_entrada=len(df)) as medicion:
+            if self.transform_mode == 'fused':
+                df_final = self.transformer.transform_fused(df, self.column_mapping)
+            else:
+                df_renamed = self.transformer.rename_columns(df, self.column_mapping)
+                df_transformed = self.transformer.transform_data(df_renamed)
+                df_final = self.transformer.filter_final_columns(df_transformed)
+            medicion.filas_salida = len(df_final)
+        self.resumen.filas_rechazadas += len(df) - len(df_final)
+        return df_final
+
+    def _preview(self, df_final: pd.DataFrame) -> None:
+        pd.set_option('display.max_columns', None)
+        pd.set_option('display.max_rows', None)
+        print("=== PREVIEW DEL DATAFRAME FINAL (SIRE VENTAS) ===")
+        print(df_final.head())
+        print(f"Total de filas a cargar: {len(df_final)}")
+        print("=" * 50)
+
+    def _load(self, df_final: pd.DataFrame, archivo: str = '') -> bool:
+        with metrics.etapa(PIPELINE, 'load', archivo, filas_entrada=len(df_final)) as medicion:
+            if self.key_cache is not None:
+                filas_antes = len(df_final)
+                df_final = self.key_cache.filter_new(df_final)
+                self.resumen.filas_omitidas += filas_antes - len(df_final)
+
+            if self.snapshot is not None:
+                success = self.loader.load_data_diff(self.snapshot.diff(df_final), self.snapshot)
+            elif self.load_mode == 'copy':
+                success = self.loader.load_data_copy(df_final, on_conflict=self.on_conflict)
+            else:
+                success = self.loader.load_data(df_final)
+            medicion.filas_salida = self.loader.estadisticas['insertadas'] + self.loader.estadisticas['actualizadas']
+            medicion.exito = success
+
+        estadisticas = self.loader.estadisticas
+        self.resumen.filas_cargadas += estadisticas['insertadas'] + estadisticas['actualizadas']
+        self.resumen.filas_omitidas += estadisticas['omitidas']
+        self.resumen.filas_rechazadas += estadisticas['errores']
+        self.resumen.filas_eliminadas += estadisticas.get('eliminadas', 0)
+
+        if success and self.key_cache is not None:
+            self.key_cache.register(df_final)
+        return success
+
+
+def run_sire_ventas_etl(file_paths: List[Origen], show_preview: bool = False,
+                        load_mode: str = 'rows', on_conflict: str = 'nothing', dedup: bool = False,
+                        chunk_rows: Optional[int] = None, transform_mode: Optional[str] = None,
+                        read_engine: str = 'pandas') -> ResumenETL:
     logger.info(f"Iniciando ETL de SIRE Ventas para {len(file_paths)} archivo(s).")
     db_url = config.DB_URL
     schema = "acc"
     table = "_5" 
+    conflict_columns = ["cui"]
+    # Columnas de las que se deriva el cui; se usan para filtrar filas ya cargadas
+    key_columns = ["ruc", "tipo_comprobante", "numero_serie", "numero_correlativo"]
 
-    etl = ETLSIRE(db_url, schema, table, COLUMN_MAPPING_VENTAS)
-    success = etl.run(file_paths, show_preview=show_preview)
+    etl = ETLSIRE(db_url, schema, table, COLUMN_MAPPING_VENTAS,
+                  load_mode=load_mode, on_conflict=on_conflict, conflict_columns=conflict_columns,
+                  key_columns=key_columns, dedup=dedup, transform_mode=transform_mode,
+                  read_engine=read_engine)
+    etl.run(file_paths, show_preview=show_preview, chunk_rows=chunk_rows)
 
-    if success:
+    if etl.resumen:
         logger.info("ETL de SIRE Ventas completado exitosamente.")
     else:
         logger.warning("ETL de SIRE Ventas finalizado con errores.")
         
-    return success
\ No newline at end of file
+    return etl.resumen
@@ -1,14 +1,434 @@
-# Placeholder para ETL de archivos XML
-# El usuario proporcionará la lógica específica
+# ETL de comprobantes electrónicos UBL 2.x (factura, boleta, notas de crédito/débito y recibos por honorarios)
+
+import logging
+import os
+import zipfile
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+from xml.etree.ElementTree import ParseError, XMLPullParser
+
+import pandas as pd
+from sqlalchemy import text
+
+from app.archive_stream import Origen, iter_miembros, nombre_fuente, por_extension
+from app.config import config, match_file_pattern
+from app.etl_pipelines.sire_common import Loader, ResumenETL, ON_CONFLICT_POLICIES
+from app.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Nombre del pipeline en las métricas por etapa: extract incluye el parseo de cada documento,
+# transform el armado de los DataFrames del lote y load la validación de claves y el COPY
+PIPELINE = 'comprobantes_xml'
+
+NS = {
+    'cbc': 'urn:oasis:names:specification:ubl:schema:xsd:CommonBasicComponents-2',
+    'cac': 'urn:oasis:names:specification:ubl:schema:xsd:CommonAggregateComponents-2',
+}
+
+# Tipo de comprobante (tabla 10 SUNAT) según el elemento raíz; las facturas y boletas lo traen en InvoiceTypeCode
+TIPO_POR_RAIZ = {
+    '{urn:oasis:names:specification:ubl:schema:xsd:CreditNote-2}CreditNote': '07',
+    '{urn:oasis:names:specification:ubl:schema:xsd:DebitNote-2}DebitNote': '08',
+}
+# Respaldo según el patrón del nombre de archivo, para documentos sin InvoiceTypeCode (p. ej. UBL 2.0)
+TIPO_POR_PATRON = {
+    'factura_xml': '01', 'boleta_xml': '03', 'credito_xml': '07', 'debito_xml': '08', 'recibo_xml': '02',
+}
+
+# Elementos hijos de la raíz que abren una línea de detalle
+ELEMENTOS_LINEA = ('cac:InvoiceLine', 'cac:CreditNoteLine', 'cac:DebitNoteLine')
+
+# Campo -> rutas relativas a la raíz (la primera que aparezca en el documento gana). Las rutas alternativas
+# cubren la variante UBL 2.0 que SUNAT usó hasta 2018 (CustomerAssignedAccountID) y las notas de débito.
+CAMPOS_CABECERA = {
+    'numero': ['cbc:ID'],
+    'fecha_emision': ['cbc:IssueDate'],
+    'hora_emision': ['cbc:IssueTime'],
+    'fecha_vencimiento': ['cbc:DueDate', 'cac:PaymentMeans/cbc:PaymentDueDate'],
+    'tipo_comprobante': ['cbc:InvoiceTypeCode'],
+    'tipo_moneda': ['cbc:DocumentCurrencyCode'],
+    'ruc_emisor': ['cac:AccountingSupplierParty/cac:Party/cac:PartyIdentification/cbc:ID',
+                   'cac:AccountingSupplierParty/cbc:CustomerAssignedAccountID'],
+    'razon_social_emisor': ['cac:AccountingSupplierParty/cac:Party/cac:PartyLegalEntity/cbc:RegistrationName'],
+    'numero_documento_receptor': ['cac:AccountingCustomerParty/cac:Party/cac:PartyIdentification/cbc:ID',
+                                  'cac:AccountingCustomerParty/cbc:CustomerAssignedAccountID'],
+    'tipo_documento_receptor': ['cac:AccountingCustomerParty/cbc:AdditionalAccountID'],
+    'razon_social_receptor': ['cac:AccountingCustomerParty/cac:Party/cac:PartyLegalEntity/cbc:RegistrationName'],
+    'total_impuestos': ['cac:TaxTotal/cbc:TaxAmount'],
+    'valor_venta': ['cac:LegalMonetaryTotal/cbc:LineExtensionAmount',
+                    'cac:RequestedMonetaryTotal/cbc:LineExtensionAmount'],
+    'importe_total': ['cac:LegalMonetaryTotal/cbc:PayableAmount', 'cac:RequestedMonetaryTotal/cbc:PayableAmount'],
+    'tipo_comprobante_modificado': ['cac:BillingReference/cac:InvoiceDocumentReference/cbc:DocumentTypeCode'],
+    'numero_comprobante_modificado': ['cac:BillingReference/cac:InvoiceDocumentReference/cbc:ID'],
+    'codigo_motivo': ['cac:DiscrepancyResponse/cbc:ResponseCode'],
+}
+# Campo -> (ruta, atributo)
+ATRIBUTOS_CABECERA = {
+    'tipo_documento_receptor': [('cac:AccountingCustomerParty/cac:Party/cac:PartyIdentification/cbc:ID', 'schemeID')],
+}
+# Rutas relativas a cada elemento de ELEMENTOS_LINEA
+CAMPOS_LINEA = {
+    'numero_item': ['cbc:ID'],
+    'cantidad': ['cbc:InvoicedQuantity', 'cbc:CreditedQuantity', 'cbc:DebitedQuantity'],
+    'valor_venta': ['cbc:LineExtensionAmount'],
+    'igv': ['cac:TaxTotal/cbc:TaxAmount'],
+    'descripcion': ['cac:Item/cbc:Description'],
+    'codigo_producto': ['cac:Item/cac:SellersItemIdentification/cbc:ID'],
+    'precio_unitario': ['cac:Price/cbc:PriceAmount'],
+}
+ATRIBUTOS_LINEA = {
+    'unidad_medida': [('cbc:InvoicedQuantity', 'unitCode'), ('cbc:CreditedQuantity', 'unitCode'),
+                      ('cbc:DebitedQuantity', 'unitCode')],
+}
+
+# Columnas de destino (en este orden) y sus conversiones
+CLAVE_COMPROBANTE = ['ruc_emisor', 'tipo_comprobante', 'numero_serie', 'numero_correlativo']
+COLUMNAS_CABECERA = CLAVE_COMPROBANTE + [
+    'fecha_emision', 'hora_emision', 'fecha_vencimiento', 'tipo_moneda', 'razon_social_emisor',
+    'tipo_documento_receptor', 'numero_documento_receptor', 'razon_social_receptor',
+    'valor_venta', 'total_impuestos', 'importe_total', 'tipo_comprobante_modificado',
+    'numero_comprobante_modificado', 'codigo_motivo', 'cantidad_lineas', 'archivo',
+]
+COLUMNAS_LINEA = CLAVE_COMPROBANTE + [
+    'numero_item', 'codigo_producto', 'descripcion', 'unidad_medida', 'cantidad', 'precio_unitario',
+    'valor_venta', 'igv',
+]
+COLUMNAS_MONTO = ['valor_venta', 'total_impuestos', 'importe_total', 'cantidad', 'precio_unitario', 'igv']
+COLUMNAS_FECHA = ['fecha_emision', 'fecha_vencimiento']
+COLUMNAS_ENTERAS = ['ruc_emisor', 'numero_item', 'cantidad_lineas']
+
+
+@dataclass(frozen=True)
+class EsquemaUBL:
+    """Qué se extrae de un tipo de documento UBL: campos de cabecera y de cada línea de detalle."""
+    campos_cabecera: dict
+    atributos_cabecera: dict
+    elementos_linea: tuple
+    campos_linea: dict
+    atributos_linea: dict
+
+
+COMPROBANTES = EsquemaUBL(CAMPOS_CABECERA, ATRIBUTOS_CABECERA, ELEMENTOS_LINEA, CAMPOS_LINEA, ATRIBUTOS_LINEA)
+
+DDL = {
+    'comprobantes_xml': """
+        ruc_emisor bigint NOT NULL, tipo_comprobante text NOT NULL, numero_serie text NOT NULL,
+        numero_correlativo text NOT NULL, fecha_emision date, hora_emision text, fecha_vencimiento date,
+        tipo_moneda text, razon_social_emisor text, tipo_documento_receptor text, numero_documento_receptor text,
+        razon_social_receptor text, valor_venta numeric(16,2), total_impuestos numeric(16,2),
+        importe_total numeric(16,2), tipo_comprobante_modificado text, numero_comprobante_modificado text,
+        codigo_motivo text, cantidad_lineas integer, archivo text,
+        UNIQUE (ruc_emisor, tipo_comprobante, numero_serie, numero_correlativo)
+    """,
+    'comprobantes_xml_lineas': """
+        ruc_emisor bigint NOT NULL, tipo_comprobante text NOT NULL, numero_serie text NOT NULL,
+        numero_correlativo text NOT NULL, numero_item integer NOT NULL, codigo_producto text, descripcion text,
+        unidad_medida text, cantidad numeric(18,4), precio_unitario numeric(18,6), valor_venta numeric(16,2),
+        igv numeric(16,2),
+        UNIQUE (ruc_emisor, tipo_comprobante, numero_serie, numero_correlativo, numero_item)
+    """,
+}
+
+
+def _clark(ruta: str) -> Tuple[str, ...]:
+    """'cac:Item/cbc:Description' -> ('{urn...CommonAggregateComponents-2}Item', '{urn...CommonBasicComponents-2}Description')"""
+    etiquetas = []
+    for paso in ruta.split('/'):
+        prefijo, nombre = paso.split(':')
+        etiquetas.append(f"{{{NS[prefijo]}}}{nombre}")
+    return tuple(etiquetas)
+
+
+class AutomataRutas:
+    """
+    Las rutas de un EsquemaUBL compiladas en un autómata: cada estado es un prefijo de ruta y las transiciones
+    van por etiqueta en notación Clark. Al recorrer el documento basta un lookup por elemento; los
+    subárboles que no llevan a ningún campo (la firma, extensiones) quedan en el estado muerto.
+    """
+    MUERTO = -1
+
+    def __init__(self, esquema: EsquemaUBL = COMPROBANTES):
+        self.transiciones: Dict[Tuple[int, str], int] = {}
+        # estado -> ([(es_linea, campo)], [(es_linea, campo, atributo)]): qué se extrae al cerrar el elemento
+        self.acciones: Dict[int, Tuple[list, list]] = {}
+        self.lineas = set()  # estados que abren una línea de detalle
+        prefijos_linea = [_clark(elemento) for elemento in esquema.elementos_linea]
+        for prefijo in prefijos_linea:
+            self.lineas.add(self._estado(prefijo))
+        self._compilar(esquema.campos_cabecera, esquema.atributos_cabecera, prefijos=[()], es_linea=False)
+        self._compilar(esquema.campos_linea, esquema.atributos_linea, prefijos=prefijos_linea, es_linea=True)
+
+    def _estado(self, ruta: Tuple[str, ...]) -> int:
+        estado = 0
+        for etiqueta in ruta:
+            siguiente = self.transiciones.get((estado, etiqueta))
+            if siguiente is None:
+                siguiente = len(self.transiciones) + 1
+                self.transiciones[(estado, etiqueta)] = siguiente
+            estado = siguiente
+        return estado
+
+    def _compilar(self, campos, atributos, prefijos, es_linea):
+        for prefijo in prefijos:
+            for campo, rutas in campos.items():
+                for ruta in rutas:
+                    self._acciones(prefijo + _clark(ruta))[0].append((es_linea, campo))
+            for campo, pares in atributos.items():
+                for ruta, atributo in pares:
+                    self._acciones(prefijo + _clark(ruta))[1].append((es_linea, campo, atributo))
+
+    def _acciones(self, ruta: Tuple[str, ...]) -> Tuple[list, list]:
+        return self.acciones.setdefault(self._estado(ruta), ([], []))
+
+
+class ParserUBL:
+    """
+    Parser incremental de un documento UBL: el documento se entrega por bloques a un XMLPullParser (el
+    motor de iterparse, sin su capa de generadores por evento) y los eventos start/end se recorren con el
+    autómata de rutas. Cada hijo de la raíz se libera al cerrarse, así la memoria no crece con el tamaño
+    del documento. Retorna la cabecera como dict y las líneas como lista de dicts, con los valores en texto.
+    """
+    BLOQUE_LECTURA = 64 * 1024
+
+    def __init__(self, esquema: EsquemaUBL = COMPROBANTES):
+        self.automata = AutomataRutas(esquema)
+
+    def parse(self, fuente) -> Tuple[dict, List[dict]]:
+        transiciones = self.automata.transiciones
+        acciones = self.automata.acciones
+        estados_linea = self.automata.lineas
+        muerto = AutomataRutas.MUERTO
+
+        cabecera, lineas = {}, []
+        linea = None
+        pila = []
+        raiz = None
+        parser = XMLPullParser(events=('start', 'end'))
+        while True:
+            bloque = fuente.read(self.BLOQUE_LECTURA)
+            if bloque:
+                parser.feed(bloque)
+            else:
+                parser.close()
+            for evento, elem in parser.read_events():
+                if evento == 'start':
+                    if raiz is None:
+                        raiz = elem
+                        cabecera['_raiz'] = elem.tag
+                        pila.append(0)
+                        continue
+                    estado = pila[-1]
+                    if estado != muerto:
+                        estado = transiciones.get((estado, elem.tag), muerto)
+                        if estado in estados_linea:
+                            linea = {}
+                    pila.append(estado)
+                    continue
+
+                estado = pila.pop()
+                if estado != muerto:
+                    accion = acciones.get(estado)
+                    if accion is not None:
+                        textos, atributos = accion
+                        for es_linea, campo in textos:
+                            destino = linea if es_linea else cabecera
+                            if campo not in destino and elem.text is not None:
+                                destino[campo] = elem.text.strip()
+                        for es_linea, campo, atributo in atributos:
+                            destino = linea if es_linea else cabecera
+                            if campo not in destino and atributo in elem.attrib:
+                                destino[campo] = elem.attrib[atributo]
+                    if estado in estados_linea:
+                        lineas.append(linea)
+                        linea = None
+                if len(pila) == 1:
+                    # Se cerró un hijo directo de la raíz: ya se extrajo lo que interesaba de él
+                    raiz.clear()
+            if not bloque:
+                return cabecera, lineas
+
+
+class LoteColumnar:
+    """Acumula registros en listas por columna; se convierte en DataFrame de una vez al cargar."""
+
+    def __init__(self, columnas: List[str], montos: List[str] = COLUMNAS_MONTO, enteras: List[str] = COLUMNAS_ENTERAS,
+                 fechas: List[str] = COLUMNAS_FECHA):
+        self.columnas = columnas
+        self.montos, self.enteras, self.fechas = montos, enteras, fechas
+        self.datos = {col: [] for col in columnas}
+        self.filas = 0
+
+    def agregar(self, registro: dict) -> None:
+        for col, valores in self.datos.items():
+            valores.append(registro.get(col))
+        self.filas += 1
+
+    def a_dataframe(self) -> pd.DataFrame:
+        df = pd.DataFrame(self.datos, columns=self.columnas)
+        for col in df.columns.intersection(self.montos):
+            df[col] = pd.to_numeric(df[col], errors='coerce')
+        for col in df.columns.intersection(self.enteras):
+            df[col] = pd.to_numeric(df[col], errors='coerce').astype('Int64')
+        for col in df.columns.intersection(self.fechas):
+            df[col] = pd.to_datetime(df[col], format='%Y-%m-%d', errors='coerce')
+        return df
+
+
+class Extractor:
+    @staticmethod
+    def iter_documentos(rutas_archivos: List[Origen], archivos_fallidos: Optional[List[str]] = None) -> Iterator[Tuple[str, str, Callable]]:
+        """
+        Entrega (ruta, nombre del documento, función que abre su contenido) por cada .xml suelto o miembro .xml
+        de un comprimido, incluidos los anidados. Las rutas pueden ser archivos locales o Fuentes en memoria;
+        los miembros se leen directo del comprimido, sin extraerlos a disco.
+        """
+        for ruta in rutas_archivos:
+            try:
+                for nombre, abrir in iter_miembros(ruta, por_extension('.xml')):
+                    yield str(ruta), os.path.basename(nombre), abrir
+            except (OSError, zipfile.BadZipFile) as e:
+                logger.error(f"Error al abrir '{nombre_fuente(ruta)}': {e}")
+                if archivos_fallidos is not None:
+                    archivos_fallidos.append(str(ruta))
+
+
+class Transformer:
+    @staticmethod
+    def documento(cabecera: dict, lineas: List[dict], nombre: str, tipo_archivo: Optional[str]) -> Tuple[dict, List[dict]]:
+        """Completa la clave del comprobante (tipo, serie y correlativo) y la replica en cada línea."""
+        tipo = (TIPO_POR_RAIZ.get(cabecera.pop('_raiz', None)) or cabecera.get('tipo_comprobante')
+                or TIPO_POR_PATRON.get(tipo_archivo))
+        serie, _, correlativo = cabecera.get('numero', '').partition('-')
+        clave = {
+            'ruc_emisor': cabecera.get('ruc_emisor'),
+            'tipo_comprobante': tipo,
+            'numero_serie': serie,
+            'numero_correlativo': correlativo.lstrip('0') or correlativo,
+        }
+        cabecera.update(clave, cantidad_lineas=len(lineas), archivo=nombre)
+        for linea in lineas:
+            linea.update(clave)
+        return cabecera, lineas
+
+
+def _anotar_lote(medicion, lote) -> None:
+    medicion.filas_salida = lote[0].filas
+
+
+class ETLXML:
+    def __init__(self, db_url: str, schema: str = 'acc', on_conflict: str = 'update', batch_documents: Optional[int] = None):
+        if on_conflict not in ON_CONFLICT_POLICIES:
+            raise ValueError(f"Política ON CONFLICT no soportada: {on_conflict}")
+        self.extractor = Extractor()
+        self.parser = ParserUBL()
+        self.transformer = Transformer()
+        self.schema = schema
+        self.loader_cabecera = Loader(db_url, schema, 'comprobantes_xml', CLAVE_COMPROBANTE)
+        self.loader_lineas = Loader(db_url, schema, 'comprobantes_xml_lineas', CLAVE_COMPROBANTE + ['numero_item'])
+        self.on_conflict = on_conflict
+        self.batch_documents = batch_documents or config.XML_BATCH_DOCUMENTS
+        self.resumen = ResumenETL()
+        self._tablas_listas = False
+
+    def _preparar(self) -> None:
+        if self._tablas_listas:
+            return
+        with self.loader_cabecera.engine.begin() as connection:
+            for tabla, columnas in DDL.items():
+                connection.execute(text(f"CREATE TABLE IF NOT EXISTS {self.schema}.{tabla} ({columnas})"))
+        self._tablas_listas = True
+
+    def iter_lotes(self, rutas_archivos: List[Origen]) -> Iterator[Tuple[LoteColumnar, LoteColumnar]]:
+        """Parsea los documentos y entrega lotes columnares de batch_documents cabeceras y sus líneas."""
+        cabeceras, lineas = LoteColumnar(COLUMNAS_CABECERA), LoteColumnar(COLUMNAS_LINEA)
+        for ruta, nombre, abrir in self.extractor.iter_documentos(rutas_archivos, self.resumen.archivos_fallidos):
+            tipo_archivo, _, _ = match_file_pattern(os.path.basename(ruta))
+            try:
+                with abrir() as fuente:
+                    cabecera, detalle = self.parser.parse(fuente)
+            except (ParseError, OSError, zipfile.BadZipFile) as e:
+                logger.error(f"XML inválido en '{nombre}' ({os.path.basename(ruta)}): {e}")
+                self.resumen.archivos_fallidos.append(f"{ruta}:{nombre}" if nombre != os.path.basename(ruta) else ruta)
+                continue
+            cabecera, detalle = self.transformer.documento(cabecera, detalle, nombre, tipo_archivo)
+            cabeceras.agregar(cabecera)
+            for linea in detalle:
+                lineas.agregar(linea)
+            self.resumen.filas_por_archivo[ruta] = self.resumen.filas_por_archivo.get(ruta, 0) + 1
+            if cabeceras.filas >= self.batch_documents:
+                yield cabeceras, lineas
+                cabeceras, lineas = LoteColumnar(COLUMNAS_CABECERA), LoteColumnar(COLUMNAS_LINEA)
+        if cabeceras.filas:
+            yield cabeceras, lineas
+
+    def run(self, rutas_archivos: List[Origen]) -> bool:
+        self.resumen = ResumenETL()
+        success = True
+        try:
+            self._preparar()
+            lotes = metrics.iterar(PIPELINE, 'extract', self.iter_lotes(rutas_archivos), _anotar_lote)
+            for cabeceras, lineas in lotes:
+                self.resumen.filas_extraidas += cabeceras.filas
+                with metrics.etapa(PIPELINE, 'transform', filas_entrada=cabeceras.filas) as medicion:
+                    df_cabecera, df_lineas = cabeceras.a_dataframe(), lineas.a_dataframe()
+                    medicion.filas_salida = len(df_cabecera)
+                cargadas = self.resumen.filas_cargadas
+                with metrics.etapa(PIPELINE, 'load', filas_entrada=len(df_cabecera)) as medicion:
+                    medicion.exito = self._load(df_cabecera, df_lineas)
+                    medicion.filas_salida = self.resumen.filas_cargadas - cargadas
+                success = medicion.exito and success
+        except Exception as e:
+            logger.critical(f"Error fatal en el proceso ETL de comprobantes XML: {str(e)}", exc_info=True)
+            self.resumen.archivos_fallidos = [str(ruta) for ruta in rutas_archivos]
+            success = False
+        self.resumen.exito = success and not self.resumen.archivos_fallidos
+        return success
+
+    def _load(self, df_cabecera: pd.DataFrame, df_lineas: pd.DataFrame) -> bool:
+        # Sin clave completa el documento no se puede identificar (ni actualizar) en destino
+        validas = df_cabecera[CLAVE_COMPROBANTE].notna().all(axis=1) & (df_cabecera['numero_serie'] != '')
+        self.resumen.filas_rechazadas += int((~validas).sum())
+        df_cabecera = df_cabecera[validas]
+        df_lineas = df_lineas[df_lineas[CLAVE_COMPROBANTE + ['numero_item']].notna().all(axis=1)]
+
+        success = self.loader_cabecera.load_data_copy(df_cabecera, on_conflict=self.on_conflict)
+        estadisticas = self.loader_cabecera.estadisticas
+        self.resumen.filas_cargadas += estadisticas['insertadas'] + estadisticas['actualizadas']
+        self.resumen.filas_omitidas += estadisticas['omitidas']
+        self.resumen.filas_rechazadas += estadisticas['errores']
+        if success and len(df_lineas):
+            success = self.loader_lineas.load_data_copy(df_lineas, on_conflict=self.on_conflict)
+        return success
+
+
+def run_xml_etl(file_paths: List[Origen], on_conflict: str = 'update', batch_documents: Optional[int] = None) -> ResumenETL:
+    logger.info(f"Iniciando ETL de comprobantes XML para {len(file_paths)} archivo(s).")
+    etl = ETLXML(config.DB_URL, on_conflict=on_conflict, batch_documents=batch_documents)
+    etl.run(file_paths)
+
+    if etl.resumen:
+        logger.info(f"ETL de comprobantes XML completado: {etl.resumen.filas_extraidas} documento(s).")
+    else:
+        logger.warning("ETL de comprobantes XML finalizado con errores.")
+    return etl.resumen
+
 
 async def process_xml(file_path):
     """
-    Procesa un archivo XML y retorna los datos extraídos.
-    Implementar la lógica de parsing y transformación aquí.
+    Procesa un archivo XML (o un .zip con XML) y retorna los comprobantes extraídos, sin cargarlos:
+    {"data": [cabecera con su lista de 'lineas', ...]}.
     """
-    # TODO: Implementar lógica de ETL
-    # Ejemplo: parsear XML, extraer elementos, validar, etc.
-    pass
+    import asyncio
+
+    def _parsear():
+        parser, transformer = ParserUBL(), Transformer()
+        tipo_archivo, _, _ = match_file_pattern(os.path.basename(file_path))
+        documentos = []
+        for _, nombre, abrir in Extractor.iter_documentos([file_path]):
+            with abrir() as fuente:
+                cabecera, lineas = transformer.documento(*parser.parse(fuente), nombre, tipo_archivo)
+            documentos.append({**cabecera, 'lineas': lineas})
+        return documentos
 
-    # Retornar datos en formato dict o list para insertar en PostgreSQL
-    return {"data": []}
\ No newline at end of file
+    return {"data": await asyncio.to_thread(_parsear)}
@@ -0,0 +1,250 @@
+# Métricas por etapa y por archivo de cada ejecución: tiempos, filas y bytes, exportados como JSON lines y Prometheus
+
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple, TypeVar
+
+from app.config import config
+
+# Etapas en el orden en que se muestran en el resumen
+ETAPAS = ('verify', 'download', 'extract', 'transform', 'load', 'upload')
+
+PREFIJO_PROMETHEUS = 'sunat_etl'
+MB = 1024 * 1024
+
+T = TypeVar('T')
+
+
+@dataclass
+class Medicion:
+    """
+    Una etapa medida sobre un archivo (o sobre un lote, con archivo vacío). Tiempo de reloj y de CPU los
+    completa Metricas.etapa; filas y bytes, quien mide. El tiempo de CPU es el del proceso: con hilos
+    concurrentes (fase 2) incluye el de las otras tareas.
+    """
+    pipeline: str
+    etapa: str
+    archivo: str = ''
+    inicio: float = 0.0
+    segundos: float = 0.0
+    cpu_segundos: float = 0.0
+    filas_entrada: int = 0
+    filas_salida: int = 0
+    bytes_leidos: int = 0
+    exito: bool = True
+    pid: int = 0
+
+    @property
+    def filas(self) -> int:
+        """Filas procesadas: las de entrada o, en etapas que las producen (extract), las de salida."""
+        return self.filas_entrada or self.filas_salida
+
+    @property
+    def filas_por_segundo(self) -> float:
+        return self.filas / self.segundos if self.segundos > 0 else 0.0
+
+
+@dataclass
+class Agregado:
+    """Suma de las mediciones de una etapa de un pipeline."""
+    mediciones: int = 0
+    errores: int = 0
+    segundos: float = 0.0
+    cpu_segundos: float = 0.0
+    filas_entrada: int = 0
+    filas_salida: int = 0
+    bytes_leidos: int = 0
+    filas: int = 0
+
+    def sumar(self, medicion: Medicion) -> None:
+        self.mediciones += 1
+        self.errores += not medicion.exito
+        self.segundos += medicion.segundos
+        self.cpu_segundos += medicion.cpu_segundos
+        self.filas_entrada += medicion.filas_entrada
+        self.filas_salida += medicion.filas_salida
+        self.bytes_leidos += medicion.bytes_leidos
+        self.filas += medicion.filas
+
+    @property
+    def filas_por_segundo(self) -> float:
+        return self.filas / self.segundos if self.segundos > 0 else 0.0
+
+    @property
+    def mb_por_segundo(self) -> float:
+        return self.bytes_leidos / MB / self.segundos if self.segundos > 0 else 0.0
+
+
+def _etiqueta(valor: str) -> str:
+    return valor.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Metricas:
+    """
+    Registro de las mediciones de la ejecución en curso. Los procesos del pool (pipelines) miden en su propio
+    registro y lo devuelven en ResumenETL.metricas; el proceso principal las incorpora con registrar().
+    Al terminar, exportar() agrega una línea JSON por medición a METRICS_JSONL_FILE y reescribe el textfile
+    de Prometheus (METRICS_PROMETHEUS_FILE) con los totales por pipeline y etapa.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._mediciones: List[Medicion] = []
+        self._pid = os.getpid()
+        self.ejecucion = f"{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}"
+        self.inicio = time.time()
+
+    def _verificar_proceso(self) -> None:
+        # Proceso hijo (fork): no debe volver a informar lo que el padre ya midió. Con spawn (Windows) el
+        # registro del hijo ya empieza vacío; se verifica por pid como en app/db.py y app/queue_db.py.
+        if os.getpid() != self._pid:
+            self._lock = threading.Lock()
+            self._mediciones = []
+            self._pid = os.getpid()
+
+    @contextmanager
+    def etapa(self, pipeline: str, etapa: str, archivo: str = '', filas_entrada: int = 0) -> Iterator[Medicion]:
+        """Mide el bloque; la medición queda marcada como fallida si el bloque levanta una excepción."""
+        medicion = Medicion(pipeline, etapa, str(archivo), inicio=time.time(), filas_entrada=filas_entrada, pid=os.getpid())
+        reloj, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield medicion
+        except BaseException:
+            medicion.exito = False
+            raise
+        finally:
+            self._cerrar(medicion, reloj, cpu)
+
+    def iterar(self, pipeline: str, etapa: str, iterable: Iterable[T],
+               completar: Optional[Callable[[Medicion, T], None]] = None) -> Iterator[T]:
+        """
+        Entrega los elementos de `iterable` midiendo como `etapa` lo que tarda en producir cada uno (p. ej. la
+        extracción en streaming, que avanza bloque a bloque). `completar(medicion, elemento)` anota archivo y filas.
+        """
+        iterador = iter(iterable)
+        while True:
+            medicion = Medicion(pipeline, etapa, inicio=time.time(), pid=os.getpid())
+            reloj, cpu = time.perf_counter(), time.process_time()
+            try:
+                elemento = next(iterador)
+            except StopIteration:
+                return
+            except BaseException:
+                medicion.exito = False
+                self._cerrar(medicion, reloj, cpu)
+                raise
+            if completar is not None:
+                completar(medicion, elemento)
+            self._cerrar(medicion, reloj, cpu)
+            yield elemento
+
+    def _cerrar(self, medicion: Medicion, reloj: float, cpu: float) -> None:
+        medicion.segundos = time.perf_counter() - reloj
+        medicion.cpu_segundos = time.process_time() - cpu
+        self.registrar([medicion])
+
+    def registrar(self, mediciones: List[Medicion]) -> None:
+        self._verificar_proceso()
+        with self._lock:
+            self._mediciones.extend(mediciones)
+
+    def tomar(self) -> List[Medicion]:
+        """Retorna y descarta las mediciones registradas (para devolverlas desde un proceso del pool)."""
+        self._verificar_proceso()
+        with self._lock:
+            mediciones, self._mediciones = self._mediciones, []
+        return mediciones
+
+    def mediciones(self) -> List[Medicion]:
+        self._verificar_proceso()
+        with self._lock:
+            return list(self._mediciones)
+
+    def agregar(self) -> Dict[Tuple[str, str], Agregado]:
+        """Totales por (pipeline, etapa), ordenados por pipeline y por el orden de ETAPAS."""
+        totales: Dict[Tuple[str, str], Agregado] = {}
+        for medicion in self.mediciones():
+            totales.setdefault((medicion.pipeline, medicion.etapa), Agregado()).sumar(medicion)
+        orden = {etapa: i for i, etapa in enumerate(ETAPAS)}
+        return dict(sorted(totales.items(), key=lambda item: (item[0][0], orden.get(item[0][1], len(orden)), item[0][1])))
+
+    # --- Exportación ---
+
+    def exportar_jsonl(self, ruta: str) -> int:
+        """Agrega una línea JSON por medición, con el id de la ejecución para compararla con otras."""
+        mediciones = self.mediciones()
+        with open(ruta, 'a', encoding='utf-8') as f:
+            for medicion in mediciones:
+                registro = {'ejecucion': self.ejecucion, **asdict(medicion),
+                            'filas_por_segundo': round(medicion.filas_por_segundo, 1)}
+                f.write(json.dumps(registro, ensure_ascii=False) + '\n')
+        return len(mediciones)
+
+    def exportar_prometheus(self, ruta: str) -> None:
+        """
+        Textfile para el collector de node_exporter: totales de la ejecución por pipeline y etapa. Se escribe
+        a un temporal del mismo directorio y se renombra, así el collector nunca lee un archivo a medias.
+        """
+        series = (
+            ('segundos', 'gauge', 'Tiempo de reloj de la etapa en la última ejecución.', lambda a: a.segundos),
+            ('cpu_segundos', 'gauge', 'Tiempo de CPU del proceso durante la etapa en la última ejecución.', lambda a: a.cpu_segundos),
+            ('filas_entrada', 'gauge', 'Filas que recibió la etapa en la última ejecución.', lambda a: a.filas_entrada),
+            ('filas_salida', 'gauge', 'Filas que produjo la etapa en la última ejecución.', lambda a: a.filas_salida),
+            ('bytes_leidos', 'gauge', 'Bytes leídos o transferidos por la etapa en la última ejecución.', lambda a: a.bytes_leidos),
+            ('filas_por_segundo', 'gauge', 'Throughput de la etapa en la última ejecución.', lambda a: a.filas_por_segundo),
+            ('mediciones', 'gauge', 'Archivos o lotes medidos en la etapa en la última ejecución.', lambda a: a.mediciones),
+            ('errores', 'gauge', 'Mediciones fallidas de la etapa en la última ejecución.', lambda a: a.errores),
+        )
+        totales = self.agregar()
+        lineas = []
+        for nombre, tipo, ayuda, valor in series:
+            metrica = f"{PREFIJO_PROMETHEUS}_etapa_{nombre}"
+            lineas += [f"# HELP {metrica} {ayuda}", f"# TYPE {metrica} {tipo}"]
+            for (pipeline, etapa), agregado in totales.items():
+                lineas.append(f'{metrica}{{pipeline="{_etiqueta(pipeline)}",etapa="{_etiqueta(etapa)}"}} {valor(agregado):g}')
+        metrica = f"{PREFIJO_PROMETHEUS}_ultima_ejecucion_timestamp_seconds"
+        lineas += [f"# HELP {metrica} Fin de la última ejecución (epoch).", f"# TYPE {metrica} gauge",
+                   f"{metrica} {time.time():.0f}"]
+
+        directorio = os.path.dirname(os.path.abspath(ruta))
+        with tempfile.NamedTemporaryFile('w', dir=directorio, prefix='.metricas_', suffix='.prom',
+                                         delete=False, encoding='utf-8') as f:
+            f.write('\n'.join(lineas) + '\n')
+        os.chmod(f.name, 0o644)
+        os.replace(f.name, ruta)
+
+    def exportar(self, jsonl: Optional[str] = None, prometheus: Optional[str] = None) -> None:
+        """Exporta a los destinos indicados o, por defecto, a los de la configuración (vacío = deshabilitado)."""
+        jsonl = config.METRICS_JSONL_FILE if jsonl is None else jsonl
+        prometheus = config.METRICS_PROMETHEUS_FILE if prometheus is None else prometheus
+        if jsonl:
+            self.exportar_jsonl(jsonl)
+        if prometheus:
+            self.exportar_prometheus(prometheus)
+
+    def tabla_resumen(self) -> List[str]:
+        """Tabla de fin de ejecución: una fila por pipeline y etapa."""
+        totales = self.agregar()
+        if not totales:
+            return []
+        lineas = [
+            f"=== MÉTRICAS POR ETAPA (ejecución {self.ejecucion}, {time.time() - self.inicio:.1f}s) ===",
+            f"{'pipeline':<18}{'etapa':<11}{'n':>6}{'reloj s':>10}{'CPU s':>10}{'filas ent':>12}"
+            f"{'filas sal':>12}{'MB':>10}{'filas/s':>12}{'MB/s':>9}{'err':>5}",
+        ]
+        for (pipeline, etapa), a in totales.items():
+            lineas.append(
+                f"{pipeline:<18}{etapa:<11}{a.mediciones:>6,}{a.segundos:>10.2f}{a.cpu_segundos:>10.2f}"
+                f"{a.filas_entrada:>12,}{a.filas_salida:>12,}{a.bytes_leidos / MB:>10.1f}"
+                f"{a.filas_por_segundo:>12,.0f}{a.mb_por_segundo:>9.1f}{a.errores:>5}"
+            )
+        return lineas
+
+
+# Instancia global
+metrics = Metricas()
@@ -1,16 +1,62 @@
+import os
 import sqlite3
-from datetime import datetime
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
 from app.config import config
 
+# Columnas agregadas después de la versión inicial de la tabla tasks; se crean con ALTER en bases existentes
+TASK_COLUMNS_EXTRA = {
+    'attempts': "INTEGER NOT NULL DEFAULT 0",
+    'lease_owner': "TEXT",
+    'lease_expires_at': "TEXT",
+    'next_attempt_at': "TEXT",
+    'file_version': "TEXT",  # lastModifiedDateTime de OneDrive al encolar; detecta archivos modificados
+}
+
+
 class QueueDB:
+    """
+    Cola de tareas en SQLite. Reutiliza una sola conexión por proceso (modo WAL), protegida
+    con un lock para poder usarse desde varios hilos.
+    """
+
     def __init__(self, db_path=None):
         self.db_path = db_path or config.QUEUE_DB_PATH
+        self._lock = threading.RLock()
+        self._conn = None
+        self._conn_key = None
 
     def _get_connection(self):
-        return sqlite3.connect(self.db_path)
+        # Se reabre si cambió la ruta o si estamos en un proceso hijo (las conexiones no sobreviven a un fork)
+        clave = (self.db_path, os.getpid())
+        if self._conn is None or self._conn_key != clave:
+            conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._conn = conn
+            self._conn_key = clave
+        return self._conn
+
+    @contextmanager
+    def _transaction(self, immediate=False):
+        """Transacción sobre la conexión compartida; immediate toma el lock de escritura desde el inicio."""
+        with self._lock:
+            conn = self._get_connection()
+            if immediate:
+                conn.execute('BEGIN IMMEDIATE')
+            with conn:
+                yield conn
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+            self._conn = None
+            self._conn_key = None
 
     def create_table(self):
-        with self._get_connection() as conn:
+        with self._transaction() as conn:
             conn.execute('''
                 CREATE TABLE IF NOT EXISTS tasks (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -22,26 +68,266 @@ class QueueDB:
                     error_message TEXT
                 )
             ''')
+            existentes = {row[1] for row in conn.execute('PRAGMA table_info(tasks)')}
+            for columna, definicion in TASK_COLUMNS_EXTRA.items():
+                if columna not in existentes:
+                    conn.execute(f'ALTER TABLE tasks ADD COLUMN {columna} {definicion}')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_tasks_status ON tasks (status, id)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_tasks_file_id ON tasks (file_id)')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS content_manifest (
+                    sha256 TEXT NOT NULL,
+                    pipeline TEXT NOT NULL,
+                    tipo_contenido TEXT NOT NULL,
+                    nombre TEXT NOT NULL,
+                    tamano INTEGER,
+                    filas_extraidas INTEGER,
+                    filas_cargadas INTEGER,
+                    filas_omitidas INTEGER,
+                    filas_rechazadas INTEGER,
+                    resultado TEXT NOT NULL,
+                    updated_at TEXT NOT NULL,
+                    PRIMARY KEY (sha256, pipeline)
+                )
+            ''')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS delta_tokens (
+                    scope TEXT PRIMARY KEY,
+                    delta_link TEXT NOT NULL,
+                    updated_at TEXT NOT NULL
+                )
+            ''')
 
     def insert_task(self, file_name, file_id):
+        self.insert_tasks([(file_name, file_id)])
+
+    def insert_tasks(self, tasks):
+        """Encola un lote de (file_name, file_id) o (file_name, file_id, file_version) en una sola transacción."""
         created_at = updated_at = datetime.now().isoformat()
-        with self._get_connection() as conn:
-            conn.execute('''
-                INSERT INTO tasks (file_name, file_id, created_at, updated_at)
-                VALUES (?, ?, ?, ?)
-            ''', (file_name, file_id, created_at, updated_at))
+        filas = [(*tarea, None)[:3] + (created_at, updated_at) for tarea in tasks]
+        if not filas:
+            return 0
+        with self._transaction() as conn:
+            conn.executemany('''
+                INSERT INTO tasks (file_name, file_id, file_version, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?)
+            ''', filas)
+        return len(filas)
+
+    def requeue_tasks(self, tasks):
+        """
+        Vuelve a encolar archivos ya conocidos que cambiaron en OneDrive, a partir de (file_name, file_id,
+        file_version). Su última tarea vuelve a PENDIENTE con el nombre y la versión nuevos y sin intentos;
+        si esa tarea está EN_PROCESO (un worker procesa la versión anterior) se encola una tarea nueva.
+        La download URL se pide al procesar, así que siempre corresponde a la versión actual.
+        """
+        updated_at = datetime.now().isoformat()
+        nuevas = []
+        with self._transaction() as conn:
+            for file_name, file_id, file_version in tasks:
+                row = conn.execute('''
+                    SELECT id, status FROM tasks WHERE file_id = ? ORDER BY id DESC LIMIT 1
+                ''', (file_id,)).fetchone()
+                if row is None or row[1] == 'EN_PROCESO':
+                    nuevas.append((file_name, file_id, file_version, updated_at, updated_at))
+                    continue
+                conn.execute('''
+                    UPDATE tasks SET status = 'PENDIENTE', file_name = ?, file_version = ?, updated_at = ?,
+                        error_message = NULL, attempts = 0, next_attempt_at = NULL,
+                        lease_owner = NULL, lease_expires_at = NULL
+                    WHERE id = ?
+                ''', (file_name, file_version, updated_at, row[0]))
+            conn.executemany('''
+                INSERT INTO tasks (file_name, file_id, file_version, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?)
+            ''', nuevas)
+        return len(tasks)
 
     def get_pending_tasks(self):
-        with self._get_connection() as conn:
-            cursor = conn.execute('SELECT * FROM tasks WHERE status = "PENDIENTE"')
+        with self._transaction() as conn:
+            cursor = conn.execute("SELECT * FROM tasks WHERE status = 'PENDIENTE'")
             return cursor.fetchall()
 
-    def update_task_status(self, task_id, status, error_message=None):
+    def claim_tasks(self, worker_id, limit=10, lease_seconds=None, exclude_ids=()):
+        """
+        Reserva de forma atómica hasta `limit` tareas para un worker: las pendientes cuyo reintento
+        ya venció y las que quedaron EN_PROCESO con el lease vencido (worker caído). Cada tarea
+        reservada pasa a EN_PROCESO con un lease de lease_seconds; ningún otro worker la recibirá
+        mientras siga vigente. Cada reserva incrementa `attempts`, que funciona como token del lease: al
+        recuperar una tarea vencida, el dueño anterior (aunque sea el mismo worker) ya no puede renovarla
+        ni cerrarla (ver renew_lease y update_task_status).
+        `exclude_ids` son las tareas que el worker todavía está procesando: no se recuperan aunque su lease
+        haya vencido. Retorna las filas reservadas como dicts.
+        """
+        ahora = datetime.now()
+        vence = (ahora + timedelta(seconds=lease_seconds or config.QUEUE_LEASE_SECONDS)).isoformat()
+        ahora = ahora.isoformat()
+        excluidas = list(exclude_ids)
+        filtro = f"AND id NOT IN ({', '.join('?' * len(excluidas))})" if excluidas else ''
+
+        with self._transaction(immediate=True) as conn:
+            ids = [row[0] for row in conn.execute(f'''
+                SELECT id FROM tasks
+                WHERE ((status = 'PENDIENTE' AND (next_attempt_at IS NULL OR next_attempt_at <= ?))
+                       OR (status = 'EN_PROCESO' AND lease_expires_at < ?))
+                  {filtro}
+                ORDER BY id LIMIT ?
+            ''', (ahora, ahora, *excluidas, limit))]
+            if not ids:
+                return []
+            marcadores = ', '.join('?' * len(ids))
+            conn.execute(f'''
+                UPDATE tasks
+                SET status = 'EN_PROCESO', lease_owner = ?, lease_expires_at = ?,
+                    attempts = attempts + 1, updated_at = ?
+                WHERE id IN ({marcadores})
+            ''', (worker_id, vence, ahora, *ids))
+            cursor = conn.execute(f'SELECT * FROM tasks WHERE id IN ({marcadores}) ORDER BY id', ids)
+            columnas = [col[0] for col in cursor.description]
+            return [dict(zip(columnas, row)) for row in cursor.fetchall()]
+
+    def renew_lease(self, task_id, worker_id, attempt, lease_seconds=None):
+        """
+        Extiende el lease de una tarea larga. `attempt` es el valor de `attempts` con que se reservó.
+        Retorna False si el worker ya no es su dueño: el lease venció o la tarea se volvió a reservar.
+        """
+        ahora = datetime.now()
+        vence = (ahora + timedelta(seconds=lease_seconds or config.QUEUE_LEASE_SECONDS)).isoformat()
+        with self._transaction() as conn:
+            cursor = conn.execute('''
+                UPDATE tasks SET lease_expires_at = ?
+                WHERE id = ? AND lease_owner = ? AND attempts = ? AND status = 'EN_PROCESO'
+                  AND lease_expires_at >= ?
+            ''', (vence, task_id, worker_id, attempt, ahora.isoformat()))
+            return cursor.rowcount == 1
+
+    def schedule_retry(self, task_id, error_message, delay_seconds, attempt=None):
+        """
+        Devuelve una tarea fallida a PENDIENTE para reintentarla dentro de delay_seconds. Con `attempt`, solo
+        si sigue EN_PROCESO con esa reserva; retorna False si otro worker la recuperó entretanto.
+        """
+        ahora = datetime.now()
+        next_attempt_at = (ahora + timedelta(seconds=delay_seconds)).isoformat()
+        condicion, parametros = self._condicion_reserva(attempt)
+        with self._transaction() as conn:
+            cursor = conn.execute(f'''
+                UPDATE tasks SET status = 'PENDIENTE', updated_at = ?, error_message = ?, next_attempt_at = ?,
+                    lease_owner = NULL, lease_expires_at = NULL
+                WHERE id = ?{condicion}
+            ''', (ahora.isoformat(), error_message, next_attempt_at, task_id, *parametros))
+            return cursor.rowcount == 1
+
+    @staticmethod
+    def _condicion_reserva(attempt):
+        """Filtro que limita una actualización a la reserva `attempt` de una tarea en curso (None: sin filtro)."""
+        if attempt is None:
+            return '', ()
+        return " AND status = 'EN_PROCESO' AND attempts = ?", (attempt,)
+
+    def next_retry_at(self):
+        """Fecha (datetime) del próximo reintento programado entre las tareas PENDIENTE; None si no hay."""
+        with self._transaction() as conn:
+            row = conn.execute('''
+                SELECT MIN(next_attempt_at) FROM tasks WHERE status = 'PENDIENTE' AND next_attempt_at IS NOT NULL
+            ''').fetchone()
+        return datetime.fromisoformat(row[0]) if row and row[0] else None
+
+    def count_by_status(self):
+        with self._transaction() as conn:
+            return dict(conn.execute('SELECT status, COUNT(*) FROM tasks GROUP BY status').fetchall())
+
+    def get_known_file_ids(self):
+        """IDs de OneDrive que ya tienen una tarea registrada, en cualquier estado."""
+        with self._transaction() as conn:
+            return {row[0] for row in conn.execute('SELECT file_id FROM tasks')}
+
+    def get_known_file_versions(self):
+        """{file_id: file_version} de la última tarea de cada archivo (versión None si se encoló sin ella)."""
+        with self._transaction() as conn:
+            return dict(conn.execute('''
+                SELECT file_id, file_version FROM tasks
+                WHERE id IN (SELECT MAX(id) FROM tasks GROUP BY file_id)
+            '''))
+
+    def mark_deleted(self, file_id):
+        """Descarta las tareas pendientes de un archivo que ya no existe en OneDrive."""
         updated_at = datetime.now().isoformat()
-        with self._get_connection() as conn:
+        with self._transaction() as conn:
+            cursor = conn.execute('''
+                UPDATE tasks SET status = 'ELIMINADO', updated_at = ? WHERE file_id = ? AND status = 'PENDIENTE'
+            ''', (updated_at, file_id))
+            return cursor.rowcount
+
+    def get_delta_link(self, scope):
+        with self._transaction() as conn:
+            row = conn.execute('SELECT delta_link FROM delta_tokens WHERE scope = ?', (scope,)).fetchone()
+            return row[0] if row else None
+
+    def save_delta_link(self, scope, delta_link):
+        updated_at = datetime.now().isoformat()
+        with self._transaction() as conn:
             conn.execute('''
-                UPDATE tasks SET status = ?, updated_at = ?, error_message = ? WHERE id = ?
-            ''', (status, updated_at, error_message, task_id))
+                INSERT INTO delta_tokens (scope, delta_link, updated_at) VALUES (?, ?, ?)
+                ON CONFLICT(scope) DO UPDATE SET delta_link = excluded.delta_link, updated_at = excluded.updated_at
+            ''', (scope, delta_link, updated_at))
+
+    def clear_delta_link(self, scope):
+        with self._transaction() as conn:
+            conn.execute('DELETE FROM delta_tokens WHERE scope = ?', (scope,))
+
+    def get_processed_hashes(self, pipeline, hashes):
+        """Subconjunto de `hashes` (SHA-256) cuyo contenido ya se procesó sin errores con `pipeline`."""
+        hashes = list(set(hashes))
+        encontrados = set()
+        with self._transaction() as conn:
+            # SQLite limita la cantidad de parámetros por sentencia
+            for inicio in range(0, len(hashes), 500):
+                lote = hashes[inicio:inicio + 500]
+                marcadores = ', '.join('?' * len(lote))
+                encontrados.update(row[0] for row in conn.execute(f'''
+                    SELECT sha256 FROM content_manifest
+                    WHERE pipeline = ? AND resultado = 'PROCESADO' AND sha256 IN ({marcadores})
+                ''', (pipeline, *lote)))
+        return encontrados
+
+    def record_contents(self, registros):
+        """
+        Registra en una sola transacción una lista de (sha256, pipeline, tipo_contenido, nombre, tamano,
+        filas_extraidas, filas_cargadas, filas_omitidas, filas_rechazadas, resultado).
+        Un contenido ya PROCESADO no pierde ese estado por un reproceso forzado que termine con errores.
+        """
+        updated_at = datetime.now().isoformat()
+        filas = [(*registro, updated_at) for registro in registros]
+        if not filas:
+            return 0
+        with self._transaction() as conn:
+            conn.executemany('''
+                INSERT INTO content_manifest (sha256, pipeline, tipo_contenido, nombre, tamano, filas_extraidas,
+                    filas_cargadas, filas_omitidas, filas_rechazadas, resultado, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(sha256, pipeline) DO UPDATE SET
+                    tipo_contenido = excluded.tipo_contenido, nombre = excluded.nombre, tamano = excluded.tamano,
+                    filas_extraidas = excluded.filas_extraidas, filas_cargadas = excluded.filas_cargadas,
+                    filas_omitidas = excluded.filas_omitidas, filas_rechazadas = excluded.filas_rechazadas,
+                    resultado = excluded.resultado, updated_at = excluded.updated_at
+                WHERE content_manifest.resultado != 'PROCESADO' OR excluded.resultado = 'PROCESADO'
+            ''', filas)
+        return len(filas)
+
+    def update_task_status(self, task_id, status, error_message=None, attempt=None):
+        """
+        Cambia el estado de una tarea y libera su lease. Con `attempt`, solo si sigue EN_PROCESO con esa
+        reserva; retorna False si otro worker la recuperó entretanto.
+        """
+        updated_at = datetime.now().isoformat()
+        condicion, parametros = self._condicion_reserva(attempt)
+        with self._transaction() as conn:
+            cursor = conn.execute(f'''
+                UPDATE tasks SET status = ?, updated_at = ?, error_message = ?,
+                    lease_owner = NULL, lease_expires_at = NULL
+                WHERE id = ?{condicion}
+            ''', (status, updated_at, error_message, task_id, *parametros))
+            return cursor.rowcount == 1
 
 # Instancia global
-queue_db = QueueDB()
\ No newline at end of file
+queue_db = QueueDB()
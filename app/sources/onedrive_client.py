@@ -1,10 +1,123 @@
 # Cliente para OneDrive - Adaptado de FilesToS3.py
 
 import os
-import msal
+import time
+import asyncio
+import logging
+import threading
+from contextlib import contextmanager
+import httpx
 import requests
 from app.config import config
 
+GRAPH_API_URL = "https://graph.microsoft.com/v1.0"
+# Campos mínimos que necesita la fase de escaneo; reduce el tamaño de cada página
+LIST_SELECT_FIELDS = "id,name,size,file,folder,parentReference,lastModifiedDateTime"
+
+logger = logging.getLogger(__name__)
+
+class DeltaTokenExpired(Exception):
+    """Graph rechazó el delta link guardado (410 Gone / resyncRequired); hay que re-sincronizar desde cero."""
+
+
+class TokenManager:
+    """
+    Access token de Graph compartido por todo el proceso. Usa una sola PublicClientApplication con
+    una caché MSAL serializable (opcionalmente persistida en disco) y solo vuelve a pedir token
+    cuando faltan menos de refresh_margin segundos para que expire.
+    Seguro para hilos; las tareas asyncio usan get_token_async, que no bloquea el event loop.
+    """
+
+    def __init__(self, ms_config, cache_path=None, refresh_margin=None):
+        self.ms_config = ms_config
+        self.cache_path = cache_path
+        self.refresh_margin = refresh_margin if refresh_margin is not None else config.MS_TOKEN_REFRESH_MARGIN
+        self._lock = threading.Lock()
+        # msal y su caché se cargan al pedir el primer token (ver _get_app)
+        self._cache = None
+        self._app = None
+        self._access_token = None
+        self._expires_at = 0.0
+
+    def _is_valid(self):
+        return self._access_token is not None and time.time() < self._expires_at - self.refresh_margin
+
+    def _get_app(self):
+        # Siempre usar PublicClientApplication (compatible con refresh tokens de device flow)
+        if self._app is None:
+            import msal
+            self._cache = msal.SerializableTokenCache()
+            if self.cache_path and os.path.exists(self.cache_path):
+                with open(self.cache_path, 'r', encoding='utf-8') as f:
+                    self._cache.deserialize(f.read())
+            self._app = msal.PublicClientApplication(
+                client_id=self.ms_config["client_id"],
+                authority=self.ms_config["authority"],
+                token_cache=self._cache
+            )
+        return self._app
+
+    def _persist_cache(self):
+        if self.cache_path and self._cache is not None and self._cache.has_state_changed:
+            with open(self.cache_path, 'w', encoding='utf-8') as f:
+                f.write(self._cache.serialize())
+
+    def _acquire(self):
+        config_ms = self.ms_config
+        app = self._get_app()
+        scopes = config_ms["scopes"]
+
+        # Primero la caché de MSAL: renueva en silencio con el refresh token que ya tiene guardado
+        accounts = app.get_accounts()
+        if accounts:
+            result = app.acquire_token_silent(scopes, account=accounts[0])
+            if result and "access_token" in result:
+                return result
+
+        if config_ms.get("use_refresh"):
+            # Usar refresh token con Public Client
+            return app.acquire_token_by_refresh_token(config_ms["refresh_token"], scopes=scopes)
+
+        # Usar device flow
+        flow = app.initiate_device_flow(scopes=scopes)
+        if "user_code" not in flow:
+            raise ValueError("Fallo al crear el flujo de dispositivo.", flow.get("error_description"))
+
+        print(flow["message"])
+        result = app.acquire_token_by_device_flow(flow)
+        # Imprimir refresh token para configuración
+        if "access_token" in result and "refresh_token" in result:
+            print(f"\n--- REFRESH TOKEN PARA .ENV ---\nMS_REFRESH_TOKEN={result['refresh_token']}\n-------------------------------\n")
+        return result
+
+    def get_token(self):
+        """Devuelve un access token vigente, renovándolo solo si está por expirar."""
+        if self._is_valid():
+            return self._access_token
+        with self._lock:
+            # Otro hilo pudo haberlo renovado mientras esperábamos el lock
+            if self._is_valid():
+                return self._access_token
+            result = self._acquire()
+            if "access_token" not in result:
+                raise Exception(f"No se pudo obtener el access token: {result.get('error_description')}")
+            self._access_token = result["access_token"]
+            self._expires_at = time.time() + int(result.get("expires_in", 3600))
+            self._persist_cache()
+            return self._access_token
+
+    async def get_token_async(self):
+        if self._is_valid():
+            return self._access_token
+        return await asyncio.to_thread(self.get_token)
+
+    def invalidate(self):
+        """Fuerza la renovación en la próxima llamada (p. ej. tras un 401 de Graph)."""
+        with self._lock:
+            self._access_token = None
+            self._expires_at = 0.0
+
+
 class OneDriveClient:
     def __init__(self):
         # Configuración de Microsoft (igual que en el código de ejemplo)
@@ -19,38 +132,17 @@ class OneDriveClient:
             "scopes": ['Files.ReadWrite.All'],
             "use_refresh": use_refresh  # True solo si hay refresh token válido
         }
+        self.token_manager = TokenManager(self.ms_config, cache_path=config.MS_TOKEN_CACHE_PATH or None)
         self.token = None
 
     def _get_token(self):
-        """Obtiene access token de Microsoft Graph usando Public Client (compatible con refresh tokens de device flow)."""
-        config_ms = self.ms_config
+        """Obtiene access token de Microsoft Graph; se reutiliza hasta poco antes de que expire."""
+        self.token = self.token_manager.get_token()
+        return self.token
 
-        # Siempre usar PublicClientApplication (compatible con refresh tokens de device flow)
-        app = msal.PublicClientApplication(
-            client_id=config_ms["client_id"],
-            authority=config_ms["authority"]
-        )
-
-        if config_ms.get("use_refresh"):
-            # Usar refresh token con Public Client
-            result = app.acquire_token_by_refresh_token(config_ms["refresh_token"], scopes=config_ms["scopes"])
-        else:
-            # Usar device flow
-            flow = app.initiate_device_flow(scopes=config_ms["scopes"])
-            if "user_code" not in flow:
-                raise ValueError("Fallo al crear el flujo de dispositivo.", flow.get("error_description"))
-
-            print(flow["message"])
-            result = app.acquire_token_by_device_flow(flow)
-            # Imprimir refresh token para configuración
-            if "access_token" in result and "refresh_token" in result:
-                print(f"\n--- REFRESH TOKEN PARA .ENV ---\nMS_REFRESH_TOKEN={result['refresh_token']}\n-------------------------------\n")
-
-        if "access_token" in result:
-            self.token = result["access_token"]
-            return self.token
-        else:
-            raise Exception(f"No se pudo obtener el access token: {result.get('error_description')}")
+    async def _auth_headers_async(self):
+        token = await self.token_manager.get_token_async()
+        return {'Authorization': 'Bearer ' + token}
 
     def list_files(self, folder_path="AbacoBot"):
         """
@@ -90,6 +182,109 @@ class OneDriveClient:
         recurse(folder_path)
         return archivos_totales
 
+    async def iter_files_async(self, folder_path="AbacoBot", max_concurrency=None, carpetas_fallidas=None):
+        """
+        Versión asíncrona de list_files: lista las carpetas en paralelo (acotado por un semáforo),
+        sigue la paginación @odata.nextLink y entrega cada archivo apenas llega su página.
+        Una carpeta que no se pudo listar (agotados los reintentos por throttling) se registra en el log y
+        en `carpetas_fallidas`: su subárbol queda fuera del escaneo.
+        """
+        semaphore = asyncio.Semaphore(max_concurrency or config.ONEDRIVE_MAX_CONCURRENCY)
+        archivos = asyncio.Queue()
+        fin = object()
+        tareas = set()
+        activas = 0
+
+        async with httpx.AsyncClient(timeout=httpx.Timeout(60.0)) as client:
+
+            async def get_page(url):
+                # Respeta el throttling de Graph (429/503 con Retry-After) y renueva el token ante un 401
+                for _ in range(5):
+                    async with semaphore:
+                        response = await client.get(url, headers=await self._auth_headers_async())
+                    if response.status_code == 401:
+                        self.token_manager.invalidate()
+                        continue
+                    if response.status_code not in (429, 503):
+                        break
+                    await asyncio.sleep(float(response.headers.get('Retry-After', 5)))
+                response.raise_for_status()
+                return response.json()
+
+            async def listar(url, current_path):
+                nonlocal activas
+                try:
+                    while url:
+                        data = await get_page(url)
+                        for item in data.get('value', []):
+                            if 'folder' in item:
+                                lanzar(f"{GRAPH_API_URL}/me/drive/items/{item['id']}/children?$select={LIST_SELECT_FIELDS}",
+                                       f"{current_path}/{item['name']}")
+                            else:
+                                await archivos.put(item)
+                        url = data.get('@odata.nextLink')
+                except Exception as e:
+                    # HTTP, token (MSAL) o respuesta inválida; CancelledError (BaseException) sigue su curso
+                    logger.error(f"Error al listar {current_path} en OneDrive; se omite su subárbol: "
+                                 f"{type(e).__name__}: {e}")
+                    if carpetas_fallidas is not None:
+                        carpetas_fallidas.append(current_path)
+                finally:
+                    activas -= 1
+                    if activas == 0:
+                        archivos.put_nowait(fin)
+
+            def lanzar(url, current_path):
+                nonlocal activas
+                activas += 1
+                tarea = asyncio.create_task(listar(url, current_path))
+                tareas.add(tarea)
+                tarea.add_done_callback(tareas.discard)
+
+            print(f"Buscando todos los archivos dentro de la carpeta '{folder_path}' en OneDrive (modo asíncrono)...")
+            lanzar(f"{GRAPH_API_URL}/me/drive/root:/{folder_path}:/children?$select={LIST_SELECT_FIELDS}", folder_path)
+            try:
+                while True:
+                    item = await archivos.get()
+                    if item is fin:
+                        break
+                    yield item
+            finally:
+                for tarea in tareas:
+                    tarea.cancel()
+
+    async def iter_delta_pages_async(self, folder_path="AbacoBot", delta_link=None):
+        """
+        Recorre el endpoint delta de la carpeta. Sin delta_link entrega todo el árbol (sincronización
+        inicial); con él, solo lo agregado, modificado o eliminado desde entonces.
+        Cada página es un dict {'items': [...], 'delta_link': str | None}; el delta link nuevo llega
+        únicamente en la última página, y conviene guardarlo solo después de procesarla.
+        """
+        url = delta_link or f"{GRAPH_API_URL}/me/drive/root:/{folder_path}:/delta?$select={LIST_SELECT_FIELDS},deleted"
+
+        reintentos_401 = 0
+        reintentos_throttling = 0
+        async with httpx.AsyncClient(timeout=httpx.Timeout(60.0)) as client:
+            while url:
+                response = await client.get(url, headers=await self._auth_headers_async())
+                if response.status_code == 401 and reintentos_401 < 2:
+                    reintentos_401 += 1
+                    self.token_manager.invalidate()
+                    continue
+                # Throttling acotado como en get_page: agotados los reintentos, raise_for_status hace fallar la corrida
+                if response.status_code in (429, 503) and reintentos_throttling < 4:
+                    reintentos_throttling += 1
+                    await asyncio.sleep(float(response.headers.get('Retry-After', 5)))
+                    continue
+                if response.status_code == 410:
+                    raise DeltaTokenExpired(response.text)
+                response.raise_for_status()
+                reintentos_throttling = 0
+                data = response.json()
+                nuevo_delta = data.get('@odata.deltaLink')
+                yield {'items': data.get('value', []), 'delta_link': nuevo_delta}
+                url = data.get('@odata.nextLink')
+
     def get_download_url(self, file_id):
         """
         Obtiene la URL de descarga de un archivo usando su ID.
@@ -117,6 +312,16 @@ class OneDriveClient:
                 for chunk in r.iter_content(chunk_size=8192):
                     f.write(chunk)
 
+    @contextmanager
+    def open_download(self, download_url):
+        """
+        Abre la descarga como stream binario de solo lectura, sin escribirla a disco.
+        """
+        with requests.get(download_url, stream=True, timeout=(10, 300)) as r:
+            r.raise_for_status()
+            r.raw.decode_content = True
+            yield r.raw
+
     def delete_file(self, file_id):
         """
         Elimina un archivo de OneDrive usando su ID.
@@ -0,0 +1,165 @@
+# Lectura de .zip remotos con HTTP Range: solo el directorio central y los miembros que se procesan
+
+import bisect
+import io
+import zipfile
+
+import requests
+
+from app.config import config
+
+# Cola que se pide al abrir: registro de fin del directorio central (22 bytes) + comentario máximo (64 KB).
+# En comprimidos chicos y medianos trae también el directorio central completo.
+TAMANO_COLA = 22 + 65535
+
+# Al abrir un miembro la petición se extiende a los miembros chicos que le siguen (p. ej. XML contiguos),
+# hasta LECTURA_AGRUPADA bytes; un miembro más grande que MIEMBRO_CHICO (un anexo) corta la agrupación
+MIEMBRO_CHICO = 64 * 1024
+LECTURA_AGRUPADA = 512 * 1024
+
+
+class RangoNoSoportado(Exception):
+    """El servidor ignora Range y respondería el archivo completo."""
+
+
+class HTTPRangeFile(io.RawIOBase):
+    """
+    Archivo de solo lectura y con seek sobre una URL: cada lectura que no está en el búfer se pide con
+    un GET Range de al menos `bloque` bytes. Sirve como fp de zipfile.ZipFile. Lleva la cuenta de las
+    peticiones y los bytes transferidos.
+    """
+
+    def __init__(self, url, session=None, bloque=None, timeout=(10, 120)):
+        super().__init__()
+        self.url = url
+        self.session = session or requests.Session()
+        self.bloque = bloque or config.ARCHIVE_RANGE_BLOCK_MB * 1024 * 1024
+        self.timeout = timeout
+        self.peticiones = 0
+        self.bytes_transferidos = 0
+        self._tamano = None
+        self._pos = 0
+        self._buf_inicio = 0
+        self._buf = b''
+
+    # --- HTTP ---
+
+    def _get(self, rango):
+        with self.session.get(self.url, headers={'Range': f"bytes={rango}"}, stream=True, timeout=self.timeout) as r:
+            r.raise_for_status()
+            if r.status_code != 206:
+                # Un servidor sin soporte de Range responde 200 con el archivo completo: solo se acepta si es chico
+                largo = int(r.headers.get('Content-Length') or 0)
+                if r.status_code != 200 or not largo or largo > TAMANO_COLA:
+                    raise RangoNoSoportado(f"Respuesta {r.status_code} a una petición Range de {largo} bytes")
+                datos = r.content
+                total = len(datos)
+                inicio = 0
+            else:
+                datos = r.content
+                unidad_rango, _, total = r.headers.get('Content-Range', '').rpartition('/')
+                inicio = int(unidad_rango.split()[-1].split('-')[0]) if unidad_rango else 0
+                total = int(total) if total.isdigit() else None
+        self.peticiones += 1
+        self.bytes_transferidos += len(datos)
+        return inicio, datos, total
+
+    def _cargar(self, inicio, longitud):
+        fin = min(inicio + longitud, self.size) - 1
+        self._buf_inicio, self._buf, _ = self._get(f"{inicio}-{fin}")
+
+    @property
+    def size(self):
+        if self._tamano is None:
+            # La primera petición trae la cola del archivo (donde zipfile busca el directorio central) y el tamaño
+            inicio, datos, total = self._get(f"-{TAMANO_COLA}")
+            self._tamano = total if total is not None else inicio + len(datos)
+            self._buf_inicio, self._buf = inicio, datos
+        return self._tamano
+
+    def precargar(self, inicio, necesario, deseado=None):
+        """
+        Si [inicio, inicio+necesario) no está en el búfer, trae en una sola petición `deseado` bytes
+        desde inicio (por defecto `necesario`; como máximo `bloque`).
+        """
+        fin = min(inicio + necesario, self.size)
+        if not (self._buf_inicio <= inicio and fin <= self._buf_inicio + len(self._buf)):
+            self._cargar(inicio, min(max(deseado or 0, necesario), self.bloque))
+
+    # --- io.RawIOBase ---
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self._pos = offset
+        elif whence == io.SEEK_CUR:
+            self._pos += offset
+        elif whence == io.SEEK_END:
+            self._pos = self.size + offset
+        else:
+            raise ValueError(f"whence inválido: {whence}")
+        if self._pos < 0:
+            raise ValueError("Posición negativa")
+        return self._pos
+
+    def readinto(self, b):
+        # Se llena b completo (o hasta el final): zipfile trata una lectura corta como archivo truncado
+        vista = memoryview(b).cast('B')
+        leidos = 0
+        while leidos < len(vista) and self._pos < self.size:
+            if not (self._buf_inicio <= self._pos < self._buf_inicio + len(self._buf)):
+                self._cargar(self._pos, max(len(vista) - leidos, self.bloque))
+            desde = self._pos - self._buf_inicio
+            trozo = self._buf[desde:desde + len(vista) - leidos]
+            vista[leidos:leidos + len(trozo)] = trozo
+            leidos += len(trozo)
+            self._pos += len(trozo)
+        return leidos
+
+    def close(self):
+        self._buf = b''
+        super().close()
+
+
+class RemoteZipFile(zipfile.ZipFile):
+    """
+    zipfile.ZipFile sobre una URL con soporte de Range. Al abrir el comprimido solo se descargan la cola y,
+    si no entra en ella, el directorio central. Al abrir un miembro se pide de una vez su cabecera local y
+    sus datos comprimidos; los miembros que no se abren no se descargan.
+    """
+
+    def __init__(self, url, session=None, bloque=None):
+        self.remoto = HTTPRangeFile(url, session=session, bloque=bloque)
+        super().__init__(self.remoto)
+        # Cada miembro ocupa desde su cabecera local hasta la del siguiente (o el directorio central)
+        self._inicios = sorted(info.header_offset for info in self.infolist())
+        self._inicios.append(self.start_dir)
+
+    def _extension(self, posicion):
+        """Bytes del miembro cuya cabecera local está en `posicion`, incluidos cabecera y descriptor."""
+        indice = bisect.bisect_right(self._inicios, posicion)
+        return self._inicios[indice] - posicion
+
+    def open(self, name, mode='r', pwd=None, *, force_zip64=False):
+        if mode == 'r':
+            info = name if isinstance(name, zipfile.ZipInfo) else self.getinfo(name)
+            necesario = deseado = self._extension(info.header_offset)
+            while info.header_offset + deseado < self.start_dir:
+                siguiente = self._extension(info.header_offset + deseado)
+                if siguiente > MIEMBRO_CHICO or deseado + siguiente > LECTURA_AGRUPADA:
+                    break
+                deseado += siguiente
+            self.remoto.precargar(info.header_offset, necesario, deseado)
+        return super().open(name, mode, pwd, force_zip64=force_zip64)
+
+    def close(self):
+        super().close()
+        self.remoto.close()
@@ -0,0 +1,389 @@
+# Pool de workers asíncrono para la fase 2: drena la cola de tareas con concurrencia acotada por tipo
+
+import asyncio
+import importlib
+import logging
+import os
+import random
+import socket
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+
+from app.config import config, match_file_pattern, extract_ruc, generar_identificador_procesamiento, ARCHIVE_EXTENSIONS
+from app.queue_db import queue_db
+from app.sources.onedrive_client import onedrive_client
+from app.sources.remote_zip import RemoteZipFile, RangoNoSoportado
+from app.archive_stream import Fuente, abrir_comprimido, iter_comprimido, nombre_fuente
+from app.destinations.s3_client import s3_client
+from app.destinations.postgres_client import postgres_client
+from app.content_manifest import ContentManifest
+from app.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Pipelines disponibles por tipo de archivo NEED ETL (módulo, función); el resto queda en estado SIN_PIPELINE.
+# Se importan recién en el proceso del pool, así el proceso principal no carga pandas
+ETL_PIPELINES = {
+    'sire_compras': ('app.etl_pipelines.sire_compras_etl', 'run_sire_compras_etl'),
+    'sire_ventas': ('app.etl_pipelines.sire_ventas_etl', 'run_sire_ventas_etl'),
+    'factura_xml': ('app.etl_pipelines.xml_parser_etl', 'run_xml_etl'),
+    'boleta_xml': ('app.etl_pipelines.xml_parser_etl', 'run_xml_etl'),
+    'credito_xml': ('app.etl_pipelines.xml_parser_etl', 'run_xml_etl'),
+    'debito_xml': ('app.etl_pipelines.xml_parser_etl', 'run_xml_etl'),
+    'recibo_xml': ('app.etl_pipelines.xml_parser_etl', 'run_xml_etl'),
+    'guia_remision_xml': ('app.etl_pipelines.guia_remision_etl', 'run_guia_remision_etl'),
+}
+
+
+class SinPipeline(Exception):
+    """El archivo necesita ETL pero todavía no hay pipeline para su tipo; no tiene sentido reintentar."""
+
+
+def classify_task(file_name):
+    """Tipo de tarea de la fase 2 ('no_etl', 'etl' o 'comprimido'); None si el archivo no se reconoce."""
+    tipo, _, need_etl = match_file_pattern(file_name)
+    if tipo is None:
+        return 'comprimido' if file_name.lower().endswith(ARCHIVE_EXTENSIONS) else None
+    return 'etl' if need_etl else 'no_etl'
+
+
+def s3_key(file_name):
+    """Clave de archivo en S3: RUC/nombre_archivo."""
+    return f"{extract_ruc(file_name) or 'SIN_RUC'}/{file_name}"
+
+
+def _run_pipeline_etl(tipo, rutas):
+    """Punto de entrada en el pool de procesos. COPY + ON CONFLICT DO NOTHING hace idempotente un reintento."""
+    modulo, funcion = ETL_PIPELINES[tipo]
+    pipeline = getattr(importlib.import_module(modulo), funcion)
+    if tipo.startswith('sire_'):
+        resumen = pipeline(rutas, load_mode='copy', on_conflict='nothing', transform_mode='fused',
+                           read_engine=config.SIRE_READ_ENGINE)
+    else:
+        resumen = pipeline(rutas, on_conflict='nothing')
+    # Las mediciones de este proceso viajan con el resumen al proceso principal
+    resumen.metricas = metrics.tomar()
+    return resumen
+
+
+class WorkerPool:
+    """
+    Reserva tareas de queue_db (claim con lease) y las procesa en paralelo:
+    - no_etl: la download URL de OneDrive se transmite directo a S3.
+    - etl: descarga a una Fuente (en memoria salvo archivos grandes), pipeline (SIRE o XML) en un
+      ProcessPoolExecutor y archivo del original en S3.
+    - comprimido: lectura por rangos (o descarga) e inspección de los miembros, incluidos los de comprimidos
+      anidados, que coinciden con patrones SUNAT; cada uno pasa como Fuente al pipeline y a S3, sin extraerlo.
+    La red y el disco se ejecutan en hilos para no bloquear el event loop. Cada tipo tiene su propio
+    límite de concurrencia. Antes de correr un pipeline se consulta el manifiesto de contenido: un archivo
+    idéntico a uno ya procesado no vuelve a cargarse (salvo force). Una tarea fallida se reintenta con backoff exponencial y, agotados
+    WORKER_MAX_ATTEMPTS intentos, pasa a estado FALLIDO (dead-letter) sin detener al resto.
+    Mientras una tarea está en curso su lease se renueva cada QUEUE_LEASE_SECONDS / 3, así otro worker no la
+    recupera durante una carga larga. Si un proceso del pool muere, el pool se reconstruye.
+    """
+
+    def __init__(self, queue=None, concurrency=None, etl_processes=None, max_attempts=None,
+                 backoff_base=None, backoff_max=None, poll_interval=5.0, force=False):
+        self.queue = queue or queue_db
+        self.concurrency = concurrency or {
+            'no_etl': config.WORKER_CONCURRENCY_NO_ETL,
+            'etl': config.WORKER_CONCURRENCY_ETL,
+            'comprimido': config.WORKER_CONCURRENCY_COMPRIMIDO,
+        }
+        self.etl_processes = etl_processes or config.WORKER_ETL_PROCESSES
+        self.max_attempts = max_attempts or config.WORKER_MAX_ATTEMPTS
+        self.backoff_base = backoff_base if backoff_base is not None else config.WORKER_BACKOFF_BASE_SECONDS
+        self.backoff_max = backoff_max if backoff_max is not None else config.WORKER_BACKOFF_MAX_SECONDS
+        self.poll_interval = poll_interval
+        self.force = force
+        self.manifest = ContentManifest(self.queue)
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}"
+        self.lease_seconds = config.QUEUE_LEASE_SECONDS
+        self.stats = {'completadas': 0, 'reintentos': 0, 'fallidas': 0, 'sin_pipeline': 0, 'ignoradas': 0, 'omitidas': 0,
+                      'duplicadas': 0}
+        self._etl_executor = None
+        self._en_curso = set()  # ids de las tareas reservadas que este worker todavía procesa
+        self._procesados = []  # registros para archivos_procesados, se escriben por lotes
+        self._handlers = {
+            'no_etl': self._process_no_etl,
+            'etl': self._process_etl,
+            'comprimido': self._process_archive,
+        }
+
+    async def run(self):
+        """
+        Procesa la cola hasta que no quedan tareas disponibles, en curso ni reintentos programados (si solo
+        quedan reintentos, espera a que venza el próximo). Retorna los contadores.
+        """
+        semaforos = {tipo: asyncio.Semaphore(n) for tipo, n in self.concurrency.items()}
+        capacidad = sum(self.concurrency.values())
+        en_curso = set()
+
+        self._etl_executor = ProcessPoolExecutor(max_workers=self.etl_processes)
+        try:
+            while True:
+                libres = capacidad - len(en_curso)
+                tareas = await asyncio.to_thread(self.queue.claim_tasks, self.worker_id, libres,
+                                                 exclude_ids=list(self._en_curso)) if libres > 0 else []
+                if tareas:
+                    tareas = await asyncio.to_thread(self._skip_processed, tareas)
+                await self._flush_processed()
+                for tarea in tareas:
+                    self._en_curso.add(tarea['id'])
+                    t = asyncio.create_task(self._handle(tarea, semaforos))
+                    en_curso.add(t)
+                    t.add_done_callback(en_curso.discard)
+                if not en_curso:
+                    proximo = await asyncio.to_thread(self.queue.next_retry_at)
+                    if proximo is None:
+                        break
+                    espera = max((proximo - datetime.now()).total_seconds(), 0)
+                    logger.info(f"Sin tareas en curso; se espera {espera:.0f}s al próximo reintento programado.")
+                    await asyncio.sleep(espera)
+                    continue
+                # Espera a que termine alguna tarea (o a que venza algún reintento) antes de reservar más
+                await asyncio.wait(en_curso, timeout=self.poll_interval, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            self._etl_executor.shutdown()
+
+        await self._flush_processed()
+        logger.info(f"Fase 2 completada: {self.stats}")
+        return self.stats
+
+    async def _handle(self, tarea, semaforos):
+        latido = asyncio.create_task(self._heartbeat(tarea))
+        try:
+            await self._handle_claimed(tarea, semaforos)
+        finally:
+            latido.cancel()
+            self._en_curso.discard(tarea['id'])
+
+    async def _heartbeat(self, tarea):
+        """Renueva el lease de la tarea mientras se procesa (incluida la espera del semáforo)."""
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            if not await asyncio.to_thread(self.queue.renew_lease, tarea['id'], self.worker_id, tarea['attempts']):
+                logger.warning(f"No se pudo renovar el lease de la tarea {tarea['id']} ({tarea['file_name']}).")
+                return
+
+    async def _handle_claimed(self, tarea, semaforos):
+        nombre = tarea['file_name']
+        tipo = classify_task(nombre)
+        if tipo is None:
+            await asyncio.to_thread(self.queue.update_task_status, tarea['id'], 'IGNORADO', 'Archivo no reconocido',
+                                    tarea['attempts'])
+            self.stats['ignoradas'] += 1
+            return
+
+        async with semaforos[tipo]:
+            # El latido pudo haber perdido el lease mientras la tarea esperaba el semáforo
+            if not await asyncio.to_thread(self.queue.renew_lease, tarea['id'], self.worker_id, tarea['attempts']):
+                logger.warning(f"Se perdió el lease de la tarea {tarea['id']} ({nombre}); la procesará otro worker.")
+                return
+            try:
+                await self._handlers[tipo](tarea)
+            except SinPipeline as e:
+                await asyncio.to_thread(self.queue.update_task_status, tarea['id'], 'SIN_PIPELINE', str(e),
+                                        tarea['attempts'])
+                self.stats['sin_pipeline'] += 1
+            except Exception as e:
+                await asyncio.to_thread(self._register_failure, tarea, e)
+            else:
+                if await asyncio.to_thread(self.queue.update_task_status, tarea['id'], 'COMPLETADO', None,
+                                           tarea['attempts']):
+                    self.stats['completadas'] += 1
+                else:
+                    logger.warning(f"La tarea {tarea['id']} ({nombre}) terminó después de perder su lease.")
+
+    def _skip_processed(self, tareas):
+        """
+        Consulta en lote (una ronda contra PostgreSQL) cuáles de los archivos ETL reservados ya fueron
+        procesados; esos se cierran como OMITIDO y no se descargan. Retorna las tareas restantes.
+        """
+        nombres = [t['file_name'] for t in tareas if classify_task(t['file_name']) == 'etl']
+        if not nombres:
+            return tareas
+        procesados = postgres_client.check_files_processed(nombres)
+        pendientes = []
+        for tarea in tareas:
+            if procesados.get(tarea['file_name']):
+                self.queue.update_task_status(tarea['id'], 'OMITIDO', 'Ya procesado según archivos_procesados',
+                                              tarea['attempts'])
+                self.stats['omitidas'] += 1
+            else:
+                pendientes.append(tarea)
+        return pendientes
+
+    def _mark_processed(self, tipo, nombre):
+        _, data, _ = match_file_pattern(nombre)
+        data['file_name'] = nombre
+        timestamp = data.get('timestamp')
+        self._procesados.append((tipo, generar_identificador_procesamiento(tipo, data), nombre,
+                                 data.get('ruc'), int(timestamp) if timestamp else None))
+
+    async def _flush_processed(self):
+        """Registra en archivos_procesados, con un solo upsert, los archivos ETL terminados."""
+        if self._procesados:
+            registros, self._procesados = self._procesados, []
+            await asyncio.to_thread(postgres_client.registrar_procesamientos, registros)
+
+    def _register_failure(self, tarea, error):
+        intentos = tarea['attempts']
+        mensaje = f"{type(error).__name__}: {error}"
+        if intentos >= self.max_attempts:
+            if not self.queue.update_task_status(tarea['id'], 'FALLIDO', mensaje, intentos):
+                logger.warning(f"Tarea {tarea['id']} ({tarea['file_name']}) falló después de perder su lease: {mensaje}")
+                return
+            self.stats['fallidas'] += 1
+            logger.error(f"Tarea {tarea['id']} ({tarea['file_name']}) pasa a FALLIDO tras {intentos} intento(s): {mensaje}")
+            return
+        espera = min(self.backoff_base * 2 ** (intentos - 1), self.backoff_max)
+        espera += random.uniform(0, espera * 0.1)
+        if not self.queue.schedule_retry(tarea['id'], mensaje, espera, intentos):
+            logger.warning(f"Tarea {tarea['id']} ({tarea['file_name']}) falló después de perder su lease: {mensaje}")
+            return
+        self.stats['reintentos'] += 1
+        logger.warning(f"Tarea {tarea['id']} ({tarea['file_name']}) falló (intento {intentos}); reintento en {espera:.0f}s: {mensaje}")
+
+    # --- Manejadores por tipo ---
+
+    async def _process_no_etl(self, tarea):
+        key = s3_key(tarea['file_name'])
+        if (await asyncio.to_thread(s3_client.check_files_exist, [key]))[key]:
+            logger.info(f"{key} ya existe en S3; se omite la subida.")
+            return
+        url = await asyncio.to_thread(self._download_url, tarea['file_id'])
+        await asyncio.to_thread(s3_client.upload_from_url, url, key)
+
+    async def _process_etl(self, tarea):
+        nombre = tarea['file_name']
+        tipo, _, _ = match_file_pattern(nombre)
+        if tipo not in ETL_PIPELINES:
+            raise SinPipeline(f"No hay pipeline para archivos de tipo '{tipo}'")
+
+        url = await asyncio.to_thread(self._download_url, tarea['file_id'])
+        with await asyncio.to_thread(self._download, url, nombre) as fuente:
+            await self._run_etl(tipo, fuente)
+            await asyncio.to_thread(self._upload, fuente, s3_key(nombre))
+        self._mark_processed(tipo, nombre)
+
+    async def _process_archive(self, tarea):
+        nombre = tarea['file_name']
+        archivo, descarga = await asyncio.to_thread(self._open_archive, tarea['file_id'], nombre)
+        miembros = iter_comprimido(archivo, self._es_miembro_procesable)
+        procesados = 0
+        try:
+            # De a un miembro: se copia a una Fuente en un hilo y se procesa antes de leer el siguiente
+            while (fuente := await asyncio.to_thread(self._next_member, miembros)) is not None:
+                with fuente:
+                    await self._process_member(fuente)
+                procesados += 1
+        finally:
+            miembros.close()
+            archivo.close()
+            if descarga is not None:
+                descarga.cerrar()
+        if isinstance(archivo, RemoteZipFile):
+            remoto = archivo.remoto
+            logger.info(f"{nombre}: {procesados} miembro(s) procesado(s) con {remoto.peticiones} petición(es) por rango, "
+                        f"{remoto.bytes_transferidos / 1024:.0f} KB de {remoto.size / 1024:.0f} KB.")
+        if not procesados:
+            logger.info(f"El comprimido {nombre} no contiene archivos SUNAT reconocidos.")
+
+    async def _process_member(self, fuente):
+        nombre = nombre_fuente(fuente)
+        tipo, _, need_etl = match_file_pattern(nombre)
+        if need_etl:
+            await self._run_etl(tipo, fuente)
+            self._mark_processed(tipo, nombre)
+        await asyncio.to_thread(self._upload, fuente, s3_key(nombre))
+
+    async def _run_etl(self, tipo, ruta):
+        pendientes, huellas = await asyncio.to_thread(self.manifest.filtrar, tipo, [ruta], self.force)
+        if not pendientes:
+            self.stats['duplicadas'] += 1
+            return
+        loop = asyncio.get_running_loop()
+        executor = self._etl_executor
+        try:
+            resumen = await loop.run_in_executor(executor, _run_pipeline_etl, tipo, [ruta])
+        except BrokenProcessPool:
+            self._rebuild_executor(executor)
+            raise
+        metrics.registrar(resumen.metricas)
+        await asyncio.to_thread(self.manifest.registrar, tipo, huellas, resumen)
+        if not resumen:
+            raise RuntimeError(f"El pipeline {tipo} terminó con errores (archivos fallidos: {resumen.archivos_fallidos})")
+
+    def _rebuild_executor(self, roto):
+        """
+        Reemplaza el pool de procesos después de que murió uno de sus procesos; sin esto, todas las tareas ETL
+        restantes fallarían hasta FALLIDO. Las tareas que compartían el pool roto lo ven ya reemplazado.
+        """
+        if self._etl_executor is not roto:
+            return
+        logger.error("Un proceso del pool ETL terminó de forma inesperada; se reconstruye el pool.")
+        roto.shutdown(wait=False, cancel_futures=True)
+        self._etl_executor = ProcessPoolExecutor(max_workers=self.etl_processes)
+
+    # --- Trabajo bloqueante (se ejecuta en hilos) ---
+
+    @staticmethod
+    def _download_url(file_id):
+        url = onedrive_client.get_download_url(file_id)
+        if not url:
+            raise RuntimeError(f"No se pudo obtener la download URL de {file_id}")
+        return url
+
+    @staticmethod
+    def _download(url, nombre):
+        """Descarga a una Fuente: en memoria o, por encima de ARCHIVE_SPOOL_MAX_MB, en un temporal."""
+        with metrics.etapa('onedrive', 'download', nombre) as medicion, onedrive_client.open_download(url) as origen:
+            fuente = Fuente.desde_stream(nombre, origen)
+            medicion.bytes_leidos = fuente.tamano
+        return fuente
+
+    @staticmethod
+    def _upload(fuente, key):
+        with fuente.abrir() as contenido:
+            s3_client.upload_fileobj(contenido, key)
+
+    def _open_archive(self, file_id, nombre):
+        """
+        Abre el comprimido de la tarea. Retorna (archivo, descarga): los .zip se leen por HTTP Range sobre la
+        download URL (descarga None); los .rar, o si el servidor no admite Range, se descargan a una Fuente.
+        """
+        url = self._download_url(file_id)
+        if config.ARCHIVE_RANGE_READS and nombre.lower().endswith('.zip'):
+            try:
+                return RemoteZipFile(url), None
+            except RangoNoSoportado as e:
+                logger.info(f"{nombre}: el servidor no admite lecturas por rango ({e}); se descarga completo.")
+        descarga = self._download(url, nombre)
+        try:
+            return abrir_comprimido(descarga), descarga
+        except Exception:
+            descarga.cerrar()
+            raise
+
+    @staticmethod
+    def _es_miembro_procesable(nombre):
+        """Miembros que coinciden con un patrón SUNAT: NO ETL, o NEED ETL con pipeline."""
+        tipo, _, need_etl = match_file_pattern(nombre)
+        return tipo is not None and not (need_etl and tipo not in ETL_PIPELINES)
+
+    @staticmethod
+    def _next_member(miembros):
+        """
+        Copia a una Fuente el siguiente miembro seleccionado del comprimido; None al terminar. En las métricas
+        cuenta como descarga: con lectura por rangos es lo único que se trae del comprimido.
+        """
+        siguiente = next(miembros, None)
+        if siguiente is None:
+            return None
+        nombre, abrir = siguiente
+        with metrics.etapa('comprimido', 'download', nombre) as medicion, abrir() as origen:
+            fuente = Fuente.desde_stream(nombre, origen)
+            medicion.bytes_leidos = fuente.tamano
+        return fuente
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Benchmark del clasificador de nombres de archivo (match_file_pattern).
+
+Compara la implementación original (recorrido secuencial de PATRONES_NEED_ETL y PATRONES_NO_ETL)
+con el clasificador precompilado, sobre un listado sintético con ejemplos de todos los patrones
+y nombres que no coinciden con ninguno. Antes de medir verifica que ambas devuelvan lo mismo
+para cada nombre.
+
+Uso:
+    python benchmarks/bench_classifier.py [--items 100000] [--repeat 3]
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import config as config_module  # noqa: E402
+from app.config import PATRONES_NEED_ETL, PATRONES_NO_ETL, classify_many, match_file_pattern  # noqa: E402
+
+# Un nombre de ejemplo por patrón (en el orden de los diccionarios)
+EJEMPLOS = {
+    "declaraciones_pagos": "DetalleDeclaraciones_20614301172_20251010101010.xlsx",
+    "guia_remision_xml": "20611097400-09-EG07-859.xml",
+    "sire_compras": "20614301172-20251016-123456-propuesta.zip",
+    "sire_ventas": "LE20614301172202510001140EXP2.zip",
+    "factura_xml": "FACTURAF001-12320614301172.zip",
+    "boleta_xml": "BOLETAB001-45620614301172.xml",
+    "credito_xml": "NOTA_CREDITOFC01_7820614301172.zip",
+    "debito_xml": "NOTA_DEBITOFD01_9920614301172.xml",
+    "recibo_xml": "RHE206143011721234.xml",
+    "reporte_planilla_zip": "20614301172_PLA_20251010.zip",
+    "ficha_ruc": "reporteec_ficharuc_20614301172_20251010101010.pdf",
+    "ingreso_recaudacion": "ridetrac_20614301172_0230050123456_20251010101010_000000001.pdf",
+    "liberacion_fondos": "rilf_20614301172_0230050123456_20251010101010_000000001.pdf",
+    "multa": "rmgen_20614301172_023-002-0012345_20251010101010_000000001.pdf",
+    "notificacion": "constancia_20251010101010_00000000000000000001_0230050123456_000000001.pdf",
+    "valores": "rvalores_20614301172_ABC123456789_20251010101010_000000001.pdf",
+    "ejecucion": "recgen_20614301172_0230050123456_20251010101010_000000001.pdf",
+    "baja_oficio": "bod_123456_20614301172_0123.pdf",
+    "coactiva": "rcce_20614301172_ 0230050123456_20251010101010_000000001.pdf",
+    "fraccionamiento": "fragen_123456_20614301172_0230050123456_20251010101010_000000001.pdf",
+    "reporte_tributario": "reporteec_reportetrieeff_20614301172_20251010101010.pdf",
+    "rentas_retenciones": "reporteec_rentas_20614301172_20251010101010.pdf",
+    "factura_pdf": "PDF-DOC-F001-12320614301172.pdf",
+    "boleta_pdf": "PDF-BOLETAB001-45620614301172.pdf",
+    "credito_pdf": "PDF-NOTA_CREDITOFC01_7820614301172.pdf",
+    "debito_pdf": "PDF-NOTA_DEBITOFD01_9920614301172.pdf",
+    "recibo_honorarios_pdf": "RHE20614301172E001123.pdf",
+    "guia_remision_pdf": "20611097400-09-EG07-859.pdf",
+}
+
+# Nombres que no coinciden con ningún patrón (o casi): son la mayoría de un listado real
+NO_COINCIDEN = [
+    "Informe mensual.docx", "foto.jpg", "paquete.zip", "20614301172-20251016-propuesta.zip",
+    "LE2061430117220251000EXP1.zip", "reporteec_ficharuc_2061430117_20251010101010.pdf",
+    "PDF-DOC-F001.pdf", "RHE2061430117.pdf", "20611097400-09-EG07-859.txt", "notas.txt",
+]
+
+# Casos límite del índice por prefijo/extensión: mayúsculas mezcladas, salto de línea final
+# (que $ acepta) y caracteres no ASCII que re equipara a letras ASCII al ignorar mayúsculas
+BORDES = [
+    "ReporteEC_FichaRUC_20614301172_20251010101010.PDF", "20611097400-09-eg07-859.Xml",
+    "PDF-DOC-F001-12320614301172.pdf\n", "DetalleDeclaraciones_20614301172_20251010101010.xl\u017fx",
+    "r\u0130lf_20614301172_0230050123456_20251010101010_000000001.pdf", "", ".pdf", "le",
+]
+
+
+def legacy_match_file_pattern(file_name):
+    """Implementación original: prueba cada patrón en orden y construye el dict en cada acierto."""
+    for tipo, (pattern, fields) in PATRONES_NEED_ETL.items():
+        match = pattern.match(file_name)
+        if match:
+            return tipo, dict(zip(fields, match.groups())), True
+    for tipo, (pattern, fields) in PATRONES_NO_ETL.items():
+        match = pattern.match(file_name)
+        if match:
+            return tipo, dict(zip(fields, match.groups())), False
+    return None, None, None
+
+
+def _variar(nombre, rnd):
+    """Cambia los dígitos del ejemplo para que cada nombre del listado sea distinto."""
+    return ''.join(str(rnd.randint(0, 9)) if c.isdigit() else c for c in nombre)
+
+
+def generar_listado(n, seed=0):
+    rnd = random.Random(seed)
+    base = list(EJEMPLOS.values())
+    nombres = []
+    for _ in range(n):
+        r = rnd.random()
+        if r < 0.6:
+            nombre = _variar(rnd.choice(base), rnd)
+        elif r < 0.9:
+            nombre = _variar(rnd.choice(NO_COINCIDEN), rnd)
+        else:
+            nombre = rnd.choice(base + NO_COINCIDEN)
+        nombres.append(nombre.lower() if rnd.random() < 0.05 else nombre)
+    return nombres
+
+
+def verificar(nombres):
+    faltantes = set(PATRONES_NEED_ETL) | set(PATRONES_NO_ETL)
+    faltantes -= set(EJEMPLOS)
+    assert not faltantes, f"Patrones sin ejemplo en el benchmark: {sorted(faltantes)}"
+    for tipo, nombre in EJEMPLOS.items():
+        assert legacy_match_file_pattern(nombre)[0] == tipo, f"El ejemplo de {tipo} no coincide con su patrón"
+
+    diferencias = [n for n in set(nombres) | set(EJEMPLOS.values()) | set(NO_COINCIDEN) | set(BORDES)
+                   if legacy_match_file_pattern(n) != match_file_pattern(n)]
+    assert not diferencias, f"Resultados distintos para {len(diferencias)} nombre(s), p. ej. {diferencias[:5]}"
+
+
+def medir(func, nombres, repeat):
+    mejor = float('inf')
+    for _ in range(repeat):
+        config_module._match_cached.cache_clear()
+        inicio = time.perf_counter()
+        func(nombres)
+        mejor = min(mejor, time.perf_counter() - inicio)
+    return mejor
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--items', type=int, default=100_000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    nombres = generar_listado(args.items)
+    verificar(nombres)
+    print(f"Equivalencia verificada: {len(EJEMPLOS)} patrones, {len(set(nombres))} nombres distintos.")
+
+    # Un listado se clasifica dos o tres veces (fase 1, extract_ruc, verificación): se mide una pasada
+    # en frío y tres pasadas seguidas, que es donde la memoización se nota
+    legacy = medir(lambda ns: [legacy_match_file_pattern(n) for n in ns], nombres, args.repeat)
+    nuevo = medir(classify_many, nombres, args.repeat)
+    legacy_x3 = medir(lambda ns: [legacy_match_file_pattern(n) for _ in range(3) for n in ns], nombres, args.repeat)
+    nuevo_x3 = medir(lambda ns: [classify_many(ns) for _ in range(3)], nombres, args.repeat)
+
+    print(f"{'':<28}{'original':>12}{'compilado':>12}{'speedup':>10}")
+    print(f"{'1 pasada (' + str(args.items) + ')':<28}{legacy:>11.3f}s{nuevo:>11.3f}s{legacy / nuevo:>9.1f}x")
+    print(f"{'3 pasadas':<28}{legacy_x3:>11.3f}s{nuevo_x3:>11.3f}s{legacy_x3 / nuevo_x3:>9.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Benchmark del índice de claves de row_by_row_check (RowKeyIndex) contra un set de claves en texto (como
+ExistingKeyCache), sin base de datos: la consulta de claves existentes se reemplaza por un texto sintético
+con el mismo formato que devuelve COPY (una clave por línea), que ambos métodos parten en claves.
+
+Para --existing claves ya cargadas de --rucs RUC y un lote de --rows ítems de guía (--overlap de ellos ya
+existentes, más un porcentaje repetido dentro del lote) se mide:
+- construcción del índice a partir de las claves recibidas y la memoria que retiene (tracemalloc, en una
+  construcción aparte);
+- filtrado del lote (filas nuevas), verificando que ambos métodos descarten exactamente las mismas filas.
+
+Uso:
+    python benchmarks/bench_key_index.py [--existing 1000000] [--rows 200000] [--overlap 0.5] [--rucs 20]
+"""
+
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.etl_pipelines.sire_common import RowKeyIndex, construir_claves  # noqa: E402
+
+MB = 1024 * 1024
+CLAVE = ['ruc', 'numero_guia', 'item']
+
+
+class IndiceSintetico(RowKeyIndex):
+    """RowKeyIndex cuyas claves existentes vienen de una lista en memoria en vez de la base."""
+
+    def __init__(self, respuesta_copy):
+        super().__init__(None, 'acc.guias_remision', ['numero_guia', 'item'])
+        self.respuesta_copy = respuesta_copy
+
+    def _fetch(self, ambitos):
+        self.consultas += 1
+        return np.array(self.respuesta_copy.splitlines(), dtype=object)
+
+
+class SetDeClaves:
+    """Referencia: set de str por clave, filtrado con Series.isin (el enfoque de ExistingKeyCache)."""
+
+    def __init__(self, respuesta_copy):
+        self.claves = set(respuesta_copy.splitlines())
+
+    def filter_new(self, df):
+        claves = construir_claves(df, CLAVE)
+        ya_existen = claves.isin(self.claves)
+        repetidas = claves.duplicated() & ~ya_existen
+        return df[~(ya_existen | repetidas)]
+
+
+def generar(existentes, filas, solapamiento, rucs, seed=0):
+    """Claves existentes (texto, como lo devuelve COPY) y un lote de ítems con parte de ellas."""
+    rnd = np.random.default_rng(seed)
+    lista_rucs = 20100000000 + np.arange(rucs)
+    guias_por_ruc = existentes // (rucs * 3) + 1
+    ruc = np.repeat(lista_rucs, guias_por_ruc * 3)[:existentes]
+    guia = np.tile(np.repeat(np.arange(1, guias_por_ruc + 1), 3), rucs)[:existentes]
+    item = np.tile([1, 2, 3], rucs * guias_por_ruc)[:existentes]
+    previas = pd.DataFrame({'ruc': ruc, 'numero_guia': [f"T001-{g}" for g in guia], 'item': item})
+    respuesta_copy = '\n'.join(construir_claves(previas.astype({'ruc': 'Int64', 'item': 'Int64'}), CLAVE))
+
+    n_viejas = int(filas * solapamiento)
+    viejas = previas.sample(n_viejas, random_state=seed)
+    nuevas = pd.DataFrame({
+        'ruc': rnd.choice(lista_rucs, filas - n_viejas),
+        'numero_guia': [f"T002-{g}" for g in rnd.integers(1, 10 * filas, filas - n_viejas)],
+        'item': rnd.integers(1, 10, filas - n_viejas),
+    })
+    lote = pd.concat([viejas, nuevas], ignore_index=True)
+    lote = lote.astype({'ruc': 'Int64', 'item': 'Int64'}).sample(frac=1, random_state=seed).reset_index(drop=True)
+    return respuesta_copy, lote
+
+
+def _construir(construir, lote):
+    indice = construir()
+    if isinstance(indice, RowKeyIndex):
+        indice.load(lote['ruc'].unique())
+    return indice
+
+
+def medir(nombre, construir, lote):
+    # La memoria se mide en una construcción aparte: tracemalloc distorsiona los tiempos
+    tracemalloc.start()
+    retenido = _construir(construir, lote)
+    memoria = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del retenido
+
+    inicio = time.perf_counter()
+    indice = _construir(construir, lote)
+    construccion = time.perf_counter() - inicio
+
+    inicio = time.perf_counter()
+    resultado = indice.filter_new(lote)
+    filtrado = time.perf_counter() - inicio
+    print(f"  {nombre:<24}{construccion:>10.2f}s{memoria / MB:>11.1f}MB{filtrado:>11.3f}s{len(resultado):>12,}")
+    return resultado
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--existing', type=int, default=1_000_000)
+    parser.add_argument('--rows', type=int, default=200_000)
+    parser.add_argument('--overlap', type=float, default=0.5, help='Fracción del lote que ya existe en destino')
+    parser.add_argument('--rucs', type=int, default=20)
+    args = parser.parse_args()
+
+    respuesta_copy, lote = generar(args.existing, args.rows, args.overlap, args.rucs)
+    print(f"{args.existing:,} claves existentes | lote de {len(lote):,} filas de {args.rucs} RUC")
+    print(f"  {'método':<24}{'construcción':>11}{'memoria':>13}{'filtrado':>12}{'filas nuevas':>13}")
+    por_set = medir('set de str (isin)', lambda: SetDeClaves(respuesta_copy), lote)
+    por_indice = medir('RowKeyIndex (hash)', lambda: IndiceSintetico(respuesta_copy), lote)
+    print(f"  Mismas filas nuevas: {'sí' if por_set.index.equals(por_indice.index) else 'NO'}")
+
+
+if __name__ == '__main__':
+    main()
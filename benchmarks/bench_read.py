@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Benchmark del motor de lectura SIRE: pandas (todo como texto) contra pyarrow (LectorArrow, multihilo
+y con columnas tipadas), midiendo extracción + transformación fusionada hasta el DataFrame final.
+
+Cada motor corre en un proceso nuevo para medir el pico de memoria residente (ru_maxrss), que incluye
+lo que reserva Arrow fuera de tracemalloc. También se informa el tamaño del DataFrame extraído
+(memory_usage deep) y se verifica que ambos motores produzcan los mismos valores finales.
+
+Uso:
+    python benchmarks/bench_read.py [--tipo compras|ventas] [--rows 1000000] [--file propuesta.txt]
+"""
+
+import argparse
+import logging
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.synthetic import generar_propuesta  # noqa: E402
+
+MB = 1024 * 1024
+
+
+def _pipeline(tipo):
+    from app.config import COLUMN_MAPPING_COMPRAS, COLUMN_MAPPING_VENTAS
+    from app.etl_pipelines import sire_compras_etl, sire_ventas_etl
+    if tipo == 'compras':
+        return sire_compras_etl, COLUMN_MAPPING_COMPRAS
+    return sire_ventas_etl, COLUMN_MAPPING_VENTAS
+
+
+def _correr(motor, tipo, ruta, cola):
+    """Se ejecuta en un proceso nuevo: extrae y transforma, y reporta tiempos, tamaños y el resultado."""
+    import pandas as pd
+    from app.etl_pipelines.sire_common import LectorArrow
+    logging.disable(logging.INFO)
+    modulo, mapping = _pipeline(tipo)
+    lector = LectorArrow(mapping, modulo.Transformer.COLUMNAS_VALOR) if motor == 'pyarrow' else None
+    base = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    inicio = time.perf_counter()
+    df = pd.concat(modulo.Extractor.extract_files([ruta], None, lector), ignore_index=True)
+    lectura = time.perf_counter() - inicio
+    tamano = df.memory_usage(deep=True).sum()  # fuera del cronómetro: recorre cada cadena
+    inicio = time.perf_counter()
+    df_final = modulo.Transformer.transform_fused(df, mapping)
+    total = lectura + time.perf_counter() - inicio
+
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    cola.put({'lectura': lectura, 'total': total, 'extraido': tamano, 'pico': (pico - base) * 1024,
+              'final': df_final})
+
+
+def medir(motor, tipo, ruta):
+    contexto = multiprocessing.get_context('spawn')
+    cola = contexto.Queue()
+    proceso = contexto.Process(target=_correr, args=(motor, tipo, ruta, cola))
+    proceso.start()
+    resultado = cola.get()
+    proceso.join()
+    return resultado
+
+
+def verificar(a, b):
+    import pandas as pd
+    assert list(a.columns) == list(b.columns), "Columnas distintas"
+    for col in a.columns:
+        izquierda = a[col].astype(object).where(a[col].notna(), None)
+        derecha = b[col].astype(object).where(b[col].notna(), None)
+        pd.testing.assert_series_equal(izquierda, derecha, check_dtype=False, obj=col)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tipo', choices=('compras', 'ventas'), default='compras')
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--file', help='Propuesta existente (.txt o .zip); si se omite se genera una sintética.')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        ruta = args.file or generar_propuesta(args.tipo, os.path.join(tmp, f'propuesta_{args.tipo}.txt'), args.rows)
+        resultados = {motor: medir(motor, args.tipo, ruta) for motor in ('pandas', 'pyarrow')}
+
+    verificar(resultados['pandas']['final'], resultados['pyarrow']['final'])
+    print(f"Propuesta de {args.tipo}: {len(resultados['pandas']['final'])} filas. Resultados equivalentes.")
+    print(f"{'':<10}{'lectura':>10}{'lectura+transf.':>17}{'DataFrame leído':>17}{'pico RSS':>11}")
+    for motor, r in resultados.items():
+        print(f"{motor:<10}{r['lectura']:>9.2f}s{r['total']:>16.2f}s{r['extraido'] / MB:>14.0f} MB{r['pico'] / MB:>8.0f} MB")
+    p, a = resultados['pandas'], resultados['pyarrow']
+    print(f"{'mejora':<10}{p['lectura'] / a['lectura']:>9.1f}x{p['total'] / a['total']:>15.1f}x"
+          f"{p['extraido'] / a['extraido']:>15.1f}x{p['pico'] / a['pico']:>9.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+Benchmark de la inspección de comprimidos por HTTP Range (RemoteZipFile) contra la descarga completa,
+con un servidor HTTP local que atiende peticiones Range sobre un .zip sintético: --docs comprobantes UBL
+(miembros que se procesan) mezclados con --attachments anexos de --attachment-mb MB que no coinciden con
+ningún patrón SUNAT (p. ej. PDFs), que es lo que hoy se descarga solo para descartarlo.
+
+Para cada método informa peticiones, bytes transferidos y tiempo, y verifica que los miembros extraídos sean
+idénticos. Al final comprueba que un servidor sin soporte de Range provoque el fallback (RangoNoSoportado).
+
+Uso:
+    python benchmarks/bench_remote_zip.py [--docs 200] [--attachments 40] [--attachment-mb 2]
+"""
+
+import argparse
+import filecmp
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.synthetic import comprobante_ubl  # noqa: E402
+from app.archive_stream import abrir_comprimido, iter_comprimido  # noqa: E402
+from app.sources.remote_zip import RangoNoSoportado, RemoteZipFile  # noqa: E402
+from app.workers import WorkerPool  # noqa: E402
+
+MB = 1024 * 1024
+RANGO = re.compile(r'bytes=(\d*)-(\d*)$')
+# Nombre con que SUNAT entrega cada comprobante, según su tipo (así lo reconoce match_file_pattern)
+PREFIJO_SUNAT = {'01': ('FACTURA', '-'), '03': ('BOLETA', '-'), '07': ('NOTA_CREDITO', '_')}
+
+
+class ServidorArchivo(ThreadingHTTPServer):
+    """Sirve un único archivo en memoria; con `rangos=False` ignora Range como un servidor sin soporte."""
+
+    daemon_threads = True
+
+    def __init__(self, contenido, rangos=True):
+        super().__init__(('127.0.0.1', 0), ManejadorRango)
+        self.contenido = contenido
+        self.rangos = rangos
+        self.peticiones = 0
+        self.bytes_enviados = 0
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/archivo.zip"
+
+
+class ManejadorRango(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Cabeceras y cuerpo van en escrituras separadas: sin esto cada petición espera el ACK retardado (~40 ms)
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        contenido, total = self.server.contenido, len(self.server.contenido)
+        coincidencia = RANGO.match(self.headers.get('Range', ''))
+        if self.server.rangos and coincidencia:
+            inicio, fin = coincidencia.groups()
+            if not inicio:
+                inicio, fin = max(total - int(fin), 0), total - 1
+            else:
+                inicio, fin = int(inicio), min(int(fin), total - 1) if fin else total - 1
+            self.send_response(206)
+            self.send_header('Content-Range', f"bytes {inicio}-{fin}/{total}")
+        else:
+            inicio, fin = 0, total - 1
+            self.send_response(200)
+        cuerpo = memoryview(contenido)[inicio:fin + 1]
+        self.send_header('Content-Length', str(len(cuerpo)))
+        self.send_header('Accept-Ranges', 'bytes' if self.server.rangos else 'none')
+        self.end_headers()
+        try:
+            self.wfile.write(cuerpo)
+        except (BrokenPipeError, ConnectionResetError):
+            # El cliente cerró la conexión sin leer el cuerpo (fallback sin Range)
+            pass
+        self.server.peticiones += 1
+        self.server.bytes_enviados += len(cuerpo)
+
+    def log_message(self, *args):
+        pass
+
+
+def generar_zip(ruta, documentos, anexos, mb_anexo, seed=0):
+    """Comprobantes UBL comprimidos intercalados con anexos binarios sin comprimir que no se procesan."""
+    rnd = random.Random(seed)
+    with zipfile.ZipFile(ruta, 'w', zipfile.ZIP_DEFLATED) as zip_ref:
+        for i in range(max(documentos, anexos)):
+            if i < documentos:
+                nombre, contenido = comprobante_ubl(rnd, i)
+                ruc, tipo, serie, correlativo = nombre[:-4].split('-')
+                prefijo, separador = PREFIJO_SUNAT[tipo]
+                zip_ref.writestr(f"{prefijo}{serie}{separador}{correlativo}{ruc}.xml", contenido)
+            if i < anexos:
+                zip_ref.writestr(f"anexos/sustento_{i:04d}.pdf", os.urandom(int(mb_anexo * MB)), zipfile.ZIP_STORED)
+    return ruta
+
+
+def servir(contenido, rangos=True):
+    servidor = ServidorArchivo(contenido, rangos)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor
+
+
+def extraer(archivo, destino):
+    """Escribe en `destino` los miembros que procesaría la fase 2; retorna sus rutas."""
+    os.makedirs(destino, exist_ok=True)
+    extraidos = []
+    for nombre, abrir in iter_comprimido(archivo, WorkerPool._es_miembro_procesable):
+        extraidos.append(os.path.join(destino, os.path.basename(nombre)))
+        with abrir() as origen, open(extraidos[-1], 'wb') as salida:
+            salida.write(origen.read())
+    return extraidos
+
+
+def completo(url, ruta_zip, destino):
+    """Flujo anterior: descarga completa a disco y extracción local de los miembros reconocidos."""
+    import requests
+    with requests.get(url, stream=True) as r, open(ruta_zip, 'wb') as salida:
+        for bloque in r.iter_content(MB):
+            salida.write(bloque)
+    with abrir_comprimido(ruta_zip) as archivo:
+        return extraer(archivo, destino)
+
+
+def por_rangos(url, destino):
+    with RemoteZipFile(url) as archivo:
+        return extraer(archivo, destino)
+
+
+def medir(nombre, contenido, funcion):
+    servidor = servir(contenido)
+    try:
+        inicio = time.perf_counter()
+        miembros = funcion(servidor.url)
+        segundos = time.perf_counter() - inicio
+    finally:
+        servidor.shutdown()
+    print(f"  {nombre:<22}{servidor.peticiones:>10,}{servidor.bytes_enviados / MB:>12.2f}MB{segundos:>10.2f}s"
+          f"{len(miembros):>10,}")
+    return miembros
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--docs', type=int, default=200, help='Comprobantes UBL (miembros que se procesan)')
+    parser.add_argument('--attachments', type=int, default=40, help='Anexos que no coinciden con ningún patrón')
+    parser.add_argument('--attachment-mb', type=float, default=2)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        ruta = generar_zip(os.path.join(tmp, 'origen.zip'), args.docs, args.attachments, args.attachment_mb)
+        with open(ruta, 'rb') as f:
+            contenido = f.read()
+        print(f"Comprimido de {len(contenido) / MB:.1f} MB: {args.docs} comprobante(s) UBL, "
+              f"{args.attachments} anexo(s) de {args.attachment_mb} MB")
+        print(f"  {'método':<22}{'peticiones':>10}{'transferido':>14}{'tiempo':>11}{'miembros':>10}")
+
+        dir_completo, dir_rangos = os.path.join(tmp, 'completo'), os.path.join(tmp, 'rangos')
+        por_descarga = medir('descarga completa', contenido,
+                             lambda url: completo(url, os.path.join(tmp, 'descargado.zip'), dir_completo))
+        por_rango = medir('HTTP Range', contenido, lambda url: por_rangos(url, dir_rangos))
+
+        nombres = [os.path.basename(ruta_miembro) for ruta_miembro in por_descarga]
+        _, distintos, errores = filecmp.cmpfiles(dir_completo, dir_rangos, nombres, shallow=False)
+        iguales = nombres == [os.path.basename(r) for r in por_rango] and not distintos and not errores
+        print(f"  Miembros idénticos: {'sí' if iguales else 'NO'}")
+
+        servidor = servir(contenido, rangos=False)
+        try:
+            por_rangos(servidor.url, os.path.join(tmp, 'sin_rango'))
+            print("  Servidor sin Range: NO se detectó")
+        except RangoNoSoportado as e:
+            print(f"  Servidor sin Range: fallback a descarga completa ({e})")
+        finally:
+            servidor.shutdown()
+
+
+if __name__ == '__main__':
+    main()
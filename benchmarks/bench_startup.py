@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Benchmark del arranque de la CLI (main.py) por subcomando: compara una revisión base del repositorio
+(por defecto HEAD) con el árbol de trabajo actual.
+
+Cada escenario se ejecuta en un proceso nuevo con `python -X importtime`. Se informa el tiempo total de
+importación (suma de los módulos de primer nivel), el tiempo de pared del proceso (mejor de --repeat) y
+qué dependencias pesadas (pandas, boto3, msal, ...) llegó a cargar cada versión.
+
+La revisión base se extrae con `git archive` en un directorio temporal. Los subcomandos `--path` usan una
+propuesta sintética pequeña y un DB_URL inalcanzable: la carga falla al conectar, pero el arranque
+(lo que se mide) es el mismo.
+
+Uso:
+    python benchmarks/bench_startup.py [--baseline REF] [--repeat 5] [--rows 200]
+"""
+
+import argparse
+import os
+import re
+import subprocess
+import sys
+import tarfile
+import tempfile
+import time
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+from benchmarks.synthetic import generar_propuesta  # noqa: E402
+
+PESADOS = ('pandas', 'numpy', 'pyarrow', 'sqlalchemy', 'psycopg2', 'boto3', 'botocore', 'msal',
+           'requests', 'httpx', 'rarfile')
+
+# Conexión rechazada al instante: el pipeline falla en la carga sin esperar timeouts de red
+DB_INALCANZABLE = 'postgresql://etl@127.0.0.1:1/etl'
+
+LINEA_IMPORTTIME = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)')
+
+
+def escenarios(compras, ventas):
+    return [
+        ('--help', ['--help']),
+        ('sire-compras --help', ['sire-compras', '--help']),
+        ('sire-ventas --help', ['sire-ventas', '--help']),
+        ('sire-compras --path', ['sire-compras', '--path', compras]),
+        ('sire-ventas --path', ['sire-ventas', '--path', ventas]),
+    ]
+
+
+def extraer_base(ref, destino):
+    """Vuelca el árbol de `ref` en `destino` con git archive."""
+    archivo = os.path.join(destino, 'base.tar')
+    with open(archivo, 'wb') as f:
+        subprocess.run(['git', 'archive', ref], cwd=RAIZ, stdout=f, check=True)
+    with tarfile.open(archivo) as tar:
+        tar.extractall(os.path.join(destino, 'base'))
+    return os.path.join(destino, 'base')
+
+
+def analizar_importtime(stderr):
+    """Retorna (µs de importación de los módulos de primer nivel, conjunto de módulos importados)."""
+    total, modulos = 0, set()
+    for linea in stderr.splitlines():
+        m = LINEA_IMPORTTIME.match(linea)
+        if not m:
+            continue
+        modulos.add(m.group(4))
+        if len(m.group(3)) == 1:  # primer nivel: un solo espacio tras el separador
+            total += int(m.group(2))
+    return total, modulos
+
+
+def correr(arbol, argumentos, cwd, env):
+    inicio = time.perf_counter()
+    proceso = subprocess.run([sys.executable, '-X', 'importtime', os.path.join(arbol, 'main.py'), *argumentos],
+                             cwd=cwd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    pared = time.perf_counter() - inicio
+    importacion, modulos = analizar_importtime(proceso.stderr)
+    return pared, importacion, modulos
+
+
+def medir(arbol, argumentos, cwd, env, repeat):
+    mejor_pared, mejor_importacion, modulos = float('inf'), float('inf'), set()
+    for _ in range(repeat):
+        pared, importacion, modulos = correr(arbol, argumentos, cwd, env)
+        mejor_pared = min(mejor_pared, pared)
+        mejor_importacion = min(mejor_importacion, importacion)
+    return mejor_pared, mejor_importacion / 1e6, sorted(p for p in PESADOS if p in modulos)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--baseline', default='HEAD', help='Revisión git contra la que comparar (por defecto HEAD)')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--rows', type=int, default=200, help='Filas de las propuestas sintéticas de --path')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        base = extraer_base(args.baseline, tmp)
+        compras = generar_propuesta('compras', os.path.join(tmp, '20614301172-20251016-123456-propuesta.txt'), args.rows)
+        ventas = generar_propuesta('ventas', os.path.join(tmp, 'LE20614301172202510001140EXP2.txt'), args.rows)
+        # Cada proceso escribe su log en el directorio temporal, no en el del proyecto
+        env = dict(os.environ, DB_URL=DB_INALCANZABLE, PYTHONDONTWRITEBYTECODE='1')
+        trabajo = os.path.join(tmp, 'cwd')
+        os.makedirs(trabajo)
+
+        print(f"Base: {args.baseline} | mejor de {args.repeat} ejecuciones")
+        print(f"{'escenario':<22}{'import base':>12}{'import nuevo':>13}{'pared base':>12}{'pared nuevo':>12}{'speedup':>9}")
+        evitados = {}
+        for nombre, argumentos in escenarios(compras, ventas):
+            # Una ejecución previa de cada árbol compila los .pyc y calienta la caché del sistema de archivos
+            correr(base, argumentos, trabajo, env)
+            correr(RAIZ, argumentos, trabajo, env)
+            pared_b, imp_b, pesados_b = medir(base, argumentos, trabajo, env, args.repeat)
+            pared_n, imp_n, pesados_n = medir(RAIZ, argumentos, trabajo, env, args.repeat)
+            print(f"{nombre:<22}{imp_b:>11.3f}s{imp_n:>12.3f}s{pared_b:>11.3f}s{pared_n:>11.3f}s{pared_b / pared_n:>8.1f}x")
+            evitados[nombre] = (pesados_b, pesados_n)
+
+        print("\nDependencias pesadas importadas (base -> nuevo):")
+        for nombre, (pesados_b, pesados_n) in evitados.items():
+            print(f"  {nombre:<22}{', '.join(pesados_b) or '-'}  ->  {', '.join(pesados_n) or '-'}")
+
+
+if __name__ == '__main__':
+    main()
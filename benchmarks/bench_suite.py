@@ -0,0 +1,442 @@
+#!/usr/bin/env python3
+"""
+Suite de benchmarks reproducible de los pipelines SIRE y del flujo OneDrive, sobre datos sintéticos
+(benchmarks/synthetic.py, con seed fija). Cada grupo se puede omitir:
+
+- clasificador: match_file_pattern sobre un listado de OneDrive de --listing nombres (caché vacía).
+- sire: por cada --tipo y cada --rows (10k a 5M) genera, o reutiliza de --data-dir, una propuesta comprimida
+  con --duplicates filas repetidas y --malformed-car CAR SUNAT mal formados. Mide por separado Extractor
+  (pandas y pyarrow), Transformer (clásico y fusionado) y Loader (COPY + ON CONFLICT, con la tabla vacía y
+  con todas las filas ya cargadas), y de punta a punta ETLSIRE.run con el desglose por etapa de app.metrics.
+  Loader y punta a punta necesitan --db-url (o BENCH_DB_URL), un PostgreSQL local de pruebas: se crea el
+  esquema bench_sire y se elimina al terminar.
+- onedrive: fase 1 (escaneo y clasificación) contra un Graph falso local que lista --no-etl-files archivos
+  NO ETL en carpetas, y fase 2 (WorkerPool) que los descarga de ese servidor y los sube a un S3 de moto.
+  Requiere moto (pip install moto); la cola y el manifiesto de S3 van a temporales.
+
+Los resultados se guardan en --output (por defecto benchmarks/results/<fecha>-<commit>.json) junto con el
+commit, las versiones de Python, pandas y pyarrow y los parámetros. Con --compare se muestran contra un
+resultado anterior (mismo caso, mismo tamaño), p. ej. el de la rama principal antes de un cambio.
+
+Uso:
+    python benchmarks/bench_suite.py [--rows 10k 100k] [--tipo compras ventas] [--duplicates 0.02]
+        [--malformed-car 0.01] [--listing 100k] [--no-etl-files 300] [--db-url URL] [--repeat 3]
+        [--skip classifier|sire|onedrive] [--compare benchmarks/results/ANTERIOR.json]
+"""
+
+import argparse
+import asyncio
+import importlib.util
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+# main.py configura el logging al importarse: la suite no escribe en el log ni en las métricas de producción
+os.environ.setdefault('LOG_FILE', os.devnull)
+os.environ.setdefault('METRICS_JSONL_FILE', '')
+
+import pandas as pd  # noqa: E402
+
+from benchmarks.synthetic import generar_listado, generar_propuesta_zip  # noqa: E402
+from app import config as config_module  # noqa: E402
+from app.config import COLUMN_MAPPING_COMPRAS, COLUMN_MAPPING_VENTAS, match_file_pattern  # noqa: E402
+from app.metrics import metrics  # noqa: E402
+
+MB = 1024 * 1024
+ESQUEMA = 'bench_sire'
+
+# tipo -> (módulo del pipeline, mapeo de columnas, tabla, columnas clave); como en run_sire_*_etl
+PIPELINES_SIRE = {
+    'compras': ('app.etl_pipelines.sire_compras_etl', COLUMN_MAPPING_COMPRAS, '_8',
+                ['numero_documento', 'tipo_comprobante', 'numero_serie', 'numero_correlativo']),
+    'ventas': ('app.etl_pipelines.sire_ventas_etl', COLUMN_MAPPING_VENTAS, '_5',
+               ['ruc', 'tipo_comprobante', 'numero_serie', 'numero_correlativo']),
+}
+
+# Tablas destino con las columnas que producen los pipelines; cui replica la clave de conflicto
+DDL_SIRE = {
+    '_8': """
+        id serial PRIMARY KEY, ruc bigint, periodo_tributario int, tipo_comprobante int, fecha_emision date,
+        fecha_vencimiento date, numero_serie text, numero_correlativo text, tipo_documento text,
+        numero_documento text, destino int, valor numeric(14,2), igv numeric(14,2), icbp numeric(14,2),
+        isc numeric(14,2), otros_cargos numeric(14,2), tipo_moneda text, tasa_detraccion int,
+        tipo_comprobante_modificado int, numero_serie_modificado text, numero_correlativo_modificado text,
+        observaciones text, tipo_operacion int,
+        cui text GENERATED ALWAYS AS (numero_documento || lpad(tipo_comprobante::text, 2, '0')
+                                      || numero_serie || numero_correlativo) STORED UNIQUE
+    """,
+    '_5': """
+        id serial PRIMARY KEY, ruc bigint, periodo_tributario int, tipo_comprobante int, fecha_emision date,
+        fecha_vencimiento date, numero_serie text, numero_correlativo text, numero_final int, tipo_documento text,
+        numero_documento text, destino int, valor numeric(14,2), igv numeric(14,2), icbp numeric(14,2),
+        isc numeric(14,2), otros_cargos numeric(14,2), tipo_moneda text, tipo_comprobante_modificado int,
+        numero_serie_modificado text, numero_correlativo_modificado text, observaciones text, tipo_operacion int,
+        cui text GENERATED ALWAYS AS (ruc::text || lpad(tipo_comprobante::text, 2, '0')
+                                      || numero_serie || numero_correlativo) STORED UNIQUE
+    """,
+}
+
+
+def cantidad(texto):
+    """'10k' -> 10000, '5M' -> 5000000."""
+    texto = texto.strip().lower().replace('_', '')
+    factor = {'k': 1_000, 'm': 1_000_000}.get(texto[-1:], 1)
+    return int(float(texto.rstrip('km')) * factor)
+
+
+class Resultados:
+    """Casos medidos en esta ejecución; cada uno se identifica por grupo/nombre para comparar ejecuciones."""
+
+    def __init__(self, argumentos):
+        self.meta = _entorno(argumentos)
+        self.casos = []
+
+    def agregar(self, grupo, nombre, segundos, filas=0, bytes_=0, **extra):
+        caso = {'caso': f"{grupo}/{nombre}", 'segundos': round(segundos, 4), 'filas': filas,
+                'filas_por_segundo': round(filas / segundos, 1) if segundos > 0 and filas else 0.0,
+                'mb_por_segundo': round(bytes_ / MB / segundos, 2) if segundos > 0 and bytes_ else 0.0,
+                'bytes': bytes_, **extra}
+        self.casos.append(caso)
+        throughput = f"{caso['filas_por_segundo']:>14,.0f}" if filas else f"{'':>14}"
+        print(f"  {caso['caso']:<46}{segundos:>10.3f}s{filas:>12,}{throughput}"
+              + (f"{caso['mb_por_segundo']:>9.1f} MB/s" if bytes_ else ''))
+        return caso
+
+    def guardar(self, ruta):
+        os.makedirs(os.path.dirname(os.path.abspath(ruta)), exist_ok=True)
+        with open(ruta, 'w', encoding='utf-8') as f:
+            json.dump({'meta': self.meta, 'casos': self.casos}, f, ensure_ascii=False, indent=2)
+        return ruta
+
+
+def _entorno(argumentos):
+    def version(modulo):
+        try:
+            return __import__(modulo).__version__
+        except ImportError:
+            return None
+
+    def git(*args):
+        try:
+            return subprocess.run(['git', *args], cwd=RAIZ, capture_output=True, text=True, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return ''
+
+    commit = git('rev-parse', '--short', 'HEAD') or 'sin-git'
+    if git('status', '--porcelain', '--untracked-files=no'):
+        commit += '-dirty'
+    return {
+        'fecha': time.strftime('%Y-%m-%dT%H:%M:%S'), 'commit': commit, 'python': platform.python_version(),
+        'pandas': version('pandas'), 'pyarrow': version('pyarrow'), 'numpy': version('numpy'),
+        'plataforma': platform.platform(), 'cpus': os.cpu_count(), 'argumentos': argumentos,
+    }
+
+
+def medir(funcion, repeticiones=1, preparar=None):
+    """Mejor tiempo de `repeticiones` corridas; `preparar` (sin medir) arma la entrada de cada una. Retorna (s, resultado)."""
+    mejor, resultado = math.inf, None
+    for _ in range(repeticiones):
+        entrada = preparar() if preparar else None
+        inicio = time.perf_counter()
+        resultado = funcion(entrada) if preparar else funcion()
+        mejor = min(mejor, time.perf_counter() - inicio)
+    return mejor, resultado
+
+
+# --- Clasificador ---
+
+def bench_clasificador(args, resultados):
+    nombres = [item['name'] for item in generar_listado(args.listing, seed=args.seed)]
+
+    def clasificar():
+        config_module._match_cached.cache_clear()
+        return sum(match_file_pattern(nombre)[0] is not None for nombre in nombres)
+
+    segundos, reconocidos = medir(clasificar, args.repeat)
+    resultados.agregar(f"classifier-{len(nombres)}", 'match_file_pattern', segundos, len(nombres), reconocidos=reconocidos)
+
+
+# --- Pipelines SIRE ---
+
+def propuesta(args, tipo, filas):
+    """Propuesta comprimida para (tipo, filas, fracciones, seed); se genera una sola vez por --data-dir."""
+    directorio = os.path.join(args.data_dir, f"{tipo}-{filas}-d{args.duplicates}-c{args.malformed_car}-s{args.seed}")
+    existentes = [n for n in os.listdir(directorio) if n.endswith('.zip')] if os.path.isdir(directorio) else []
+    if existentes:
+        return os.path.join(directorio, existentes[0])
+    os.makedirs(directorio, exist_ok=True)
+    inicio = time.perf_counter()
+    ruta = generar_propuesta_zip(tipo, directorio, filas, seed=args.seed,
+                                 duplicadas=args.duplicates, car_invalidos=args.malformed_car)
+    print(f"  (propuesta de {tipo} con {filas:,} filas generada en {time.perf_counter() - inicio:.1f}s: {ruta})")
+    return ruta
+
+
+def preparar_bd(db_url):
+    from sqlalchemy import text
+    from app.db import get_engine
+    with get_engine(db_url).begin() as connection:
+        connection.execute(text(f"DROP SCHEMA IF EXISTS {ESQUEMA} CASCADE"))
+        connection.execute(text(f"CREATE SCHEMA {ESQUEMA}"))
+        for tabla, columnas in DDL_SIRE.items():
+            connection.execute(text(f"CREATE TABLE {ESQUEMA}.{tabla} ({columnas})"))
+
+
+def vaciar(db_url, tabla):
+    from sqlalchemy import text
+    from app.db import get_engine
+    with get_engine(db_url).begin() as connection:
+        connection.execute(text(f"TRUNCATE {ESQUEMA}.{tabla}"))
+
+
+def eliminar_bd(db_url):
+    from sqlalchemy import text
+    from app.db import get_engine
+    with get_engine(db_url).begin() as connection:
+        connection.execute(text(f"DROP SCHEMA IF EXISTS {ESQUEMA} CASCADE"))
+
+
+def bench_sire(args, resultados, tipo, filas):
+    from app.etl_pipelines.sire_common import LectorArrow, Loader
+
+    modulo, mapeo, tabla, claves = PIPELINES_SIRE[tipo]
+    pipeline = importlib.import_module(modulo)
+    Extractor, Transformer = pipeline.Extractor, pipeline.Transformer
+    ruta = propuesta(args, tipo, filas)
+    grupo = f"{tipo}-{filas}"
+    tamano = os.path.getsize(ruta)
+
+    segundos, df = medir(lambda: pd.concat(Extractor.extract_files([ruta]), ignore_index=True), args.repeat)
+    resultados.agregar(grupo, 'extract pandas', segundos, len(df), tamano)
+    if args.pyarrow:
+        lector = LectorArrow(mapeo, Transformer.COLUMNAS_VALOR)
+        segundos, df_arrow = medir(lambda: pd.concat(Extractor.extract_files([ruta], lector=lector), ignore_index=True), args.repeat)
+        resultados.agregar(grupo, 'extract pyarrow', segundos, len(df_arrow), tamano)
+        del df_arrow
+
+    clasico = lambda entrada: Transformer.filter_final_columns(Transformer.transform_data(Transformer.rename_columns(entrada, mapeo)))
+    segundos, df_final = medir(clasico, args.repeat, preparar=df.copy)
+    resultados.agregar(grupo, 'transform classic', segundos, len(df), filas_salida=len(df_final))
+    segundos, df_final = medir(lambda entrada: Transformer.transform_fused(entrada, mapeo), args.repeat, preparar=df.copy)
+    resultados.agregar(grupo, 'transform fused', segundos, len(df), filas_salida=len(df_final))
+    del df
+
+    if not args.db_url:
+        return
+    loader = Loader(args.db_url, ESQUEMA, tabla, ['cui'], claves)
+
+    def cargar(_=None, df=df_final):
+        loader.load_data_copy(df, on_conflict='nothing')
+        return dict(loader.estadisticas)
+
+    segundos, estadisticas = medir(cargar, args.repeat, preparar=lambda: vaciar(args.db_url, tabla))
+    resultados.agregar(grupo, 'load copy (tabla vacía)', segundos, len(df_final), **estadisticas)
+    # Reproceso de la misma propuesta: todas las claves ya existen y ON CONFLICT las descarta
+    segundos, estadisticas = medir(cargar, args.repeat)
+    resultados.agregar(grupo, 'load copy (ya cargadas)', segundos, len(df_final), **estadisticas)
+    del df_final, cargar
+
+    configuraciones = [('pandas', 'classic')] + ([('pyarrow', 'fused')] if args.pyarrow else [])
+    for motor, transformacion in configuraciones:
+        etl = pipeline.ETLSIRE(args.db_url, ESQUEMA, tabla, mapeo, load_mode='copy', conflict_columns=['cui'],
+                               key_columns=claves, transform_mode=transformacion, read_engine=motor)
+
+        def punta_a_punta(_):
+            metrics.tomar()
+            etl.run([ruta])
+            return etl.resumen, metrics.tomar()
+
+        segundos, (resumen, mediciones) = medir(punta_a_punta, args.repeat, preparar=lambda: vaciar(args.db_url, tabla))
+        etapas = {}
+        for medicion in mediciones:
+            etapas[medicion.etapa] = round(etapas.get(medicion.etapa, 0.0) + medicion.segundos, 4)
+        resultados.agregar(grupo, f"end-to-end {motor}+{transformacion}", segundos, resumen.filas_extraidas, tamano,
+                           filas_cargadas=resumen.filas_cargadas, filas_rechazadas=resumen.filas_rechazadas,
+                           exito=bool(resumen), etapas=etapas)
+
+
+# --- OneDrive (Graph falso) y S3 (moto) ---
+
+class GraphFalso(ThreadingHTTPServer):
+    """
+    Sirve el listado paginado de Graph (children con @odata.nextLink) para un árbol de carpetas con los items
+    dados y el contenido de cada archivo en /descargas/<id>, como la download URL de OneDrive.
+    """
+
+    daemon_threads = True
+    POR_PAGINA = 200
+    POR_CARPETA = 500
+
+    def __init__(self, items, carpeta, contenido):
+        super().__init__(('127.0.0.1', 0), ManejadorGraph)
+        self.contenido = contenido
+        self.hijos = {'raiz': []}
+        for i in range(0, len(items), self.POR_CARPETA):
+            id_carpeta = f"CARPETA{i // self.POR_CARPETA:05d}"
+            self.hijos['raiz'].append({'id': id_carpeta, 'name': id_carpeta.lower(), 'folder': {'childCount': 0}})
+            self.hijos[id_carpeta] = items[i:i + self.POR_CARPETA]
+        self.carpeta = carpeta
+        self.peticiones = 0
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+
+class ManejadorGraph(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self.server.peticiones += 1
+        url = urlparse(self.path)
+        if url.path.startswith('/descargas/'):
+            return self._responder(self.server.contenido, 'application/octet-stream')
+        # /me/drive/root:/<carpeta>:/children o /me/drive/items/<id>/children
+        id_carpeta = 'raiz' if url.path.startswith('/me/drive/root:') else url.path.split('/')[-2]
+        desde = int(parse_qs(url.query).get('skip', ['0'])[0])
+        hijos = self.server.hijos.get(id_carpeta, [])
+        cuerpo = {'value': hijos[desde:desde + self.server.POR_PAGINA]}
+        if desde + self.server.POR_PAGINA < len(hijos):
+            cuerpo['@odata.nextLink'] = f"{self.server.url}{url.path}?skip={desde + self.server.POR_PAGINA}"
+        self._responder(json.dumps(cuerpo).encode(), 'application/json')
+
+    def _responder(self, datos, tipo):
+        self.send_response(200)
+        self.send_header('Content-Type', tipo)
+        self.send_header('Content-Length', str(len(datos)))
+        self.end_headers()
+        self.wfile.write(datos)
+
+    def log_message(self, *args):
+        pass
+
+
+def bench_onedrive(args, resultados):
+    try:
+        from moto import mock_aws
+    except ImportError:
+        print("  (moto no está instalado: se omite el grupo onedrive; pip install moto)")
+        return
+
+    items = generar_listado(args.no_etl_files, proporcion_no_etl=1.0, proporcion_etl=0.0, seed=args.seed)
+    contenido = os.urandom(args.file_kb * 1024)
+    grupo = f"onedrive-{len(items)}"
+    with tempfile.TemporaryDirectory() as tmp, mock_aws():
+        os.environ.update(AWS_ACCESS_KEY_ID='bench', AWS_SECRET_ACCESS_KEY='bench', AWS_DEFAULT_REGION='us-east-1')
+        import main
+        from app.queue_db import queue_db
+        from app.sources import onedrive_client as modulo_onedrive
+        from app.destinations.s3_client import S3KeyManifest, s3_client
+
+        servidor = GraphFalso(items, 'Bench', contenido)
+        threading.Thread(target=servidor.serve_forever, daemon=True).start()
+
+        async def token():
+            return 'token-bench'
+
+        cliente = modulo_onedrive.onedrive_client
+        modulo_onedrive.GRAPH_API_URL = servidor.url
+        cliente.token_manager.get_token_async = token
+        cliente.get_download_url = lambda file_id: f"{servidor.url}/descargas/{file_id}"
+        queue_db.db_path = os.path.join(tmp, 'queue.db')
+        s3_client._s3, s3_client.bucket = None, 'bench-sunat'
+        s3_client._manifest = S3KeyManifest(db_path=os.path.join(tmp, 's3_manifest.db'))
+        s3_client.s3.create_bucket(Bucket=s3_client.bucket)
+
+        try:
+            segundos, stats = medir(lambda: asyncio.run(main.phase_1_scan_and_classify('Bench')))
+            resultados.agregar(grupo, 'phase 1 scan (fake Graph)', segundos, stats['listados'],
+                               encolados=stats['no_etl'], peticiones=servidor.peticiones)
+            metrics.tomar()
+            segundos, stats = medir(lambda: asyncio.run(main.phase_2_process_queue()))
+            subidos = sum(m.bytes_leidos for m in metrics.tomar() if m.etapa == 'upload' and m.exito)
+            resultados.agregar(grupo, 'phase 2 NO ETL -> S3 (moto)', segundos, stats['completadas'], subidos,
+                               fallidas=stats['fallidas'])
+        finally:
+            servidor.shutdown()
+
+
+# --- Comparación ---
+
+def comparar(resultados, ruta_anterior):
+    with open(ruta_anterior, encoding='utf-8') as f:
+        anterior = json.load(f)
+    previos = {caso['caso']: caso for caso in anterior['casos']}
+    print(f"\nComparación con {os.path.basename(ruta_anterior)} (commit {anterior['meta'].get('commit')}):")
+    print(f"  {'caso':<46}{'antes':>11}{'ahora':>11}{'cambio':>10}")
+    for caso in resultados.casos:
+        previo = previos.get(caso['caso'])
+        if previo is None:
+            print(f"  {caso['caso']:<46}{'-':>11}{caso['segundos']:>10.3f}s{'nuevo':>10}")
+            continue
+        cambio = (caso['segundos'] / previo['segundos'] - 1) * 100 if previo['segundos'] else 0.0
+        print(f"  {caso['caso']:<46}{previo['segundos']:>10.3f}s{caso['segundos']:>10.3f}s{cambio:>+9.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=cantidad, nargs='+', default=[10_000, 100_000],
+                        help='Filas por propuesta (admite k y M: 10k, 5M)')
+    parser.add_argument('--tipo', nargs='+', choices=tuple(PIPELINES_SIRE), default=list(PIPELINES_SIRE))
+    parser.add_argument('--duplicates', type=float, default=0.02, help='Fracción de filas repetidas')
+    parser.add_argument('--malformed-car', type=float, default=0.01, help='Fracción de filas con CAR SUNAT mal formado')
+    parser.add_argument('--listing', type=cantidad, default=100_000, help='Nombres del listado para el clasificador')
+    parser.add_argument('--no-etl-files', type=cantidad, default=300, help='Archivos NO ETL en el Graph falso')
+    parser.add_argument('--file-kb', type=int, default=64, help='Tamaño de cada archivo NO ETL')
+    parser.add_argument('--db-url', default=os.getenv('BENCH_DB_URL'),
+                        help=f"PostgreSQL de pruebas para Loader y punta a punta (esquema {ESQUEMA}); por defecto BENCH_DB_URL")
+    parser.add_argument('--repeat', type=int, default=1, help='Corridas por caso; se informa la mejor')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--skip', nargs='+', choices=('classifier', 'sire', 'onedrive'), default=[])
+    parser.add_argument('--data-dir', default=os.path.join(tempfile.gettempdir(), 'bench_sunat'),
+                        help='Caché de las propuestas generadas')
+    parser.add_argument('--output', help='Archivo de resultados (por defecto benchmarks/results/<fecha>-<commit>.json)')
+    parser.add_argument('--compare', metavar='ANTERIOR.json', help='Resultado anterior con el que comparar')
+    args = parser.parse_args()
+    args.pyarrow = importlib.util.find_spec('pyarrow') is not None
+
+    argumentos = {k: v for k, v in vars(args).items() if k not in ('db_url', 'output', 'compare', 'data_dir')}
+    argumentos['db'] = bool(args.db_url)
+    resultados = Resultados(argumentos)
+    print(f"Commit {resultados.meta['commit']} | Python {resultados.meta['python']} | pandas {resultados.meta['pandas']}"
+          f" | pyarrow {resultados.meta['pyarrow']} | {resultados.meta['cpus']} CPU")
+    print(f"  {'caso':<46}{'tiempo':>11}{'filas':>12}{'filas/s':>14}")
+
+    if 'classifier' not in args.skip:
+        bench_clasificador(args, resultados)
+    if 'sire' not in args.skip:
+        if not args.db_url:
+            print("  (sin --db-url ni BENCH_DB_URL: se omiten Loader y punta a punta)")
+        else:
+            preparar_bd(args.db_url)
+        try:
+            for tipo in args.tipo:
+                for filas in args.rows:
+                    bench_sire(args, resultados, tipo, filas)
+        finally:
+            if args.db_url:
+                eliminar_bd(args.db_url)
+    if 'onedrive' not in args.skip:
+        bench_onedrive(args, resultados)
+
+    salida = args.output or os.path.join(RAIZ, 'benchmarks', 'results',
+                                         f"{time.strftime('%Y%m%d-%H%M%S')}-{resultados.meta['commit']}.json")
+    print(f"\nResultados guardados en {resultados.guardar(salida)}")
+    if args.compare:
+        comparar(resultados, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Benchmark de la transformación de SIRE Compras/Ventas: modo clásico (rename_columns + transform_data
++ filter_final_columns) contra la pasada fusionada (Transformer.transform_fused).
+
+Genera una propuesta sintética (benchmarks/synthetic.py), la extrae una vez y mide para cada modo
+el tiempo (mejor de --repeat) y el pico de memoria asignada durante la transformación (tracemalloc,
+en una corrida aparte porque el rastreo encarece cada asignación). Antes de medir verifica que ambos
+modos produzcan el mismo resultado; las fechas se comparan contra el formato SIRE dd/mm/aaaa,
+ya que el modo clásico infiere el formato a partir del primer valor.
+
+Uso:
+    python benchmarks/bench_transform.py [--tipo compras|ventas] [--rows 1000000] [--repeat 3]
+"""
+
+import argparse
+import gc
+import logging
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.config import COLUMN_MAPPING_COMPRAS, COLUMN_MAPPING_VENTAS  # noqa: E402
+from app.etl_pipelines import sire_compras_etl, sire_ventas_etl  # noqa: E402
+from benchmarks.synthetic import generar_propuesta  # noqa: E402
+
+PIPELINES = {
+    'compras': (sire_compras_etl, COLUMN_MAPPING_COMPRAS),
+    'ventas': (sire_ventas_etl, COLUMN_MAPPING_VENTAS),
+}
+MB = 1024 * 1024
+
+
+def transformar_clasico(modulo, mapping, df):
+    transformer = modulo.Transformer
+    return transformer.filter_final_columns(transformer.transform_data(transformer.rename_columns(df, mapping)))
+
+
+def transformar_fusionado(modulo, mapping, df):
+    return modulo.Transformer.transform_fused(df, mapping)
+
+
+def verificar(modulo, mapping, df_raw, clasico, fusionado):
+    """Compara ambos resultados; retorna cuántas fechas interpretó distinto el modo clásico."""
+    columnas_fecha = [col for col in modulo.Transformer.COLUMNAS_FECHA if col in fusionado.columns]
+    assert list(clasico.columns) == list(fusionado.columns), "Columnas distintas"
+    # replace() del modo clásico reduce a float64 las columnas de texto que quedan enteramente vacías;
+    # en la carga ambas representaciones son NULL, así que de esas solo se comprueba que estén vacías
+    vacias = [col for col in clasico.columns if clasico[col].isna().all()]
+    assert fusionado[vacias].isna().all().all(), "Columnas vacías con valores en el modo fusionado"
+    otras = [col for col in clasico.columns if col not in columnas_fecha and col not in vacias]
+    pd.testing.assert_frame_equal(clasico[otras], fusionado[otras])
+
+    origen = {destino: raw for raw, destino in mapping.items()}
+    diferencias = 0
+    for col in columnas_fecha:
+        assert str(fusionado[col].dtype).startswith('datetime64'), f"{col} debería quedar como datetime64"
+        esperado = pd.to_datetime(df_raw.loc[fusionado.index, origen[col]], format='%d/%m/%Y', errors='coerce')
+        pd.testing.assert_series_equal(fusionado[col], esperado, check_names=False)
+        interpretado = pd.to_datetime(clasico[col])
+        diferencias += int((interpretado.ne(esperado) & ~(interpretado.isna() & esperado.isna())).sum())
+    return diferencias
+
+
+def medir_tiempo(func, repeat):
+    mejor = float('inf')
+    for _ in range(repeat):
+        gc.collect()
+        inicio = time.perf_counter()
+        resultado = func()
+        mejor = min(mejor, time.perf_counter() - inicio)
+        del resultado
+    return mejor
+
+
+def medir_pico(func):
+    gc.collect()
+    tracemalloc.start()
+    resultado = func()
+    _, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del resultado
+    return pico
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tipo', choices=PIPELINES, default='compras')
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--file', help='Propuesta existente (.txt); si se omite se genera una sintética.')
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    modulo, mapping = PIPELINES[args.tipo]
+    with tempfile.TemporaryDirectory() as tmp:
+        ruta = args.file or generar_propuesta(args.tipo, os.path.join(tmp, f'propuesta_{args.tipo}.txt'), args.rows)
+        df_raw = pd.concat(modulo.Extractor.extract_files([ruta]), ignore_index=True)
+    print(f"Propuesta de {args.tipo}: {len(df_raw)} filas x {len(df_raw.columns)} columnas")
+
+    modos = {
+        'clásico': lambda: transformar_clasico(modulo, mapping, df_raw),
+        'fusionado': lambda: transformar_fusionado(modulo, mapping, df_raw),
+    }
+    fechas_distintas = verificar(modulo, mapping, df_raw, modos['clásico'](), modos['fusionado']())
+    print("Equivalencia verificada (columnas, tipos y valores).")
+    if fechas_distintas:
+        print(f"  El modo clásico interpretó {fechas_distintas} fecha(s) con otro formato que dd/mm/aaaa.")
+
+    resultados = {nombre: (medir_tiempo(func, args.repeat), medir_pico(func)) for nombre, func in modos.items()}
+    (t_clasico, m_clasico), (t_fusionado, m_fusionado) = resultados['clásico'], resultados['fusionado']
+    print(f"{'':<12}{'tiempo':>10}{'pico memoria':>16}")
+    for nombre, (segundos, pico) in resultados.items():
+        print(f"{nombre:<12}{segundos:>9.2f}s{pico / MB:>13.0f} MB")
+    print(f"{'mejora':<12}{t_clasico / t_fusionado:>9.1f}x{m_clasico / m_fusionado:>14.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Benchmark del parser de comprobantes UBL (ParserUBL) contra la lectura clásica con ElementTree.parse y
+find() por ruta con prefijos de namespace, sobre un .zip de comprobantes sintéticos leídos sin extraer.
+
+Se informa:
+- documentos por segundo (mejor de --repeat) leyendo los miembros del .zip, con el armado del lote
+  columnar y su conversión a DataFrame (sin base de datos);
+- el pico de memoria (tracemalloc) al parsear un solo documento con cada vez más líneas: el árbol del
+  parser incremental se libera hijo por hijo, así que solo crece lo extraído.
+
+Uso:
+    python benchmarks/bench_xml.py [--docs 10000] [--lines 3] [--repeat 3]
+"""
+
+import argparse
+import io
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from xml.etree import ElementTree
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.synthetic import comprobante_ubl, generar_comprobantes  # noqa: E402
+from app.etl_pipelines.xml_parser_etl import (  # noqa: E402
+    ATRIBUTOS_CABECERA, ATRIBUTOS_LINEA, CAMPOS_CABECERA, CAMPOS_LINEA, COLUMNAS_CABECERA, COLUMNAS_LINEA,
+    ELEMENTOS_LINEA, NS, Extractor, LoteColumnar, ParserUBL, Transformer,
+)
+
+
+def _primero(elem, rutas):
+    for ruta in rutas:
+        encontrado = elem.find(ruta, NS)
+        if encontrado is not None and encontrado.text is not None:
+            return encontrado.text.strip()
+    return None
+
+
+def _primer_atributo(elem, pares):
+    for ruta, atributo in pares:
+        encontrado = elem.find(ruta, NS)
+        if encontrado is not None and atributo in encontrado.attrib:
+            return encontrado.attrib[atributo]
+    return None
+
+
+def parse_arbol(fuente):
+    """Referencia: árbol completo en memoria y un find() por campo, con las mismas rutas que ParserUBL."""
+    raiz = ElementTree.parse(fuente).getroot()
+    cabecera = {'_raiz': raiz.tag}
+    for campo, rutas in CAMPOS_CABECERA.items():
+        if (valor := _primero(raiz, rutas)) is not None:
+            cabecera[campo] = valor
+    for campo, pares in ATRIBUTOS_CABECERA.items():
+        if campo not in cabecera and (valor := _primer_atributo(raiz, pares)) is not None:
+            cabecera[campo] = valor
+    lineas = []
+    for elemento in ELEMENTOS_LINEA:
+        for nodo in raiz.iterfind(elemento, NS):
+            linea = {}
+            for campo, rutas in CAMPOS_LINEA.items():
+                if (valor := _primero(nodo, rutas)) is not None:
+                    linea[campo] = valor
+            for campo, pares in ATRIBUTOS_LINEA.items():
+                if (valor := _primer_atributo(nodo, pares)) is not None:
+                    linea[campo] = valor
+            lineas.append(linea)
+    return cabecera, lineas
+
+
+def procesar(parse, ruta_zip):
+    """Lee todos los miembros, arma los lotes columnares y los convierte a DataFrame. Retorna los DataFrames."""
+    cabeceras, lineas = LoteColumnar(COLUMNAS_CABECERA), LoteColumnar(COLUMNAS_LINEA)
+    for _, nombre, abrir in Extractor.iter_documentos([ruta_zip]):
+        with abrir() as fuente:
+            cabecera, detalle = Transformer.documento(*parse(fuente), nombre, 'factura_xml')
+        cabeceras.agregar(cabecera)
+        for linea in detalle:
+            lineas.agregar(linea)
+    return cabeceras.a_dataframe(), lineas.a_dataframe()
+
+
+def pico_memoria(parse, contenido):
+    tracemalloc.start()
+    parse(io.BytesIO(contenido))
+    _, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return pico
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--docs', type=int, default=10000)
+    parser.add_argument('--lines', type=int, default=3, help='Líneas de detalle por comprobante')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    ubl = ParserUBL()
+    motores = [('ElementTree.parse + find', parse_arbol), ('ParserUBL (incremental)', ubl.parse)]
+    with tempfile.TemporaryDirectory() as tmp:
+        ruta_zip = generar_comprobantes(os.path.join(tmp, 'comprobantes.zip'), args.docs, args.lines)
+        print(f"{args.docs} comprobantes de {args.lines} línea(s) | {os.path.getsize(ruta_zip) / 1024 / 1024:.1f} MB comprimidos")
+
+        resultados = {}
+        for nombre, parse in motores:
+            mejor = float('inf')
+            for _ in range(args.repeat):
+                inicio = time.perf_counter()
+                resultados[nombre] = procesar(parse, ruta_zip)
+                mejor = min(mejor, time.perf_counter() - inicio)
+            print(f"  {nombre:<26}{mejor:>8.2f}s {args.docs / mejor:>10,.0f} docs/s")
+
+        (cab_a, lin_a), (cab_b, lin_b) = resultados.values()
+        iguales = cab_a.equals(cab_b) and lin_a.equals(lin_b)
+        print(f"  Resultados idénticos: {'sí' if iguales else 'NO'}")
+
+    print("\nPico de memoria al parsear un comprobante (tracemalloc):")
+    print(f"  {'líneas':>8}{'tamaño XML':>12}" + ''.join(f"{nombre:>28}" for nombre, _ in motores))
+    for lineas in (10, 1000, 10000):
+        _, contenido = comprobante_ubl(random.Random(0), 0, lineas=lineas)
+        picos = [pico_memoria(parse, contenido) for _, parse in motores]
+        print(f"  {lineas:>8}{len(contenido) / 1024 / 1024:>10.1f}MB" + ''.join(f"{p / 1024 / 1024:>26.1f}MB" for p in picos))
+
+
+if __name__ == '__main__':
+    main()
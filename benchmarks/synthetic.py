@@ -0,0 +1,293 @@
+"""
+Generador de propuestas SIRE sintéticas (Compras y Ventas) y de comprobantes UBL para los benchmarks.
+
+Escribe un .txt separado por '|' con el encabezado y el encoding (latin-1) de las propuestas que
+descarga SUNAT. Los montos, fechas y documentos son aleatorios pero reproducibles (seed); se incluye
+una fracción de campos vacíos y de fechas inválidas para ejercitar las conversiones.
+
+Opcionalmente se repite una fracción de filas tal cual (duplicadas) y se altera el CAR SUNAT de otra
+(vacío, truncado, con espacios o basura), que es lo que filtran los pipelines. generar_propuesta_zip
+empaqueta la propuesta como la entrega SUNAT, con el nombre que reconoce match_file_pattern.
+
+Los comprobantes UBL 2.1 (facturas, boletas y notas de crédito) se escriben como miembros .xml de un .zip,
+con el bloque de firma digital que traen los XML reales. generar_listado arma un listado de OneDrive
+(driveItems) con archivos NO ETL de todos los patrones, propuestas y nombres que no coinciden con ninguno.
+
+Uso:
+    python benchmarks/synthetic.py compras /tmp/propuesta.txt [--rows 1000000]
+    python benchmarks/synthetic.py ventas /tmp/propuestas/ --zip [--rows 100000] [--duplicates 0.02] [--malformed-car 0.01]
+    python benchmarks/synthetic.py ubl /tmp/comprobantes.zip [--rows 10000]
+"""
+
+import argparse
+import base64
+import io
+import os
+import random
+import zipfile
+
+ENCABEZADO_COMPRAS = [
+    'RUC', 'Apellidos y Nombres o Razón social', 'Periodo', 'CAR SUNAT', 'Fecha de emisión',
+    'Fecha Vcto/Pago', 'Tipo CP/Doc.', 'Serie del CDP', 'Año', 'Nro CP o Doc. Nro Inicial (Rango)',
+    'Nro Final (Rango)', 'Tipo Doc Identidad', 'Nro Doc Identidad', 'Apellidos Nombres/ Razón Social',
+    'BI Gravado DG', 'IGV / IPM DG', 'BI Gravado DGNG', 'IGV / IPM DGNG', 'BI Gravado DNG', 'IGV / IPM DNG',
+    'Valor Adq. NG', 'ISC', 'ICBPER', 'Otros Trib/ Cargos', 'Total CP', 'Moneda', 'Tipo de Cambio',
+    'Fecha Emisión Doc Modificado', 'Tipo CP Modificado', 'Serie CP Modificado', 'COD. DAM O DSI',
+    'Nro CP Modificado', 'Detracción',
+]
+
+ENCABEZADO_VENTAS = [
+    'Ruc', 'Razon Social', 'Periodo', 'CAR SUNAT', 'Fecha de emisión', 'Fecha Vcto/Pago', 'Tipo CP/Doc.',
+    'Serie del CDP', 'Nro CP o Doc. Nro Inicial (Rango)', 'Nro Final (Rango)', 'Tipo Doc Identidad',
+    'Nro Doc Identidad', 'Apellidos Nombres/ Razón Social', 'Valor Facturado Exportación', 'BI Gravada',
+    'Dscto BI', 'IGV / IPM', 'Dscto IGV / IPM', 'Mto Exonerado', 'Mto Inafecto', 'ISC', 'BI Grav IVAP',
+    'IVAP', 'ICBPER', 'Otros Tributos', 'Total CP', 'Moneda', 'Tipo Cambio', 'Fecha Emisión Doc Modificado',
+    'Tipo CP Modificado', 'Serie CP Modificado', 'Nro CP Modificado', 'ID Proyecto Operadores Atribución',
+    'Tipo de Nota', 'Est. Comp', 'Valor FOB Embarcado', 'Valor OP Gratuitas', 'Tipo Operación', 'DAM / CP', 'CLU',
+]
+
+
+def _fecha(rnd, periodo):
+    """Fecha dd/mm/aaaa del periodo; ~1% vacías y ~0.1% inválidas."""
+    r = rnd.random()
+    if r < 0.01:
+        return ''
+    if r < 0.011:
+        return '31/02/' + periodo[:4]
+    return f"{rnd.randint(1, 28):02d}/{periodo[4:]}/{periodo[:4]}"
+
+
+def _monto(rnd, probabilidad):
+    return f"{rnd.uniform(1, 5000):.2f}" if rnd.random() < probabilidad else ''
+
+
+def _fila_compras(rnd, i, ruc, periodo):
+    proveedor = str(20100000000 + rnd.randint(0, 99999))
+    serie = f"F{rnd.randint(0, 999):03d}"
+    correlativo = str(i + 1)
+    bi_dg, bi_dgng, bi_dng = _monto(rnd, 0.8), _monto(rnd, 0.1), _monto(rnd, 0.1)
+    igv = lambda bi: f"{float(bi) * 0.18:.2f}" if bi else ''
+    return [
+        ruc, 'EMPRESA SAC', periodo, proveedor + '01' + serie + correlativo.zfill(10), _fecha(rnd, periodo),
+        _fecha(rnd, periodo) if rnd.random() < 0.3 else '', '01', serie, periodo[:4], correlativo,
+        '', '6', proveedor, 'PROVEEDOR SAC', bi_dg, igv(bi_dg), bi_dgng, igv(bi_dgng), bi_dng, igv(bi_dng),
+        _monto(rnd, 0.15), _monto(rnd, 0.02), _monto(rnd, 0.05), _monto(rnd, 0.05), '', 'PEN', '', '', '', '', '', '',
+        'D' if rnd.random() < 0.05 else '',
+    ]
+
+
+def _fila_ventas(rnd, i, ruc, periodo):
+    cliente = str(10400000000 + rnd.randint(0, 999999))
+    tipo_cp = rnd.choice(['01', '01', '03', '07'])
+    serie = ('F' if tipo_cp == '01' else 'B') + f"{rnd.randint(0, 99):03d}"
+    correlativo = str(i + 1)
+    bi = _monto(rnd, 0.85)
+    return [
+        ruc, 'EMPRESA SAC', periodo, (ruc + tipo_cp + serie + correlativo.zfill(10))[:27], _fecha(rnd, periodo),
+        '', tipo_cp, serie, correlativo, '', rnd.choice(['1', '6', '-']), cliente, 'CLIENTE', _monto(rnd, 0.05),
+        bi, '', f"{float(bi) * 0.18:.2f}" if bi else '', '', _monto(rnd, 0.1), _monto(rnd, 0.05), '', '', '',
+        _monto(rnd, 0.02), _monto(rnd, 0.05), '', 'PEN', '', '', '', '', '', '', '', '1', '', '', '0101', '', '',
+    ]
+
+
+def _car_invalido(rnd, car):
+    """Variantes de CAR SUNAT mal formado que aparecen en propuestas reales o editadas a mano."""
+    return rnd.choice(['', car[:-1], car + ' ', ' ' + car[1:], 'SIN CAR', car[:10]])
+
+
+def _escribir_propuesta(tipo, salida, filas, ruc, periodo, seed, duplicadas, car_invalidos):
+    rnd = random.Random(seed)
+    encabezado, fila = (ENCABEZADO_COMPRAS, _fila_compras) if tipo == 'compras' else (ENCABEZADO_VENTAS, _fila_ventas)
+    salida.write('|'.join(encabezado) + '\n')
+    anterior = None
+    for i in range(filas):
+        # Las fracciones se sortean solo si se pidieron: con 0 la salida es idéntica a la de siempre
+        if duplicadas and anterior and rnd.random() < duplicadas:
+            salida.write(anterior)
+            continue
+        valores = fila(rnd, i, ruc, periodo)
+        if car_invalidos and rnd.random() < car_invalidos:
+            valores[3] = _car_invalido(rnd, valores[3])
+        anterior = '|'.join(valores) + '\n'
+        salida.write(anterior)
+
+
+def generar_propuesta(tipo, ruta, filas, ruc='20614301172', periodo='202510', seed=0,
+                      duplicadas=0.0, car_invalidos=0.0):
+    """
+    Escribe una propuesta sintética de `filas` filas en `ruta`; `duplicadas` y `car_invalidos` son las
+    fracciones de filas repetidas y con CAR SUNAT mal formado. Retorna la ruta.
+    """
+    with open(ruta, 'w', encoding='latin-1', newline='') as salida:
+        _escribir_propuesta(tipo, salida, filas, ruc, periodo, seed, duplicadas, car_invalidos)
+    return ruta
+
+
+def nombre_propuesta(tipo, ruc='20614301172', periodo='202510', seed=0):
+    """Nombre sin extensión con que SUNAT entrega la propuesta (compras o ventas) de `periodo`."""
+    if tipo == 'compras':
+        return f"{ruc}-{periodo}{10 + seed % 18:02d}-{123456 + seed}-propuesta"
+    return f"LE{ruc}{periodo}00{1400 + seed}EXP2"
+
+
+def generar_propuesta_zip(tipo, directorio, filas, ruc='20614301172', periodo='202510', seed=0,
+                          duplicadas=0.0, car_invalidos=0.0):
+    """Como generar_propuesta, pero comprimida en `directorio` con el nombre de SUNAT. Retorna la ruta del .zip."""
+    nombre = nombre_propuesta(tipo, ruc, periodo, seed)
+    ruta = os.path.join(directorio, nombre + '.zip')
+    with zipfile.ZipFile(ruta, 'w', zipfile.ZIP_DEFLATED) as zip_ref, zip_ref.open(nombre + '.txt', 'w') as miembro, \
+            io.TextIOWrapper(miembro, encoding='latin-1', newline='') as salida:
+        _escribir_propuesta(tipo, salida, filas, ruc, periodo, seed, duplicadas, car_invalidos)
+    return ruta
+
+
+RAIZ_UBL = {
+    'Invoice': 'urn:oasis:names:specification:ubl:schema:xsd:Invoice-2',
+    'CreditNote': 'urn:oasis:names:specification:ubl:schema:xsd:CreditNote-2',
+}
+ESPACIOS_UBL = (
+    'xmlns:cac="urn:oasis:names:specification:ubl:schema:xsd:CommonAggregateComponents-2" '
+    'xmlns:cbc="urn:oasis:names:specification:ubl:schema:xsd:CommonBasicComponents-2" '
+    'xmlns:ds="http://www.w3.org/2000/09/xmldsig#" '
+    'xmlns:ext="urn:oasis:names:specification:ubl:schema:xsd:CommonExtensionComponents-2"'
+)
+
+
+def _linea_ubl(rnd, raiz, n):
+    elemento, cantidad = ('InvoiceLine', 'InvoicedQuantity') if raiz == 'Invoice' else ('CreditNoteLine', 'CreditedQuantity')
+    unidades = rnd.randint(1, 20)
+    precio = rnd.uniform(1, 500)
+    valor = unidades * precio
+    return (
+        f'<cac:{elemento}><cbc:ID>{n}</cbc:ID><cbc:{cantidad} unitCode="NIU">{unidades}</cbc:{cantidad}>'
+        f'<cbc:LineExtensionAmount currencyID="PEN">{valor:.2f}</cbc:LineExtensionAmount>'
+        f'<cac:PricingReference><cac:AlternativeConditionPrice><cbc:PriceAmount currencyID="PEN">{precio * 1.18:.2f}</cbc:PriceAmount>'
+        f'<cbc:PriceTypeCode>01</cbc:PriceTypeCode></cac:AlternativeConditionPrice></cac:PricingReference>'
+        f'<cac:TaxTotal><cbc:TaxAmount currencyID="PEN">{valor * 0.18:.2f}</cbc:TaxAmount><cac:TaxSubtotal>'
+        f'<cbc:TaxableAmount currencyID="PEN">{valor:.2f}</cbc:TaxableAmount><cbc:TaxAmount currencyID="PEN">{valor * 0.18:.2f}</cbc:TaxAmount>'
+        f'<cac:TaxCategory><cbc:Percent>18.00</cbc:Percent><cbc:TaxExemptionReasonCode>10</cbc:TaxExemptionReasonCode>'
+        f'<cac:TaxScheme><cbc:ID>1000</cbc:ID><cbc:Name>IGV</cbc:Name><cbc:TaxTypeCode>VAT</cbc:TaxTypeCode></cac:TaxScheme>'
+        f'</cac:TaxCategory></cac:TaxSubtotal></cac:TaxTotal>'
+        f'<cac:Item><cbc:Description><![CDATA[PRODUCTO {rnd.randint(1, 9999)} - DESCRIPCION]]></cbc:Description>'
+        f'<cac:SellersItemIdentification><cbc:ID>P{rnd.randint(1, 9999):05d}</cbc:ID></cac:SellersItemIdentification></cac:Item>'
+        f'<cac:Price><cbc:PriceAmount currencyID="PEN">{precio:.2f}</cbc:PriceAmount></cac:Price></cac:{elemento}>'
+    ), valor
+
+
+def comprobante_ubl(rnd, i, ruc='20614301172', lineas=3):
+    """XML UBL 2.1 de un comprobante (factura, boleta o nota de crédito). Retorna (nombre, bytes)."""
+    tipo = rnd.choice(['01', '01', '03', '07'])
+    raiz = 'CreditNote' if tipo == '07' else 'Invoice'
+    serie = ('F' if tipo in ('01', '07') else 'B') + f"{rnd.randint(0, 99):03d}"
+    numero = f"{serie}-{i + 1}"
+    cliente = str(20100000000 + rnd.randint(0, 99999)) if serie[0] == 'F' else str(40000000 + rnd.randint(0, 9999999))
+    detalle, total = zip(*(_linea_ubl(rnd, raiz, n + 1) for n in range(lineas)))
+    valor = sum(total)
+    firma = base64.b64encode(rnd.randbytes(256)).decode()
+    certificado = base64.b64encode(rnd.randbytes(1200)).decode()
+    cabecera_tipo = (
+        f'<cbc:InvoiceTypeCode listID="0101">{tipo}</cbc:InvoiceTypeCode>' if raiz == 'Invoice' else
+        f'<cac:DiscrepancyResponse><cbc:ReferenceID>F001-{rnd.randint(1, 999)}</cbc:ReferenceID>'
+        f'<cbc:ResponseCode>01</cbc:ResponseCode><cbc:Description>ANULACION</cbc:Description></cac:DiscrepancyResponse>'
+        f'<cac:BillingReference><cac:InvoiceDocumentReference><cbc:ID>F001-{rnd.randint(1, 999)}</cbc:ID>'
+        f'<cbc:DocumentTypeCode>01</cbc:DocumentTypeCode></cac:InvoiceDocumentReference></cac:BillingReference>'
+    )
+    xml = (
+        f'<?xml version="1.0" encoding="UTF-8"?>\n<{raiz} xmlns="{RAIZ_UBL[raiz]}" {ESPACIOS_UBL}>'
+        f'<ext:UBLExtensions><ext:UBLExtension><ext:ExtensionContent><ds:Signature Id="SignSUNAT"><ds:SignedInfo>'
+        f'<ds:CanonicalizationMethod Algorithm="http://www.w3.org/TR/2001/REC-xml-c14n-20010315"/>'
+        f'<ds:Reference URI=""><ds:DigestValue>{firma[:44]}</ds:DigestValue></ds:Reference></ds:SignedInfo>'
+        f'<ds:SignatureValue>{firma}</ds:SignatureValue><ds:KeyInfo><ds:X509Data><ds:X509Certificate>{certificado}'
+        f'</ds:X509Certificate></ds:X509Data></ds:KeyInfo></ds:Signature></ext:ExtensionContent></ext:UBLExtension></ext:UBLExtensions>'
+        f'<cbc:UBLVersionID>2.1</cbc:UBLVersionID><cbc:CustomizationID>2.0</cbc:CustomizationID><cbc:ID>{numero}</cbc:ID>'
+        f'<cbc:IssueDate>2025-10-{rnd.randint(1, 28):02d}</cbc:IssueDate><cbc:IssueTime>12:00:00</cbc:IssueTime>'
+        f'{cabecera_tipo}<cbc:DocumentCurrencyCode>PEN</cbc:DocumentCurrencyCode>'
+        f'<cac:Signature><cbc:ID>{ruc}</cbc:ID><cac:SignatoryParty><cac:PartyIdentification><cbc:ID>{ruc}</cbc:ID>'
+        f'</cac:PartyIdentification></cac:SignatoryParty></cac:Signature>'
+        f'<cac:AccountingSupplierParty><cac:Party><cac:PartyIdentification><cbc:ID schemeID="6">{ruc}</cbc:ID></cac:PartyIdentification>'
+        f'<cac:PartyLegalEntity><cbc:RegistrationName><![CDATA[EMPRESA SAC]]></cbc:RegistrationName></cac:PartyLegalEntity></cac:Party></cac:AccountingSupplierParty>'
+        f'<cac:AccountingCustomerParty><cac:Party><cac:PartyIdentification><cbc:ID schemeID="{"6" if len(cliente) == 11 else "1"}">{cliente}</cbc:ID></cac:PartyIdentification>'
+        f'<cac:PartyLegalEntity><cbc:RegistrationName><![CDATA[CLIENTE {i}]]></cbc:RegistrationName></cac:PartyLegalEntity></cac:Party></cac:AccountingCustomerParty>'
+        f'<cac:TaxTotal><cbc:TaxAmount currencyID="PEN">{valor * 0.18:.2f}</cbc:TaxAmount></cac:TaxTotal>'
+        f'<cac:LegalMonetaryTotal><cbc:LineExtensionAmount currencyID="PEN">{valor:.2f}</cbc:LineExtensionAmount>'
+        f'<cbc:TaxInclusiveAmount currencyID="PEN">{valor * 1.18:.2f}</cbc:TaxInclusiveAmount>'
+        f'<cbc:PayableAmount currencyID="PEN">{valor * 1.18:.2f}</cbc:PayableAmount></cac:LegalMonetaryTotal>'
+        f'{"".join(detalle)}</{raiz}>'
+    )
+    return f"{ruc}-{tipo}-{numero}.xml", xml.encode('utf-8')
+
+
+def generar_comprobantes(ruta, documentos, lineas=3, ruc='20614301172', seed=0):
+    """Escribe un .zip con `documentos` comprobantes UBL de `lineas` líneas cada uno. Retorna la ruta."""
+    rnd = random.Random(seed)
+    with zipfile.ZipFile(ruta, 'w', zipfile.ZIP_DEFLATED) as zip_ref:
+        for i in range(documentos):
+            nombre, contenido = comprobante_ubl(rnd, i, ruc, lineas)
+            zip_ref.writestr(nombre, contenido)
+    return ruta
+
+
+# Nombres NO ETL por patrón ({ruc}, {ts}: aaaammddhhmmss, {n}: número de 9 dígitos)
+PLANTILLAS_NO_ETL = [
+    "reporteec_ficharuc_{ruc}_{ts}.pdf",
+    "ridetrac_{ruc}_0230050{n6}_{ts}_{n}.pdf",
+    "rilf_{ruc}_0230050{n6}_{ts}_{n}.pdf",
+    "rmgen_{ruc}_023-002-0{n6}_{ts}_{n}.pdf",
+    "constancia_{ts}_00000000000{n}_0230050{n6}_{n}.pdf",
+    "rvalores_{ruc}_ABC{n}_{ts}_{n}.pdf",
+    "recgen_{ruc}_0230050{n6}_{ts}_{n}.pdf",
+    "reporteec_reportetrieeff_{ruc}_{ts}.pdf",
+    "reporteec_rentas_{ruc}_{ts}.pdf",
+    "PDF-DOC-F001-{n6}{ruc}.pdf",
+    "PDF-BOLETAB001-{n6}{ruc}.pdf",
+    "RHE{ruc}E001{n6}.pdf",
+    "{ruc}-09-EG07-{n6}.pdf",
+]
+# Archivos que conviven en las carpetas y no coinciden con ningún patrón
+PLANTILLAS_OTROS = ["Informe {n}.docx", "foto_{n}.jpg", "paquete_{n}.zip", "notas_{n}.txt", "{ruc}_{n}.xlsx"]
+
+
+def generar_listado(items, proporcion_no_etl=0.7, proporcion_etl=0.05, rucs=50, seed=0):
+    """
+    Listado de OneDrive sintético: driveItems ({'id', 'name', 'size', 'file'}) con `proporcion_no_etl` de
+    archivos NO ETL, `proporcion_etl` de propuestas SIRE y el resto sin patrón. Los nombres no se repiten.
+    """
+    rnd = random.Random(seed)
+    lista_rucs = [str(20100000000 + rnd.randint(0, 99999999)) for _ in range(rucs)]
+    listado = []
+    for i in range(items):
+        r = rnd.random()
+        valores = {'ruc': rnd.choice(lista_rucs), 'n': f"{i:09d}", 'n6': f"{i % 1000000:06d}",
+                   'ts': f"2025{rnd.randint(1, 12):02d}{rnd.randint(1, 28):02d}{i % 1000000:06d}"}
+        if r < proporcion_no_etl:
+            nombre = rnd.choice(PLANTILLAS_NO_ETL).format(**valores)
+        elif r < proporcion_no_etl + proporcion_etl:
+            nombre = nombre_propuesta(rnd.choice(['compras', 'ventas']), valores['ruc'], seed=i) + '.zip'
+        else:
+            nombre = rnd.choice(PLANTILLAS_OTROS).format(**valores)
+        listado.append({'id': f"ITEM{i:09d}", 'name': nombre, 'size': rnd.randint(20_000, 400_000), 'file': {}})
+    return listado
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('tipo', choices=('compras', 'ventas', 'ubl'))
+    parser.add_argument('ruta')
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--zip', action='store_true', help='Propuesta comprimida con el nombre de SUNAT; ruta es un directorio')
+    parser.add_argument('--duplicates', type=float, default=0.0, help='Fracción de filas repetidas')
+    parser.add_argument('--malformed-car', type=float, default=0.0, help='Fracción de filas con CAR SUNAT mal formado')
+    args = parser.parse_args()
+    if args.tipo == 'ubl':
+        generar_comprobantes(args.ruta, args.rows, seed=args.seed)
+        print(f"{args.rows} comprobantes UBL sintéticos escritos en {args.ruta}")
+        return
+    generar = generar_propuesta_zip if args.zip else generar_propuesta
+    ruta = generar(args.tipo, args.ruta, args.rows, seed=args.seed,
+                   duplicadas=args.duplicates, car_invalidos=args.malformed_car)
+    print(f"Propuesta sintética de {args.tipo} con {args.rows} filas escrita en {ruta}")
+
+
+if __name__ == '__main__':
+    main()
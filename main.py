@@ -4,23 +4,21 @@ Orquestador principal para ETL de documentos SUNAT.
 Permite ejecución desde OneDrive (por defecto) o desde un path local mediante argumentos.
 """
 
-import asyncio
 import logging
-import sys
 import os
-import tempfile
-import zipfile
-import rarfile
 import argparse
+from typing import TYPE_CHECKING, List, Optional
 
-from app.config import config, match_file_pattern
-from app.queue_db import queue_db
-from app.sources.onedrive_client import onedrive_client
-from app.destinations.s3_client import s3_client
-from app.destinations.postgres_client import postgres_client
-from app.etl_pipelines.sire_compras_etl import run_sire_compras_etl
-from app.etl_pipelines.sire_ventas_etl import run_sire_ventas_etl
-from app.etl_pipelines.xml_parser_etl import process_xml
+# Solo dependencias livianas a nivel de módulo: cada flujo importa lo que usa (pandas, boto3, msal, ...)
+# dentro de sus funciones, así `--help` o un subcomando local no pagan el arranque de los demás.
+from app.config import (
+    config, match_file_pattern, extract_ruc, ARCHIVE_EXTENSIONS,
+    LOAD_MODES, ON_CONFLICT_POLICIES, READ_ENGINES, TRANSFORM_MODES,
+)
+from app.metrics import metrics
+
+if TYPE_CHECKING:
+    from app.etl_pipelines.sire_common import ResumenETL
 
 # Configurar logging
 logging.basicConfig(
@@ -33,23 +31,165 @@ logger = logging.getLogger(__name__)
 
 # --- Lógica para ejecución desde OneDrive (Flujo Asíncrono) ---
 
-async def run_onedrive_flow():
+
+def _new_scan_stats() -> dict:
+    return {'listados': 0, 'need_etl': 0, 'no_etl': 0, 'comprimidos': 0, 'ignorados': 0, 'ya_en_cola': 0,
+            'modificados': 0, 'eliminados': 0, 'carpetas_fallidas': 0}
+
+
+def _classify_and_enqueue(item: dict, en_cola: dict, stats: dict, lote: list, modificados: list) -> None:
+    """
+    Clasifica un item de OneDrive y, si corresponde, lo agrega al lote pendiente de encolar;
+    actualiza los contadores de la fase 1. `en_cola` es {file_id: versión} de los archivos ya encolados:
+    uno conocido cuya versión (lastModifiedDateTime) cambió va a `modificados` para volver a procesarse.
+    Las tareas encoladas antes de guardar la versión se consideran sin cambios. Los lotes se escriben con
+    _flush_enqueue.
+    """
+    stats['listados'] += 1
+    nombre = item['name']
+    tipo, _, need_etl = match_file_pattern(nombre)
+
+    if tipo is None and not nombre.lower().endswith(ARCHIVE_EXTENSIONS):
+        stats['ignorados'] += 1
+        return
+    version = item.get('lastModifiedDateTime')
+    if item['id'] in en_cola:
+        anterior = en_cola[item['id']]
+        if anterior is not None and version is not None and anterior != version:
+            modificados.append((nombre, item['id'], version))
+            en_cola[item['id']] = version
+            stats['modificados'] += 1
+        else:
+            stats['ya_en_cola'] += 1
+        return
+
+    lote.append((nombre, item['id'], version))
+    en_cola[item['id']] = version
+    if tipo is None:
+        stats['comprimidos'] += 1
+    elif need_etl:
+        stats['need_etl'] += 1
+    else:
+        stats['no_etl'] += 1
+
+
+def _flush_enqueue(lote: list, modificados: list) -> None:
+    """Escribe en la cola los archivos nuevos acumulados en el lote y vuelve a encolar los modificados."""
+    from app.queue_db import queue_db
+    if lote:
+        queue_db.insert_tasks(lote)
+        lote.clear()
+    if modificados:
+        queue_db.requeue_tasks(modificados)
+        modificados.clear()
+
+
+async def phase_1_scan_and_classify(folder_path: str = None, incremental: bool = False, full_resync: bool = False) -> dict:
+    """
+    Fase 1: lista OneDrive y encola cada archivo reconocido a medida que llega.
+    Los comprimidos que no coinciden con ningún patrón también se encolan para inspeccionar su contenido.
+    En modo incremental se usa el endpoint delta y solo se procesan los cambios desde la última ejecución.
+    stats['carpetas_fallidas'] cuenta las carpetas que no se pudieron listar: el escaneo quedó incompleto.
+    """
+    from app.queue_db import queue_db
+    from app.sources.onedrive_client import onedrive_client
+
+    folder_path = folder_path or config.ONEDRIVE_ROOT_FOLDER
+    logger.info(f"Fase 1: escaneo y clasificación de '{folder_path}' (incremental={incremental})")
+    queue_db.create_table()
+    en_cola = queue_db.get_known_file_versions()
+    stats = _new_scan_stats()
+
+    if incremental:
+        await _scan_delta(folder_path, en_cola, stats, full_resync)
+    else:
+        lote, modificados, carpetas_fallidas = [], [], []
+        async for item in onedrive_client.iter_files_async(folder_path, carpetas_fallidas=carpetas_fallidas):
+            _classify_and_enqueue(item, en_cola, stats, lote, modificados)
+            if len(lote) + len(modificados) >= config.QUEUE_INSERT_BATCH_SIZE:
+                _flush_enqueue(lote, modificados)
+        _flush_enqueue(lote, modificados)
+        stats['carpetas_fallidas'] = len(carpetas_fallidas)
+        if carpetas_fallidas:
+            logger.error(f"Escaneo incompleto: no se pudieron listar {len(carpetas_fallidas)} carpeta(s): {carpetas_fallidas}")
+
+    logger.info(f"Fase 1 completada: {stats}")
+    return stats
+
+
+async def _scan_delta(folder_path: str, en_cola: dict, stats: dict, full_resync: bool) -> None:
+    """
+    Escaneo incremental con Graph delta. El delta link se guarda en queue.db solo al terminar
+    de procesar la última página, así una ejecución interrumpida vuelve a pedir los mismos cambios.
+    """
+    from app.queue_db import queue_db
+    from app.sources.onedrive_client import onedrive_client, DeltaTokenExpired
+
+    scope = f"onedrive:{folder_path}"
+    if full_resync:
+        logger.info(f"Re-sincronización completa solicitada: se descarta el delta link de '{scope}'.")
+        queue_db.clear_delta_link(scope)
+    delta_link = queue_db.get_delta_link(scope)
+    if not delta_link:
+        logger.info("Sin delta link guardado: se realizará una sincronización inicial de todo el árbol.")
+
+    try:
+        async for page in onedrive_client.iter_delta_pages_async(folder_path, delta_link):
+            lote, modificados = [], []
+            for item in page['items']:
+                if 'deleted' in item:
+                    stats['eliminados'] += queue_db.mark_deleted(item['id'])
+                elif 'file' in item:
+                    _classify_and_enqueue(item, en_cola, stats, lote, modificados)
+            _flush_enqueue(lote, modificados)
+            if page['delta_link']:
+                queue_db.save_delta_link(scope, page['delta_link'])
+    except DeltaTokenExpired:
+        if not delta_link:
+            raise
+        logger.warning(f"El delta link de '{scope}' expiró; se re-sincroniza desde cero.")
+        await _scan_delta(folder_path, en_cola, stats, full_resync=True)
+
+
+async def phase_2_process_queue(force: bool = False) -> dict:
+    """
+    Fase 2: drena la cola con un pool de workers asíncrono (concurrencia acotada por tipo de tarea,
+    reintentos con backoff exponencial y estado FALLIDO para los archivos que no se pudieron procesar).
+    Con force se reprocesan también los archivos cuyo contenido ya figura en el manifiesto.
+    """
+    from app.queue_db import queue_db
+    from app.workers import WorkerPool
+
+    logger.info("Fase 2: procesamiento de la cola")
+    stats = await WorkerPool(force=force).run()
+    logger.info(f"Estado de la cola al terminar la fase 2: {queue_db.count_by_status()}")
+    return stats
+
+
+async def run_onedrive_flow(incremental: bool = False, full_resync: bool = False, force: bool = False) -> bool:
     """
-    Ejecuta el flujo completo de ETL desde OneDrive.
-    (La implementación detallada de las fases de OneDrive se mantiene como estaba)
+    Ejecuta el flujo completo de ETL desde OneDrive. La fase 2 procesa lo encolado aunque el escaneo haya
+    quedado incompleto; retorna False en ese caso.
     """
     logger.info("Iniciando ETL de documentos SUNAT desde OneDrive")
-    # Aquí iría la lógica de phase_1_scan_and_classify, phase_2_async_processing, etc.
-    # Por simplicidad, se omite en este fragmento, pero debe existir para el flujo de cron.
-    logger.info("El flujo de OneDrive no está completamente implementado en este script de ejemplo.")
-    pass
+    stats = await phase_1_scan_and_classify(incremental=incremental, full_resync=full_resync)
+    await phase_2_process_queue(force=force)
+    # La fase 3 (reporte) aún no está implementada aquí.
+    if stats['carpetas_fallidas']:
+        print(f"❌ Escaneo incompleto: {stats['carpetas_fallidas']} carpeta(s) de OneDrive no se pudieron listar (ver log).")
+        return False
+    return True
 
 
 # --- Lógica para ejecución local (Flujo Síncrono por Lotes) ---
 
-def run_local_flow(pipeline_type: str, path: str, show_preview: bool):
+def run_local_flow(pipeline_type: str, path: str, show_preview: bool,
+                   workers: int = 1, group_by: str = 'ruc', force: bool = False, **opciones_etl):
     """
     Ejecuta un pipeline ETL para un archivo o una carpeta local en modo batch.
+    Con workers > 1 los archivos se reparten (agrupados por RUC o de a uno) en un pool de procesos.
+    Los archivos con el mismo contenido que uno ya procesado (manifiesto SHA-256) se omiten salvo con force.
+    opciones_etl se reenvía tal cual al pipeline (modo de carga, política ON CONFLICT, etc.).
     """
     logger.info(f"Iniciando ETL local en modo batch para '{pipeline_type}' en la ruta: {path}")
 
@@ -81,43 +221,200 @@ def run_local_flow(pipeline_type: str, path: str, show_preview: bool):
         logger.warning(f"No se encontraron archivos del tipo '{expected_tipo}' en la ruta especificada.")
         return
 
-    logger.info(f"Se encontraron {len(files_to_process)} archivo(s) para procesar en lote.")
+    from app.content_manifest import content_manifest
+    encontrados = len(files_to_process)
+    files_to_process, huellas = content_manifest.filtrar(expected_tipo, files_to_process, force=force)
+    if not files_to_process:
+        mensaje = f"Los {encontrados} archivo(s) ya fueron procesados con el mismo contenido; use --force para reprocesarlos."
+        logger.info(mensaje)
+        print(mensaje)
+        return
+
+    logger.info(f"Se encontraron {encontrados} archivo(s); {len(files_to_process)} para procesar en lote.")
 
     try:
-        if pipeline_type == 'sire-compras':
-            run_sire_compras_etl(files_to_process, show_preview=show_preview)
-        elif pipeline_type == 'sire-ventas':
-            run_sire_ventas_etl(files_to_process, show_preview=show_preview)
+        if workers > 1:
+            resumen = _run_parallel_batches(pipeline_type, files_to_process, show_preview, workers, group_by, opciones_etl, huellas)
+        else:
+            resumen = _run_sire_batch(pipeline_type, files_to_process, show_preview, opciones_etl, huellas)
+        metrics.registrar(resumen.metricas)
+        _report_summary(pipeline_type, resumen)
     except Exception as e:
         logger.critical(f"Ocurrió un error fatal durante la ejecución del lote '{pipeline_type}': {e}", exc_info=True)
 
 
+def _run_sire_batch(pipeline_type: str, files: List[str], show_preview: bool, opciones_etl: dict,
+                    huellas: Optional[dict] = None) -> 'ResumenETL':
+    """
+    Ejecuta un lote en el proceso actual. También es el punto de entrada de cada worker del pool.
+    Al terminar registra en el manifiesto de contenido el resultado de los archivos con huella.
+    """
+    if pipeline_type == 'sire-compras':
+        from app.etl_pipelines.sire_compras_etl import run_sire_compras_etl as run_pipeline
+    elif pipeline_type == 'sire-ventas':
+        from app.etl_pipelines.sire_ventas_etl import run_sire_ventas_etl as run_pipeline
+    else:
+        raise ValueError(f"Pipeline no soportado: {pipeline_type}")
+    resumen = run_pipeline(files, show_preview=show_preview, **opciones_etl)
+    if huellas:
+        from app.content_manifest import content_manifest
+        content_manifest.registrar(pipeline_type.replace('-', '_'), {f: huellas[f] for f in files if f in huellas}, resumen)
+    # Las mediciones viajan con el resumen: desde un worker del pool es la única forma de que lleguen al principal
+    resumen.metricas = metrics.tomar()
+    return resumen
+
+
+def _group_files(files: List[str], group_by: str) -> List[List[str]]:
+    """Agrupa los archivos por RUC (un lote por contribuyente) o deja un lote por archivo."""
+    if group_by == 'file':
+        return [[f] for f in files]
+    grupos = {}
+    for f in files:
+        grupos.setdefault(extract_ruc(os.path.basename(f)), []).append(f)
+    return list(grupos.values())
+
+
+def _run_parallel_batches(pipeline_type: str, files: List[str], show_preview: bool,
+                          workers: int, group_by: str, opciones_etl: dict,
+                          huellas: Optional[dict] = None) -> 'ResumenETL':
+    """
+    Reparte los lotes en un ProcessPoolExecutor. Cada worker construye su propio pipeline
+    (y por tanto su propio engine de base de datos); los resúmenes se combinan al terminar.
+    """
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    from app.etl_pipelines.sire_common import ResumenETL
+
+    grupos = _group_files(files, group_by)
+    max_workers = min(workers, len(grupos))
+    logger.info(f"Ejecutando {len(grupos)} lote(s) en {max_workers} proceso(s) (agrupación: {group_by}).")
+
+    resumen = ResumenETL()
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(_run_sire_batch, pipeline_type, grupo, show_preview, opciones_etl, huellas): grupo
+            for grupo in grupos
+        }
+        for future in as_completed(futures):
+            grupo = futures[future]
+            try:
+                resumen = resumen.combinar(future.result())
+            except Exception as e:
+                logger.critical(f"Un worker falló procesando {len(grupo)} archivo(s): {e}", exc_info=True)
+                resumen = resumen.combinar(ResumenETL(exito=False, archivos_fallidos=list(grupo)))
+    return resumen
+
+
+def _report_summary(pipeline_type: str, resumen: 'ResumenETL') -> None:
+    """Registra y muestra el resumen consolidado de la ejecución local."""
+    estado = "OK" if resumen else "CON ERRORES"
+    lineas = [
+        f"=== RESUMEN {pipeline_type.upper()}: {estado} ===",
+        f"Filas extraídas:   {resumen.filas_extraidas}",
+        f"Filas cargadas:    {resumen.filas_cargadas}",
+        f"Filas omitidas:    {resumen.filas_omitidas}",
+        f"Filas rechazadas:  {resumen.filas_rechazadas}",
+        f"Filas eliminadas:  {resumen.filas_eliminadas}",
+        f"Archivos fallidos: {len(resumen.archivos_fallidos)}",
+    ]
+    lineas.extend(f"  - {ruta}" for ruta in resumen.archivos_fallidos)
+    for linea in lineas:
+        logger.info(linea)
+    print("\n".join(lineas))
+
+
+def _report_metrics() -> None:
+    """Exporta las métricas por etapa (JSON lines / Prometheus) y muestra la tabla de fin de ejecución."""
+    try:
+        metrics.exportar()
+    except OSError as e:
+        logger.error(f"No se pudieron exportar las métricas: {e}")
+    lineas = metrics.tabla_resumen()
+    for linea in lineas:
+        logger.info(linea)
+    if lineas:
+        print("\n".join(lineas))
+
+
+def _agregar_opciones_sire(subparser):
+    """Opciones de carga comunes a los subcomandos SIRE."""
+    subparser.add_argument('--load-mode', choices=LOAD_MODES, default='rows',
+                           help="Modo de carga: 'rows' inserta fila por fila; 'copy' usa COPY a una tabla temporal y un único INSERT ... ON CONFLICT; 'diff' compara con el último snapshot cargado del mismo (ruc, periodo) y solo aplica las filas insertadas, cambiadas o eliminadas.")
+    subparser.add_argument('--on-conflict', choices=ON_CONFLICT_POLICIES, default='nothing',
+                           help="Con --load-mode copy: 'nothing' omite filas cuya clave ya existe; 'update' las actualiza.")
+    subparser.add_argument('--dedup', action='store_true',
+                           help='Consulta una vez por (ruc, periodo) las claves ya cargadas y solo envía filas nuevas al destino.')
+    subparser.add_argument('--chunk-rows', type=int, default=None, metavar='N',
+                           help='Procesa en streaming bloques de N filas (extracción, transformación y carga) para acotar la memoria.')
+    subparser.add_argument('--transform-mode', choices=TRANSFORM_MODES, default=None,
+                           help="'fused' convierte cada columna una sola vez y arma el resultado sin copias intermedias (menos tiempo y memoria); 'classic' encadena los pasos originales. Por defecto 'classic', o 'fused' con --read-engine pyarrow.")
+    subparser.add_argument('--read-engine', choices=READ_ENGINES, default='pandas',
+                           help="'pyarrow' lee los .txt SIRE en paralelo con columnas tipadas (montos, fechas, códigos y categorías); requiere pyarrow.")
+    subparser.add_argument('--workers', type=int, default=1, metavar='N',
+                           help='Número de procesos en paralelo; cada uno procesa un lote de archivos con su propia conexión.')
+    subparser.add_argument('--group-by', choices=('ruc', 'file'), default='ruc',
+                           help="Con --workers: 'ruc' envía todos los archivos de un mismo RUC al mismo proceso; 'file' reparte archivo por archivo.")
+    # Sin default propio: el de nivel superior no se pisa y `--force sire-compras ...` también fuerza
+    subparser.add_argument('--force', action='store_true', default=argparse.SUPPRESS,
+                           help='Procesa también los archivos cuyo contenido (SHA-256) ya figura como procesado en el manifiesto '
+                                '(equivale a --force antes del subcomando).')
+
+
+def _opciones_etl(args) -> dict:
+    """Traduce los argumentos de línea de comandos a parámetros del pipeline."""
+    return {
+        'load_mode': args.load_mode,
+        'on_conflict': args.on_conflict,
+        'dedup': args.dedup,
+        'chunk_rows': args.chunk_rows,
+        'transform_mode': args.transform_mode,
+        'read_engine': args.read_engine,
+    }
+
+
 def main():
     """
     Punto de entrada principal.
     Analiza los argumentos para decidir si ejecutar un flujo local o el flujo de OneDrive.
     """
     parser = argparse.ArgumentParser(description="Orquestador de ETL para archivos SUNAT.")
+    parser.add_argument('--incremental', action='store_true',
+                        help='Flujo OneDrive: usa el endpoint delta de Graph y solo procesa los cambios desde la última ejecución.')
+    parser.add_argument('--full-resync', action='store_true',
+                        help='Con --incremental: descarta el delta link guardado y vuelve a recorrer todo el árbol.')
+    parser.add_argument('--force', action='store_true',
+                        help='Procesa también los archivos cuyo contenido (SHA-256) ya figura como procesado en el manifiesto '
+                             '(flujo OneDrive y subcomandos).')
     subparsers = parser.add_subparsers(dest='command', help='Comandos disponibles')
 
     # Subcomando para SIRE Compras local
     parser_compras = subparsers.add_parser('sire-compras', help='Procesa archivos SIRE de compras en una ruta local.')
     parser_compras.add_argument('--path', required=True, help='Ruta a un archivo o carpeta con archivos de SIRE Compras.')
     parser_compras.add_argument('--preview', action='store_true', help='Muestra una vista previa de los datos transformados.')
+    _agregar_opciones_sire(parser_compras)
 
     # Subcomando para SIRE Ventas local
     parser_ventas = subparsers.add_parser('sire-ventas', help='Procesa archivos SIRE de ventas en una ruta local.')
     parser_ventas.add_argument('--path', required=True, help='Ruta a un archivo o carpeta con archivos de SIRE Ventas.')
     parser_ventas.add_argument('--preview', action='store_true', help='Muestra una vista previa de los datos transformados.')
+    _agregar_opciones_sire(parser_ventas)
 
     args = parser.parse_args()
+    if args.command and args.load_mode == 'diff' and (args.chunk_rows or args.dedup):
+        parser.error("--load-mode diff no admite --chunk-rows ni --dedup: compara cada propuesta completa con su último snapshot.")
 
-    if args.command:
-        # Si se proporciona un comando, ejecutar el flujo local y salir.
-        run_local_flow(args.command, args.path, args.preview)
-    else:
-        # Si no hay comandos, ejecutar el flujo normal de OneDrive.
-        asyncio.run(run_onedrive_flow())
+    try:
+        if args.command:
+            # Si se proporciona un comando, ejecutar el flujo local y salir.
+            run_local_flow(args.command, args.path, args.preview,
+                           workers=args.workers, group_by=args.group_by, force=args.force, **_opciones_etl(args))
+        else:
+            # Si no hay comandos, ejecutar el flujo normal de OneDrive.
+            import asyncio
+            if not asyncio.run(run_onedrive_flow(incremental=args.incremental, full_resync=args.full_resync, force=args.force)):
+                raise SystemExit(1)
+    finally:
+        # También si la ejecución se interrumpe: es cuando más interesa saber dónde se fue el tiempo
+        _report_metrics()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file